@@ -1,5 +1,7 @@
 from django.contrib import admin
-from .models import Medico, Consulta
+from .models import Medico, Consulta, ConsultaArquivada, Notificacao
 
 admin.site.register(Medico)
-admin.site.register(Consulta)
\ No newline at end of file
+admin.site.register(Consulta)
+admin.site.register(Notificacao)
+admin.site.register(ConsultaArquivada)
@@ -0,0 +1,96 @@
+from datetime import datetime, timedelta
+
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .cache import invalidar_agenda
+from .disponibilidade import atualizar_disponibilidade
+from .eventos import publicar_agenda
+from .models import Agenda
+
+
+TAMANHO_LOTE = 1000
+# Refazer o lote quando outra requisição cria um dos horários ao mesmo tempo
+TENTATIVAS = 3
+
+
+def gerar_horarios(dias_semana, hora_inicio, hora_fim, duracao, data_inicio, data_fim, excecoes=()):
+    """
+    Gera os pares (dia, horario) de um modelo recorrente.
+
+    `dias_semana` usa a numeração de date.weekday() (segunda = 0) e
+    `duracao` é o tamanho de cada horário em minutos. O último horário do
+    dia é o que ainda termina até `hora_fim`.
+    """
+    dias_semana = set(dias_semana)
+    excecoes = set(excecoes)
+    passo = timedelta(minutes=duracao)
+
+    dia = data_inicio
+    while dia <= data_fim:
+        if dia.weekday() in dias_semana and dia not in excecoes:
+            inicio = datetime.combine(dia, hora_inicio)
+            fim = datetime.combine(dia, hora_fim)
+            while inicio + passo <= fim:
+                yield dia, inicio.time()
+                inicio += passo
+        dia += timedelta(days=1)
+
+
+def _inserir(medico_id, candidatos, data_inicio, data_fim):
+    """
+    Insere os candidatos que o médico ainda não tem e retorna os que foram
+    de fato criados. Sem ignore_conflicts, que esconderia quantas linhas
+    entraram: se outra requisição criar um dos horários entre a leitura dos
+    existentes e a inserção (unique_together medico/dia/horario), o lote
+    volta no savepoint e é refeito com os existentes relidos.
+    """
+    for _ in range(TENTATIVAS):
+        existentes = set(
+            Agenda.objects.filter(medico_id=medico_id, dia__range=(data_inicio, data_fim))
+            .values_list('dia', 'horario')
+        )
+        novos = [
+            Agenda(medico_id=medico_id, dia=dia, horario=horario, disponivel=True)
+            for dia, horario in candidatos
+            if (dia, horario) not in existentes
+        ]
+        try:
+            with transaction.atomic():
+                Agenda.objects.bulk_create(novos, batch_size=TAMANHO_LOTE)
+        except IntegrityError:
+            continue
+        return novos
+    raise IntegrityError('Horários alterados por outra requisição durante a geração; tente novamente.')
+
+
+def criar_agendas_recorrentes(medico_id, dias_semana, hora_inicio, hora_fim, duracao, data_inicio, data_fim, excecoes=()):
+    """
+    Materializa os horários de um modelo recorrente com inserções em lote.
+
+    A validação de Agenda.clean é feita uma vez para o período inteiro:
+    um período que começa antes de hoje é rejeitado, e os horários de hoje
+    que já passaram são descartados. Horários que já existem para o médico
+    são ignorados. Retorna (criados, ignorados).
+    """
+    agora = timezone.now()
+    if data_inicio < agora.date():
+        raise ValidationError("A data da agenda não pode ser anterior à data atual.")
+
+    candidatos = [
+        (dia, horario)
+        for dia, horario in gerar_horarios(dias_semana, hora_inicio, hora_fim, duracao, data_inicio, data_fim, excecoes)
+        if dia > agora.date() or horario >= agora.time()
+    ]
+    if not candidatos:
+        return 0, 0
+
+    with transaction.atomic():
+        novos = _inserir(medico_id, candidatos, data_inicio, data_fim)
+        atualizar_disponibilidade(medico_id, [(agenda.dia, agenda.horario) for agenda in novos])
+        invalidar_agenda(medico_id)
+        if novos:
+            publicar_agenda(medico_id, criados=len(novos))
+
+    return len(novos), len(candidatos) - len(novos)
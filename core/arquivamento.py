@@ -0,0 +1,87 @@
+from django.db import connection, transaction
+from django.db.models import Exists, F, OuterRef
+
+from .models import Agenda, Consulta, ConsultaArquivada, Notificacao, ResumoDisponibilidade
+
+
+TAMANHO_LOTE = 1000
+
+CAMPOS_COPIADOS = [
+    'id', 'paciente_id', 'status', 'data_agendamento', 'observacoes',
+    'observacoes_paciente', 'prontuario_medico', 'motivo_cancelamento',
+]
+
+
+def _apagar_agendas(agenda_ids):
+    """
+    Apaga slots sem consulta com um DELETE ... WHERE id IN (...) em SQL.
+    O delete do ORM dispararia o post_delete de cada linha (atualização do
+    resumo, do cache e eventos), o que não serve para dias passados. As
+    únicas referências a Agenda são Consulta (o NOT EXISTS deixa de fora os
+    slots que ainda têm consulta) e o resumo, solto antes como faria o
+    SET_NULL.
+    """
+    if not agenda_ids:
+        return 0
+    ResumoDisponibilidade.objects.filter(primeira_agenda_id__in=agenda_ids).update(primeira_agenda=None)
+    nome = connection.ops.quote_name
+    agenda = nome(Agenda._meta.db_table)
+    consulta = nome(Consulta._meta.db_table)
+    coluna = nome(Consulta._meta.get_field('agenda').column)
+    marcadores = ', '.join(['%s'] * len(agenda_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {agenda} WHERE id IN ({marcadores}) '
+            f'AND NOT EXISTS (SELECT 1 FROM {consulta} WHERE {consulta}.{coluna} = {agenda}.id)',
+            agenda_ids,
+        )
+        return cursor.rowcount
+
+
+def arquivar_consultas(antes_de, tamanho=TAMANHO_LOTE):
+    """
+    Move para ConsultaArquivada as consultas encerradas com horário antes
+    de `antes_de`, junto com os slots delas, em lotes de uma transação
+    cada. Consultas com notificação ainda pendente no outbox esperam a
+    entrega, que precisa dos dados da consulta. Retorna quantas foram
+    arquivadas.
+    """
+    total = 0
+    while True:
+        with transaction.atomic():
+            linhas = list(
+                Consulta.objects.filter(status__in=ConsultaArquivada.STATUS_ARQUIVAVEIS, agenda__dia__lt=antes_de)
+                .exclude(Exists(Notificacao.objects.filter(consulta=OuterRef('pk'), status='PENDENTE')))
+                .order_by('id')
+                .values(*CAMPOS_COPIADOS, 'agenda_id', medico_id=F('agenda__medico_id'), dia=F('agenda__dia'), horario=F('agenda__horario'))
+                [:tamanho]
+            )
+            if not linhas:
+                return total
+
+            agenda_ids = [linha.pop('agenda_id') for linha in linhas]
+            ConsultaArquivada.objects.bulk_create(
+                [ConsultaArquivada(**linha) for linha in linhas], ignore_conflicts=True
+            )
+            Consulta.objects.filter(id__in=[linha['id'] for linha in linhas]).delete()
+            _apagar_agendas(agenda_ids)
+        total += len(linhas)
+
+
+def purgar_agendas_expiradas(antes_de, tamanho=TAMANHO_LOTE):
+    """Apaga os slots sem consulta de dias anteriores a `antes_de`. Retorna quantos."""
+    total = 0
+    while True:
+        agenda_ids = list(
+            Agenda.objects.filter(dia__lt=antes_de, consultas__isnull=True)
+            .order_by('id').values_list('id', flat=True)[:tamanho]
+        )
+        if not agenda_ids:
+            return total
+        with transaction.atomic():
+            total += _apagar_agendas(agenda_ids)
+
+
+def purgar_resumos_expirados(antes_de):
+    """A busca de disponibilidade só olha de hoje em diante: o resumo de dias passados é descartável."""
+    return ResumoDisponibilidade.objects.filter(dia__lt=antes_de).delete()[0]
@@ -0,0 +1,214 @@
+from collections import namedtuple
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import transaction
+from rest_framework.permissions import IsAdminUser
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+
+
+Perfil = namedtuple('Perfil', ['tipo', 'medico_id', 'paciente_id', 'crm'])
+
+
+class PerfilTokenUser(TokenUser):
+    """
+    Usuário montado só com as claims do access token (ver
+    PerfilTokenObtainPairSerializer), sem consultar o banco.
+
+    Diferente do TokenUser padrão, atributos desconhecidos levantam
+    AttributeError, para que um `hasattr(user, 'medico')` esquecido não
+    dê verdadeiro por engano, e `is_staff` é o valor atual do usuário,
+    não o do momento em que o token foi emitido.
+    """
+
+    def __init__(self, token, is_staff=False):
+        super().__init__(token)
+        self.is_staff = is_staff
+
+    @property
+    def id(self):
+        return int(super().id)
+
+    @property
+    def email(self):
+        return self.token.get('email', '')
+
+    @property
+    def perfil(self):
+        return Perfil(
+            tipo=self.token['type'],
+            medico_id=self.token.get('medico_id'),
+            paciente_id=self.token.get('paciente_id'),
+            crm=self.token.get('crm'),
+        )
+
+    def __getattr__(self, attr):
+        raise AttributeError(attr)
+
+
+def _cache():
+    return caches[settings.API_CACHE_ALIAS]
+
+
+def _chave_usuario(user_id):
+    return f'autenticacao:usuario:{user_id}'
+
+
+def _chave_estado(user_id):
+    return f'autenticacao:estado:{user_id}'
+
+
+def usuario_em_cache(user_id):
+    """
+    Usuário de um token emitido antes das claims de perfil, montado como se
+    as tivesse: um SELECT com os joins de medico/paciente e, no cache, só
+    as claims (id, username, email, perfil, is_active e is_staff) por
+    AUTENTICACAO_CACHE_TIMEOUT. A linha de User, com o hash da senha, nunca
+    vai para o cache compartilhado.
+    """
+    chave = _chave_usuario(user_id)
+    claims = _cache().get(chave)
+    if claims is None:
+        user = (
+            User.objects.select_related('medico', 'paciente')
+            .filter(**{api_settings.USER_ID_FIELD: user_id}).first()
+        )
+        if user is None:
+            raise AuthenticationFailed('Usuário não encontrado.', code='user_not_found')
+        perfil = perfil_do_usuario(user)
+        claims = {
+            api_settings.USER_ID_CLAIM: getattr(user, api_settings.USER_ID_FIELD),
+            'username': user.username,
+            'email': user.email,
+            'type': perfil.tipo,
+            'medico_id': perfil.medico_id,
+            'paciente_id': perfil.paciente_id,
+            'crm': perfil.crm,
+            'is_active': user.is_active,
+            'is_staff': user.is_staff,
+        }
+        _cache().set(chave, claims, timeout=settings.AUTENTICACAO_CACHE_TIMEOUT)
+    if not claims['is_active']:
+        raise AuthenticationFailed('Usuário inativo.', code='user_inactive')
+    return PerfilTokenUser(claims, is_staff=claims['is_staff'])
+
+
+def estado_do_usuario(user_id):
+    """
+    (is_active, is_staff) atuais do usuário, numa consulta pela chave
+    primária que lê só essas duas colunas. Usuário excluído conta como
+    inativo.
+    """
+    estado = User.objects.filter(**{api_settings.USER_ID_FIELD: user_id}).values_list('is_active', 'is_staff').first()
+    return estado or (False, False)
+
+
+def estado_em_cache(user_id):
+    """
+    estado_do_usuario guardado por AUTENTICACAO_CACHE_TIMEOUT. Uma entrada
+    que falta (expirada ou despejada) só custa a consulta de novo; num
+    cache local do processo, uma mudança feita em outro worker chega aqui
+    no fim do timeout (ver o check core.E001).
+    """
+    chave = _chave_estado(user_id)
+    estado = _cache().get(chave)
+    if estado is None:
+        estado = estado_do_usuario(user_id)
+        _cache().set(chave, estado, timeout=settings.AUTENTICACAO_CACHE_TIMEOUT)
+    return estado
+
+
+def invalidar_usuario(user_id):
+    """
+    Descarta o usuário e o estado em cache já e de novo no commit: uma
+    leitura concorrente pode ter guardado o valor antigo no meio tempo.
+    """
+    invalidar_usuarios([user_id])
+
+
+def invalidar_usuarios(user_ids):
+    """invalidar_usuario para vários usuários de uma vez (cargas em massa)."""
+    chaves = [chave for user_id in user_ids for chave in (_chave_usuario(user_id), _chave_estado(user_id))]
+    if not chaves:
+        return
+    _cache().delete_many(chaves)
+    transaction.on_commit(lambda: _cache().delete_many(chaves), robust=True)
+
+
+class PerfilJWTAuthentication(JWTAuthentication):
+    """
+    Confia nas claims de perfil do token e evita carregar User, Medico e
+    Paciente; só confere is_active/is_staff (estado_em_cache), para recusar
+    usuários desativados ou excluídos depois que o token foi emitido. As
+    rotas de administração conferem de novo no banco (AdminConferido).
+    Tokens emitidos antes das claims existirem carregam usuário e perfil
+    numa consulta só, guardados em cache por alguns segundos (ver
+    usuario_em_cache).
+    """
+
+    def authenticate(self, request):
+        validated_token = self.token_da_requisicao(request)
+        if validated_token is None:
+            return None
+        return self.get_user(validated_token), validated_token
+
+    def token_da_requisicao(self, request):
+        """
+        Access token do cabeçalho Authorization, validado uma vez por
+        requisição: o ReplicasMiddleware valida antes da view e a
+        autenticação do DRF reaproveita o resultado. None sem cabeçalho.
+        """
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        request = getattr(request, '_request', request)
+        guardado = getattr(request, '_token_validado', None)
+        if guardado is not None and guardado[0] == raw_token:
+            return guardado[1]
+        validated_token = self.get_validated_token(raw_token)
+        request._token_validado = (raw_token, validated_token)
+        return validated_token
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            return super().get_user(validated_token)
+        if 'type' not in validated_token:
+            return usuario_em_cache(user_id)
+        ativo, is_staff = estado_em_cache(user_id)
+        if not ativo:
+            raise AuthenticationFailed('Usuário inativo.', code='user_inactive')
+        return PerfilTokenUser(validated_token, is_staff=is_staff)
+
+
+class AdminConferido(IsAdminUser):
+    """
+    IsAdminUser que confere is_active e is_staff no banco, sem o cache da
+    autenticação: revogar o acesso de administrador vale na hora, em
+    qualquer worker.
+    """
+
+    def has_permission(self, request, view):
+        return super().has_permission(request, view) and estado_do_usuario(request.user.pk) == (True, True)
+
+
+def perfil_do_usuario(user):
+    """
+    Tipo e ids de perfil do usuário autenticado: direto das claims quando
+    o usuário veio do token, ou pelas relações medico/paciente do User.
+    """
+    if isinstance(user, PerfilTokenUser):
+        return user.perfil
+    if hasattr(user, 'medico'):
+        return Perfil('medico', user.medico.id, None, user.medico.crm)
+    if hasattr(user, 'paciente'):
+        return Perfil('paciente', None, user.paciente.id, None)
+    return Perfil('paciente', None, None, None)
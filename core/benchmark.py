@@ -0,0 +1,335 @@
+import json
+import math
+import random
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .models import Agenda, Consulta, Medico, Paciente
+
+
+# Mistura padrão de operações: nome -> peso
+MISTURA_PADRAO = {
+    'listar_medicos': 30,
+    'listar_agendas': 35,
+    'reservar': 15,
+    'cancelar': 10,
+    'atualizar_status': 10,
+}
+
+# Página pedida explicitamente nas listagens: a medida não muda se o
+# page_size padrão da API mudar
+TAMANHO_PAGINA = 50
+CODIGOS_CONFLITO = (409, 412)
+QUERIES_SERVER_TIMING = re.compile(r'db;[^,]*desc="(\d+) queries"')
+
+
+class ClienteLocal:
+    """Executa as requisições no próprio processo, pelo Client de testes do Django."""
+
+    def __init__(self):
+        # Usa um host aceito por ALLOWED_HOSTS (com DEBUG e lista vazia, localhost)
+        hosts = [host for host in settings.ALLOWED_HOSTS if '*' not in host and not host.startswith('.')]
+        self.client = Client(raise_request_exception=False, HTTP_HOST=hosts[0] if hosts else 'localhost')
+
+    def requisitar(self, metodo, caminho, token=None, dados=None):
+        extras = {'HTTP_AUTHORIZATION': f'Bearer {token}'} if token else {}
+        if dados is not None:
+            extras.update(data=json.dumps(dados), content_type='application/json')
+        with CaptureQueriesContext(connection) as queries:
+            inicio = time.perf_counter()
+            resposta = getattr(self.client, metodo.lower())(caminho, **extras)
+            duracao = time.perf_counter() - inicio
+        try:
+            corpo = json.loads(resposta.content or b'null')
+        except ValueError:
+            corpo = None
+        return resposta.status_code, corpo, duracao, len(queries)
+
+    def fechar(self):
+        connection.close()
+
+
+class ClienteHttp:
+    """Executa as requisições contra um servidor rodando em `base`."""
+
+    def __init__(self, base):
+        self.base = base.rstrip('/')
+
+    def requisitar(self, metodo, caminho, token=None, dados=None):
+        cabecalhos = {'Accept': 'application/json'}
+        corpo = None
+        if token:
+            cabecalhos['Authorization'] = f'Bearer {token}'
+        if dados is not None:
+            corpo = json.dumps(dados).encode()
+            cabecalhos['Content-Type'] = 'application/json'
+        requisicao = urllib.request.Request(self.base + caminho, data=corpo, headers=cabecalhos, method=metodo)
+        inicio = time.perf_counter()
+        try:
+            with urllib.request.urlopen(requisicao, timeout=30) as resposta:
+                codigo, conteudo, timing = resposta.status, resposta.read(), resposta.headers.get('Server-Timing')
+        except urllib.error.HTTPError as e:
+            codigo, conteudo, timing = e.code, e.read(), e.headers.get('Server-Timing')
+        duracao = time.perf_counter() - inicio
+        try:
+            conteudo = json.loads(conteudo or b'null')
+        except ValueError:
+            conteudo = None
+        # Número de queries informado pelo InstrumentacaoMiddleware do servidor
+        queries = QUERIES_SERVER_TIMING.search(timing or '')
+        return codigo, conteudo, duracao, int(queries.group(1)) if queries else None
+
+    def fechar(self):
+        pass
+
+
+class Estado:
+    """
+    Massa de dados compartilhada entre as threads: tokens de login,
+    horários livres a reservar e consultas que podem ser canceladas ou
+    ter o status alterado. Cada item é consumido uma vez.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.medico_ids = []
+        self.tokens_pacientes = []
+        self.tokens_medicos = {}
+        self.livres = []
+        self.cancelaveis = []
+        self.pendentes = defaultdict(list)
+
+    def tirar(self, lista):
+        with self.lock:
+            return lista.pop() if lista else None
+
+    def guardar(self, lista, item):
+        with self.lock:
+            lista.append(item)
+
+
+def _token(cliente, username, senha):
+    codigo, corpo, _, _ = cliente.requisitar('POST', '/api/token/', dados={'username': username, 'password': senha})
+    if codigo != 200:
+        return None
+    return corpo['access']
+
+
+def preparar(cliente, rng, senha, usuarios=20, horarios=2000):
+    """
+    Escolhe médicos e pacientes existentes (ex.: gerados pelo comando
+    seed), faz login de cada um e separa os horários livres e consultas
+    usados pelas operações de escrita.
+    """
+    estado = Estado()
+    hoje = timezone.localdate()
+
+    medicos = list(Medico.objects.filter(user__isnull=False).values_list('id', 'user__username').order_by('id')[:usuarios])
+    pacientes = list(Paciente.objects.filter(user__isnull=False).values_list('id', 'user__username').order_by('id')[:usuarios])
+
+    estado.medico_ids = [medico_id for medico_id, _ in medicos] or list(Medico.objects.values_list('id', flat=True)[:usuarios])
+    for medico_id, username in medicos:
+        token = _token(cliente, username, senha)
+        if token:
+            estado.tokens_medicos[medico_id] = token
+
+    tokens_por_paciente = {}
+    for paciente_id, username in pacientes:
+        token = _token(cliente, username, senha)
+        if token:
+            tokens_por_paciente[paciente_id] = token
+    estado.tokens_pacientes = list(tokens_por_paciente.values())
+
+    estado.livres = list(
+        Agenda.objects.filter(disponivel=True, dia__gt=hoje, medico_id__in=estado.tokens_medicos)
+        .values_list('id', 'medico_id').order_by('dia', 'horario', 'id')[:horarios]
+    )
+    rng.shuffle(estado.livres)
+
+    futuras = (
+        Consulta.objects.filter(agenda__dia__gt=hoje, status__in=['PENDENTE', 'AGENDADA'])
+        .values_list('id', 'paciente_id', 'agenda__medico_id').order_by('id')
+    )
+    for consulta_id, paciente_id, medico_id in futuras.filter(paciente_id__in=tokens_por_paciente)[:horarios]:
+        estado.cancelaveis.append((consulta_id, tokens_por_paciente[paciente_id]))
+    for consulta_id, paciente_id, medico_id in futuras.filter(agenda__medico_id__in=estado.tokens_medicos, status='PENDENTE')[:horarios]:
+        estado.pendentes[medico_id].append(consulta_id)
+    return estado
+
+
+def executar_operacao(nome, cliente, estado, rng):
+    """Executa uma operação da mistura. Retorna o resultado ou None se não havia dados para ela."""
+    if nome == 'listar_medicos':
+        return cliente.requisitar('GET', f'/api/medicos/?page_size={TAMANHO_PAGINA}')
+
+    if nome == 'listar_agendas':
+        if not estado.medico_ids:
+            return None
+        return cliente.requisitar('GET', f'/api/agendas/?medico={rng.choice(estado.medico_ids)}&page_size={TAMANHO_PAGINA}')
+
+    if nome == 'reservar':
+        horario = estado.tirar(estado.livres)
+        if horario is None or not estado.tokens_pacientes:
+            return None
+        agenda_id, medico_id = horario
+        token = rng.choice(estado.tokens_pacientes)
+        resultado = cliente.requisitar('POST', '/api/consultas/', token, {'agenda': agenda_id})
+        if resultado[0] == 201:
+            estado.guardar(estado.cancelaveis, (resultado[1]['id'], token))
+            estado.guardar(estado.pendentes[medico_id], resultado[1]['id'])
+        return resultado
+
+    if nome == 'cancelar':
+        item = estado.tirar(estado.cancelaveis)
+        if item is None:
+            return None
+        consulta_id, token = item
+        return cliente.requisitar('POST', f'/api/consultas/{consulta_id}/cancelar/', token, {'motivo': 'Benchmark'})
+
+    if nome == 'atualizar_status':
+        with estado.lock:
+            com_pendentes = [medico_id for medico_id, ids in estado.pendentes.items() if ids]
+        if not com_pendentes:
+            return None
+        medico_id = rng.choice(com_pendentes)
+        consulta_id = estado.tirar(estado.pendentes[medico_id])
+        if consulta_id is None:
+            return None
+        return cliente.requisitar(
+            'PATCH', f'/api/consultas/{consulta_id}/atualizar_status/',
+            estado.tokens_medicos[medico_id], {'status': 'AGENDADA'},
+        )
+
+    raise ValueError(f'Operação desconhecida: {nome}')
+
+
+def percentil(valores, p):
+    """Percentil pelo método nearest-rank sobre uma lista ordenada."""
+    if not valores:
+        return None
+    return valores[max(0, math.ceil(p / 100 * len(valores)) - 1)]
+
+
+def _resumir(amostras, duracao_total):
+    tempos = sorted(amostra[1] * 1000 for amostra in amostras)
+    queries = [amostra[2] for amostra in amostras if amostra[2] is not None]
+    codigos = defaultdict(int)
+    for amostra in amostras:
+        codigos[str(amostra[0])] += 1
+    return {
+        'requisicoes': len(amostras),
+        # 409/412 são respostas esperadas quando operações da mistura disputam a mesma consulta
+        'conflitos': sum(1 for amostra in amostras if amostra[0] in CODIGOS_CONFLITO),
+        'erros': sum(1 for amostra in amostras if amostra[0] >= 400 and amostra[0] not in CODIGOS_CONFLITO),
+        'vazao_rps': round(len(amostras) / duracao_total, 2) if duracao_total else None,
+        'media_ms': round(sum(tempos) / len(tempos), 2) if tempos else None,
+        'p50_ms': round(percentil(tempos, 50), 2) if tempos else None,
+        'p95_ms': round(percentil(tempos, 95), 2) if tempos else None,
+        'p99_ms': round(percentil(tempos, 99), 2) if tempos else None,
+        'max_ms': round(tempos[-1], 2) if tempos else None,
+        'queries_media': round(sum(queries) / len(queries), 2) if queries else None,
+        'queries_max': max(queries) if queries else None,
+        'status': dict(codigos),
+    }
+
+
+def rodar(requisicoes=500, concorrencia=1, url=None, mistura=None, seed=42, senha='senha12345',
+          usuarios=20, aquecimento=20):
+    """
+    Reproduz `requisicoes` operações sorteadas pela mistura (com pesos),
+    em `concorrencia` threads, no próprio processo ou contra `url`.
+    Retorna o relatório como dict serializável em JSON.
+    """
+    mistura = mistura or MISTURA_PADRAO
+    rng = random.Random(seed)
+    fabrica = (lambda: ClienteHttp(url)) if url else ClienteLocal
+    principal = fabrica()
+
+    estado = preparar(principal, rng, senha, usuarios=usuarios, horarios=requisicoes + aquecimento)
+    plano = rng.choices(list(mistura), weights=list(mistura.values()), k=aquecimento + requisicoes)
+    sementes = [rng.getrandbits(32) for _ in plano]
+    fila = iter(range(aquecimento, len(plano)))
+    lock = threading.Lock()
+    amostras = defaultdict(list)
+    puladas = defaultdict(int)
+
+    def executar(cliente, indice):
+        nome = plano[indice]
+        resultado = executar_operacao(nome, cliente, estado, random.Random(sementes[indice]))
+        if indice < aquecimento:
+            return
+        with lock:
+            if resultado is None:
+                puladas[nome] += 1
+            else:
+                codigo, _, duracao, queries = resultado
+                amostras[nome].append((codigo, duracao, queries))
+
+    def trabalhador():
+        cliente = fabrica()
+        try:
+            while True:
+                with lock:
+                    indice = next(fila, None)
+                if indice is None:
+                    break
+                executar(cliente, indice)
+        finally:
+            cliente.fechar()
+
+    for indice in range(aquecimento):
+        executar(principal, indice)
+
+    inicio = time.perf_counter()
+    if concorrencia > 1:
+        threads = [threading.Thread(target=trabalhador) for _ in range(concorrencia)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    else:
+        for indice in fila:
+            executar(principal, indice)
+    duracao_total = time.perf_counter() - inicio
+
+    todas = [amostra for lista in amostras.values() for amostra in lista]
+    return {
+        'executado_em': timezone.now().isoformat(),
+        'modo': 'http' if url else 'local',
+        'alvo': url,
+        'seed': seed,
+        'concorrencia': concorrencia,
+        'mistura': mistura,
+        'duracao_s': round(duracao_total, 3),
+        'total': _resumir(todas, duracao_total),
+        'operacoes': {nome: _resumir(amostras[nome], duracao_total) for nome in mistura if amostras[nome]},
+        'puladas': dict(puladas),
+    }
+
+
+def comparar(atual, anterior):
+    """Linhas de texto com a variação de p95 e vazão por operação entre dois relatórios."""
+    linhas = []
+    for nome in ['total', *atual['operacoes']]:
+        novo = atual['total'] if nome == 'total' else atual['operacoes'].get(nome)
+        velho = anterior['total'] if nome == 'total' else anterior.get('operacoes', {}).get(nome)
+        if not novo or not velho:
+            continue
+        partes = [f'{nome:<18}']
+        for chave in ('p95_ms', 'vazao_rps', 'queries_media'):
+            if novo.get(chave) is None or not velho.get(chave):
+                continue
+            variacao = (novo[chave] - velho[chave]) / velho[chave] * 100
+            partes.append(f'{chave} {velho[chave]} -> {novo[chave]} ({variacao:+.1f}%)')
+        linhas.append('  '.join(partes))
+    return linhas
@@ -0,0 +1,74 @@
+from django.db import connections
+from django.db.models import Case, IntegerField, Q, Value, When
+
+from .models import Medico, normalizar_busca
+
+
+MAX_TERMOS = 5
+MIN_CARACTERES = 2
+CAMPOS = ['id', 'nome', 'crm', 'especialidade']
+
+
+def _prefixo(campo, termo, postgres):
+    # No PostgreSQL o LIKE 'termo%' usa o índice de trigramas; nos demais,
+    # a faixa usa o índice B-tree (o LIKE do SQLite com ESCAPE não usa)
+    if postgres:
+        return Q(**{f'{campo}__startswith': termo})
+    return Q(**{f'{campo}__gte': termo, f'{campo}__lt': termo + '\uffff'})
+
+
+def _inicio_de_palavra(campo, termo):
+    # Palavra que não é a primeira ("souza" em "ana souza"). Indexado só
+    # com trigramas; nos demais bancos é a fase lenta, ver buscar_medicos
+    return Q(**{f'{campo}__contains': f' {termo}'})
+
+
+def _qualquer_palavra(termo, postgres):
+    return (
+        _prefixo('nome_busca', termo, postgres) | _inicio_de_palavra('nome_busca', termo)
+        | _prefixo('especialidade_busca', termo, postgres) | _inicio_de_palavra('especialidade_busca', termo)
+    )
+
+
+def _ranquear(queryset, termos, postgres):
+    """
+    Nome que começa pela busca inteira, depois pelo primeiro termo, depois
+    especialidade que começa por ele, depois palavra no meio do nome: a
+    mesma ordem das duas fases de buscar_medicos.
+    """
+    frase = ' '.join(termos)
+    return queryset.annotate(
+        relevancia=Case(
+            When(_prefixo('nome_busca', frase, postgres), then=Value(4)),
+            When(_prefixo('nome_busca', termos[0], postgres), then=Value(3)),
+            When(_prefixo('especialidade_busca', termos[0], postgres), then=Value(2)),
+            default=Value(1),
+            output_field=IntegerField(),
+        )
+    ).order_by('-relevancia', 'nome_busca', 'id')
+
+
+def buscar_medicos(texto, limite):
+    """
+    Autocomplete de médicos por nome e especialidade, sem diferenciar
+    maiúsculas nem acentos: cada termo tem de ser início de alguma palavra
+    do nome ou da especialidade ("ana card" acha "Ana Souza, Cardiologista").
+
+    Em duas fases: primeiro os médicos em que o primeiro termo começa o
+    nome ou a especialidade, achados pelo índice; só se não completarem
+    `limite`, os que têm o termo no meio (índice de trigramas no
+    PostgreSQL, varredura nos demais bancos).
+    """
+    termos = normalizar_busca(texto).split()[:MAX_TERMOS]
+    if len(''.join(termos)) < MIN_CARACTERES:
+        return []
+
+    postgres = connections[Medico.objects.db].vendor == 'postgresql'
+    demais = [_qualquer_palavra(termo, postgres) for termo in termos[1:]]
+    inicio = _prefixo('nome_busca', termos[0], postgres) | _prefixo('especialidade_busca', termos[0], postgres)
+
+    resultados = list(_ranquear(Medico.objects.filter(inicio, *demais), termos, postgres).values(*CAMPOS)[:limite])
+    if len(resultados) < limite:
+        meio = Medico.objects.filter(_qualquer_palavra(termos[0], postgres), *demais).exclude(inicio)
+        resultados += _ranquear(meio, termos, postgres).values(*CAMPOS)[:limite - len(resultados)]
+    return resultados
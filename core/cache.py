@@ -0,0 +1,150 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.http import urlencode
+from rest_framework import status
+from rest_framework.response import Response
+
+from .replicas import lendo_de_replica
+
+
+# Listagens de médicos (e a busca) e listagens gerais de horários têm
+# contadores separados: agendar ou cancelar não invalida /api/medicos/
+VERSAO_GLOBAL = 'versao:medicos'
+VERSAO_AGENDAS = 'versao:agendas'
+
+
+def _cache():
+    return caches[settings.API_CACHE_ALIAS]
+
+
+def chave_versao_medico(medico_id):
+    return f'versao:medico:{medico_id}'
+
+
+def chave_versao_agenda(medico_id):
+    return f'versao:agenda:{medico_id}'
+
+
+def obter_versoes(chaves):
+    """
+    Lê os contadores de versão. Um contador ausente (nunca criado ou
+    despejado do cache) recebe um valor novo baseado no relógio, para não
+    reaproveitar uma versão antiga e servir uma resposta desatualizada.
+    """
+    cache = _cache()
+    versoes = cache.get_many(chaves)
+    for chave in chaves:
+        if chave not in versoes:
+            cache.add(chave, time.time_ns())
+            versoes[chave] = cache.get(chave)
+    return [versoes[chave] for chave in chaves]
+
+
+def _incrementar(chaves):
+    cache = _cache()
+    for chave in chaves:
+        try:
+            cache.incr(chave)
+        except ValueError:
+            cache.set(chave, time.time_ns(), timeout=None)
+
+
+def _incrementar_no_commit(chaves):
+    # Uma falha do cache no commit é só registrada no log (robust): a
+    # escrita já foi confirmada e a resposta não pode virar erro.
+    transaction.on_commit(lambda: _incrementar(chaves), robust=True)
+
+
+def invalidar_medico(medico_id):
+    """
+    Invalida as respostas em cache do perfil de um médico e das listagens
+    de médicos; só para mudanças na linha de Medico. Roda no commit, senão
+    uma leitura concorrente poderia guardar os dados antigos sob a versão
+    nova.
+    """
+    chaves = [VERSAO_GLOBAL]
+    if medico_id is not None:
+        chaves.append(chave_versao_medico(medico_id))
+    _incrementar_no_commit(chaves)
+
+
+def invalidar_medicos(medico_ids):
+    """invalidar_medico para vários médicos de uma vez (cargas em massa)."""
+    chaves = [VERSAO_GLOBAL, *map(chave_versao_medico, medico_ids)]
+    _incrementar_no_commit(chaves)
+
+
+def invalidar_agenda(medico_id):
+    """
+    Invalida os horários em cache de um médico e as listagens gerais de
+    horários (horário criado, reservado, liberado ou excluído).
+    """
+    chaves = [VERSAO_AGENDAS]
+    if medico_id is not None:
+        chaves.append(chave_versao_agenda(medico_id))
+    _incrementar_no_commit(chaves)
+
+
+class RespostaVersionadaMixin:
+    """
+    Cache de list/retrieve para endpoints públicos, com ETag forte.
+
+    A chave combina rota, parâmetros, formato e as versões devolvidas por
+    `chaves_de_versao()`. Como a ETag sai só dos contadores de versão, um
+    If-None-Match que ainda bate é respondido com 304 sem tocar no banco.
+    O que a resposta usa além do banco (o horário de corte, por exemplo)
+    entra na chave por `partes_da_chave()`.
+    """
+
+    def chaves_de_versao(self):
+        return [VERSAO_GLOBAL]
+
+    def partes_da_chave(self):
+        return []
+
+    def list(self, request, *args, **kwargs):
+        return self.resposta_em_cache(request, lambda: super(RespostaVersionadaMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.resposta_em_cache(request, lambda: super(RespostaVersionadaMixin, self).retrieve(request, *args, **kwargs))
+
+    def resposta_em_cache(self, request, gerar):
+        versoes = obter_versoes(self.chaves_de_versao())
+        identidade = '|'.join([
+            request.get_host(),
+            request.path,
+            urlencode(sorted(request.query_params.lists()), doseq=True),
+            request.accepted_renderer.format,
+            *map(str, versoes),
+            *self.partes_da_chave(),
+        ])
+        digest = hashlib.sha1(identidade.encode('utf-8')).hexdigest()
+        etag = f'"{digest}"'
+
+        if etag in request.headers.get('If-None-Match', ''):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            cache = _cache()
+            chave = f'resposta:{digest}'
+            data = cache.get(chave)
+            if data is not None:
+                response = Response(data)
+            else:
+                response = gerar()
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+                # Gerada numa réplica, a resposta pode ter o atraso de
+                # replicação: fica pouco tempo, para não ficar guardada sob
+                # a versão nova com dados de antes da escrita.
+                timeout = settings.API_CACHE_TIMEOUT
+                if lendo_de_replica():
+                    timeout = min(timeout, settings.REPLICA_FIXACAO_SEGUNDOS)
+                cache.set(chave, response.data, timeout=timeout)
+
+        response['ETag'] = etag
+        response['Cache-Control'] = 'no-cache'
+        return response
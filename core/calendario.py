@@ -0,0 +1,112 @@
+import hashlib
+import secrets
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from .models import Consulta
+
+
+# Consultas confirmadas que aparecem no calendário do médico
+STATUS_NO_CALENDARIO = ['AGENDADA', 'FINALIZADA']
+TAMANHO_LOTE = 500
+FORMATO_UTC = '%Y%m%dT%H%M%SZ'
+
+
+def gerar_token():
+    return secrets.token_urlsafe(32)
+
+
+def validadores(medico):
+    """
+    (ETag, Last-Modified) do feed, numa consulta agregada só: a última
+    alteração entre todas as consultas do médico (cancelar também conta,
+    já que tira o evento do feed) e os pacientes delas (o nome vai no
+    título do evento), e quantas são, para pegar exclusões. O nome do
+    médico, que vai no nome do calendário, entra direto na assinatura.
+    """
+    agregado = Consulta.objects.filter(agenda__medico_id=medico.id).aggregate(
+        total=Count('id'), ultima=Max('atualizada_em'), paciente=Max('paciente__atualizado_em')
+    )
+    ultima = max(filter(None, (agregado['ultima'], agregado['paciente'])), default=None)
+    assinatura = f'{medico.id}|{medico.nome}|{agregado["total"]}|{ultima.isoformat() if ultima else "-"}|{settings.CALENDARIO_DURACAO_MINUTOS}'
+    return f'"{hashlib.sha1(assinatura.encode()).hexdigest()}"', ultima
+
+
+def _texto(valor):
+    """Escapa um valor TEXT do iCalendar (RFC 5545, 3.3.11)."""
+    return (
+        (valor or '').replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+        .replace('\r\n', '\\n').replace('\n', '\\n')
+    )
+
+
+def _linha(conteudo):
+    """Linha terminada em CRLF, dobrada a cada 75 octetos como pede a RFC."""
+    dados = conteudo.encode('utf-8')
+    if len(dados) <= 75:
+        return conteudo + '\r\n'
+    partes = []
+    while dados:
+        limite = 75 if not partes else 74
+        # Não corta no meio de um caractere UTF-8
+        while limite < len(dados) and (dados[limite] & 0xC0) == 0x80:
+            limite -= 1
+        partes.append(dados[:limite].decode('utf-8'))
+        dados = dados[limite:]
+    return '\r\n '.join(partes) + '\r\n'
+
+
+def _utc(dia, horario):
+    return timezone.make_aware(datetime.combine(dia, horario)).astimezone(dt_timezone.utc)
+
+
+def gerar_ics(medico):
+    """
+    Gera o VCALENDAR em pedaços, lendo as consultas com iterator() em
+    lotes: a memória usada não depende do tamanho da agenda.
+    """
+    dominio = settings.CALENDARIO_DOMINIO_UID
+    duracao = timedelta(minutes=settings.CALENDARIO_DURACAO_MINUTOS)
+    agora = timezone.now().astimezone(dt_timezone.utc).strftime(FORMATO_UTC)
+
+    yield ''.join([
+        _linha('BEGIN:VCALENDAR'),
+        _linha('VERSION:2.0'),
+        _linha('PRODID:-//Grumos Med//Agenda//PT'),
+        _linha('CALSCALE:GREGORIAN'),
+        _linha('X-WR-CALNAME:' + _texto(f'Consultas - {medico.nome}')),
+    ])
+
+    consultas = (
+        Consulta.objects.filter(agenda__medico_id=medico.id, status__in=STATUS_NO_CALENDARIO)
+        .order_by('agenda__dia', 'agenda__horario', 'id')
+        .values_list('id', 'agenda__dia', 'agenda__horario', 'paciente__nome', 'observacoes_paciente', 'atualizada_em')
+    )
+    lote = []
+    for consulta_id, dia, horario, paciente, motivo, atualizada_em in consultas.iterator(chunk_size=TAMANHO_LOTE):
+        inicio = _utc(dia, horario)
+        titulo = _texto(f'Consulta - {paciente or "paciente"}')
+        evento = [
+            _linha('BEGIN:VEVENT'),
+            _linha(f'UID:consulta-{consulta_id}@{dominio}'),
+            _linha(f'DTSTAMP:{agora}'),
+            _linha(f'DTSTART:{inicio.strftime(FORMATO_UTC)}'),
+            _linha(f'DTEND:{(inicio + duracao).strftime(FORMATO_UTC)}'),
+            _linha(f'SUMMARY:{titulo}'),
+            _linha('STATUS:CONFIRMED'),
+        ]
+        if motivo:
+            evento.append(_linha(f'DESCRIPTION:{_texto(motivo)}'))
+        if atualizada_em:
+            evento.append(_linha(f'LAST-MODIFIED:{atualizada_em.astimezone(dt_timezone.utc).strftime(FORMATO_UTC)}'))
+        evento.append(_linha('END:VEVENT'))
+        lote.append(''.join(evento))
+        if len(lote) >= TAMANHO_LOTE:
+            yield ''.join(lote)
+            lote = []
+
+    lote.append(_linha('END:VCALENDAR'))
+    yield ''.join(lote)
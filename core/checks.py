@@ -0,0 +1,47 @@
+from django.conf import settings
+from django.core.checks import Error, register
+
+
+# Backends que guardam os dados na memória de cada processo
+CACHES_LOCAIS = ['django.core.cache.backends.locmem.LocMemCache']
+
+
+def cache_local(alias):
+    return settings.CACHES[alias]['BACKEND'] in CACHES_LOCAIS
+
+
+@register()
+def cache_compartilhado(app_configs, **kwargs):
+    """
+    O estado de autenticação (is_active/is_staff) fica em API_CACHE_ALIAS:
+    num cache local, desativar um usuário só vale na hora no processo que
+    fez a mudança.
+    """
+    if settings.CACHE_COMPARTILHADO_OBRIGATORIO and cache_local(settings.API_CACHE_ALIAS):
+        return [Error(
+            f'O cache {settings.API_CACHE_ALIAS!r} (API_CACHE_ALIAS) é local de cada processo.',
+            hint=(
+                'Usuários desativados continuariam autenticados nos outros workers por até '
+                'AUTENTICACAO_CACHE_TIMEOUT. Configure DJANGO_CACHE_BACKEND com Redis ou Memcached, '
+                'ou CACHE_COMPARTILHADO_OBRIGATORIO = False se a aplicação roda num processo só.'
+            ),
+            id='core.E001',
+        )]
+    return []
+
+
+@register()
+def replicas_com_cache_compartilhado(app_configs, **kwargs):
+    """
+    A fixação no primário depois de uma escrita (core/replicas.py) fica em
+    API_CACHE_ALIAS: num cache local, a requisição seguinte do usuário cai
+    em outro worker, lê da réplica e não vê o que acabou de escrever.
+    """
+    if settings.DATABASE_REPLICAS and cache_local(settings.API_CACHE_ALIAS):
+        return [Error(
+            f'DATABASE_REPLICAS está configurado, mas o cache {settings.API_CACHE_ALIAS!r} '
+            '(API_CACHE_ALIAS) é local de cada processo.',
+            hint='Configure DJANGO_CACHE_BACKEND com Redis ou Memcached para a leitura das próprias escritas.',
+            id='core.E002',
+        )]
+    return []
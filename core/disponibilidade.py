@@ -0,0 +1,103 @@
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Count, Min, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce, ExtractHour
+
+from .models import Agenda, ResumoDisponibilidade
+
+
+TAMANHO_LOTE = 1000
+
+
+def _livres_na_hora():
+    return Agenda.objects.filter(
+        medico=OuterRef('medico'),
+        dia=OuterRef('dia'),
+        horario__hour=OuterRef('hora'),
+        disponivel=True,
+    )
+
+
+def atualizar_disponibilidade(medico_id, horarios, criar=True):
+    """
+    Recalcula o resumo das horas tocadas por uma mudança em Agenda.
+
+    `horarios` são pares (dia, horario) dos horários criados, reservados ou
+    liberados. As linhas do resumo são travadas antes (select_for_update)
+    e só então cada hora é recalculada a partir dos horários livres dela
+    num UPDATE com subconsultas. Em READ COMMITTED esse UPDATE é um comando
+    novo, que já enxerga o que outra transação na mesma hora confirmou
+    enquanto esta esperava a trava; recalcular no mesmo comando que espera
+    usaria o snapshot antigo e contaria um horário livre a mais. Com
+    `criar=False` (exclusões) as linhas que ainda não existem não são
+    criadas.
+    """
+    horas = {(dia, horario.hour) for dia, horario in horarios}
+    if not horas:
+        return
+
+    filtro = reduce(or_, (Q(dia=dia, hora=hora) for dia, hora in horas))
+    livres = _livres_na_hora()
+    atualizacao = {
+        'livres': Coalesce(
+            Subquery(livres.order_by().values('medico').annotate(total=Count('id')).values('total')),
+            0,
+        ),
+        'primeira_agenda': Subquery(livres.order_by('horario', 'id').values('id')[:1]),
+        'primeiro_horario': Subquery(livres.order_by('horario', 'id').values('horario')[:1]),
+    }
+
+    # Sem savepoint: dentro de uma reserva, é parte da mesma transação
+    with transaction.atomic(savepoint=False):
+        resumos = ResumoDisponibilidade.objects.filter(filtro, medico_id=medico_id)
+        travar = resumos.select_for_update().order_by('id').values_list('id', flat=True)
+        if criar and len(travar) < len(horas):
+            ResumoDisponibilidade.objects.bulk_create(
+                [ResumoDisponibilidade(medico_id=medico_id, dia=dia, hora=hora) for dia, hora in horas],
+                ignore_conflicts=True,
+            )
+            list(travar.all())
+        resumos.update(**atualizacao)
+
+
+def reconstruir_disponibilidade(medico_ids=None):
+    """
+    Refaz o resumo inteiro (ou dos médicos informados) a partir de Agenda.
+    Usado pelo comando recalcular_disponibilidade e depois de cargas em
+    massa que não passam por atualizar_disponibilidade.
+    """
+    agendas = Agenda.objects.filter(disponivel=True)
+    resumos = ResumoDisponibilidade.objects.all()
+    if medico_ids is not None:
+        agendas = agendas.filter(medico_id__in=medico_ids)
+        resumos = resumos.filter(medico_id__in=medico_ids)
+
+    grupos = (
+        agendas.annotate(hora=ExtractHour('horario'))
+        .values('medico_id', 'dia', 'hora')
+        .annotate(livres=Count('id'), primeiro_horario=Min('horario'))
+        .order_by()
+    )
+
+    total = 0
+    with transaction.atomic():
+        resumos.delete()
+        lote = []
+        for grupo in grupos.iterator(chunk_size=TAMANHO_LOTE):
+            lote.append(ResumoDisponibilidade(**grupo))
+            if len(lote) >= TAMANHO_LOTE:
+                ResumoDisponibilidade.objects.bulk_create(lote)
+                total += len(lote)
+                lote = []
+        ResumoDisponibilidade.objects.bulk_create(lote)
+        total += len(lote)
+
+        ResumoDisponibilidade.objects.filter(primeira_agenda__isnull=True, livres__gt=0).update(
+            primeira_agenda=Subquery(
+                _livres_na_hora().filter(horario=OuterRef('primeiro_horario')).order_by('id').values('id')[:1]
+            )
+        )
+
+    return total
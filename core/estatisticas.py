@@ -0,0 +1,127 @@
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, F, Sum
+
+from .models import Consulta, ConsultaArquivada, EstatisticaDiaria, ResumoDisponibilidade
+
+
+CAMPO_POR_STATUS = {
+    'PENDENTE': 'pendentes',
+    'AGENDADA': 'agendadas',
+    'FINALIZADA': 'finalizadas',
+    'CANCELADA': 'canceladas',
+    'REJEITADA': 'rejeitadas',
+}
+CAMPOS = list(CAMPO_POR_STATUS.values())
+# Consultas que ocupam o horário (entram na taxa de ocupação)
+CAMPOS_OCUPADOS = ['pendentes', 'agendadas', 'finalizadas']
+
+
+def registrar_mudancas(mudancas):
+    """
+    Aplica aos contadores uma lista de (medico_id, dia, status_anterior,
+    status_novo); status_anterior None é uma consulta nova. Um UPDATE com
+    F() por médico e dia, então reservas simultâneas no mesmo dia não se
+    sobrescrevem. Deve rodar dentro da transação da mudança.
+    """
+    deltas = defaultdict(Counter)
+    for medico_id, dia, anterior, novo in mudancas:
+        if anterior:
+            deltas[medico_id, dia][CAMPO_POR_STATUS[anterior]] -= 1
+        deltas[medico_id, dia][CAMPO_POR_STATUS[novo]] += 1
+
+    for (medico_id, dia), delta in deltas.items():
+        campos = {campo: F(campo) + valor for campo, valor in delta.items() if valor}
+        if not campos:
+            continue
+        linhas = EstatisticaDiaria.objects.filter(medico_id=medico_id, dia=dia)
+        if not linhas.update(**campos):
+            # Primeira consulta do dia: cria a linha zerada (ou perde a
+            # corrida para outra reserva) e incrementa
+            EstatisticaDiaria.objects.bulk_create(
+                [EstatisticaDiaria(medico_id=medico_id, dia=dia)], ignore_conflicts=True
+            )
+            linhas.update(**campos)
+
+
+def registrar(medico_id, dia, anterior, novo):
+    registrar_mudancas([(medico_id, dia, anterior, novo)])
+
+
+def reconstruir_estatisticas(medico_ids=None):
+    """
+    Refaz os contadores (de todos ou dos médicos informados) a partir das
+    consultas e do histórico arquivado. Usado pelo comando
+    recalcular_estatisticas e depois de cargas em massa.
+    """
+    consultas = Consulta.objects.filter(agenda__isnull=False)
+    arquivadas = ConsultaArquivada.objects.filter(medico__isnull=False)
+    estatisticas = EstatisticaDiaria.objects.all()
+    if medico_ids is not None:
+        consultas = consultas.filter(agenda__medico_id__in=medico_ids)
+        arquivadas = arquivadas.filter(medico_id__in=medico_ids)
+        estatisticas = estatisticas.filter(medico_id__in=medico_ids)
+
+    linhas = {}
+    grupos = [
+        consultas.values_list('agenda__medico_id', 'agenda__dia', 'status'),
+        arquivadas.values_list('medico_id', 'dia', 'status'),
+    ]
+    for grupo in grupos:
+        for medico_id, dia, status, total in grupo.annotate(total=Count('id')).order_by():
+            linha = linhas.setdefault((medico_id, dia), EstatisticaDiaria(medico_id=medico_id, dia=dia))
+            setattr(linha, CAMPO_POR_STATUS[status], getattr(linha, CAMPO_POR_STATUS[status]) + total)
+
+    with transaction.atomic():
+        estatisticas.delete()
+        EstatisticaDiaria.objects.bulk_create(linhas.values(), batch_size=1000)
+    return len(linhas)
+
+
+def _com_ocupacao(linha):
+    ocupados = sum(linha[campo] for campo in CAMPOS_OCUPADOS)
+    capacidade = ocupados + linha['livres']
+    linha['ocupados'] = ocupados
+    linha['ocupacao'] = round(ocupados / capacidade, 4) if capacidade else None
+    return linha
+
+
+def painel(medico_id, data_inicio, data_fim):
+    """
+    Contadores por dia, por semana (começando na segunda) e do período,
+    com a ocupação dos horários: consultas que ocupam o slot sobre elas
+    mais os horários ainda livres (do resumo de disponibilidade). Duas
+    consultas, independentemente do tamanho do histórico.
+    """
+    dias = {
+        linha['dia']: {**linha, 'livres': 0}
+        for linha in EstatisticaDiaria.objects.filter(medico_id=medico_id, dia__range=(data_inicio, data_fim))
+        .values('dia', *CAMPOS)
+    }
+    livres = (
+        ResumoDisponibilidade.objects.filter(medico_id=medico_id, dia__range=(data_inicio, data_fim))
+        .values('dia').annotate(total=Sum('livres')).order_by()
+    )
+    for linha in livres:
+        if linha['total']:
+            dias.setdefault(linha['dia'], {'dia': linha['dia'], **dict.fromkeys(CAMPOS, 0), 'livres': 0})['livres'] = linha['total']
+
+    por_dia = [dias[dia] for dia in sorted(dias)]
+    semanas = {}
+    totais = {**dict.fromkeys(CAMPOS, 0), 'livres': 0}
+    for linha in por_dia:
+        inicio = linha['dia'] - timedelta(days=linha['dia'].weekday())
+        semana = semanas.setdefault(inicio, {'inicio': inicio, **dict.fromkeys(CAMPOS, 0), 'livres': 0})
+        for campo in [*CAMPOS, 'livres']:
+            semana[campo] += linha[campo]
+            totais[campo] += linha[campo]
+
+    return {
+        'data_inicio': data_inicio,
+        'data_fim': data_fim,
+        'totais': _com_ocupacao(totais),
+        'dias': [_com_ocupacao(linha) for linha in por_dia],
+        'semanas': [_com_ocupacao(semana) for semana in semanas.values()],
+    }
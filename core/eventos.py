@@ -0,0 +1,181 @@
+import asyncio
+import itertools
+import json
+import threading
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+
+TAMANHO_FILA = 100
+
+
+def canal_medico(medico_id):
+    """Eventos públicos da agenda de um médico (horários ocupados/liberados)."""
+    return f'medico:{medico_id}'
+
+
+def canal_consultas_medico(medico_id):
+    return f'consultas:medico:{medico_id}'
+
+
+def canal_consultas_paciente(paciente_id):
+    return f'consultas:paciente:{paciente_id}'
+
+
+class Assinatura:
+    """Fila asyncio de um cliente conectado, alimentada de qualquer thread."""
+
+    def __init__(self, canais):
+        self.canais = set(canais)
+        self.loop = asyncio.get_running_loop()
+        self.fila = asyncio.Queue(maxsize=TAMANHO_FILA)
+        self.perdeu_eventos = False
+
+    def entregar(self, evento):
+        # Chamado no loop da assinatura. Um cliente lento demais perde
+        # eventos e recebe um aviso para recarregar, em vez de acumular memória.
+        try:
+            self.fila.put_nowait(evento)
+        except asyncio.QueueFull:
+            self.perdeu_eventos = True
+
+    async def proximo(self, timeout):
+        if self.perdeu_eventos:
+            self.perdeu_eventos = False
+            return {'tipo': 'recarregar', 'dados': {}}
+        return await asyncio.wait_for(self.fila.get(), timeout)
+
+
+class MemoriaBackend:
+    """
+    Broker no próprio processo. Serve um servidor ASGI com um worker; com
+    vários processos, use RedisBackend para que todos recebam os eventos.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.assinaturas = set()
+
+    def publicar(self, canal, evento):
+        with self.lock:
+            destinos = [assinatura for assinatura in self.assinaturas if canal in assinatura.canais]
+        for assinatura in destinos:
+            try:
+                assinatura.loop.call_soon_threadsafe(assinatura.entregar, evento)
+            except RuntimeError:
+                # Loop já encerrado: a conexão caiu sem cancelar a assinatura
+                with self.lock:
+                    self.assinaturas.discard(assinatura)
+
+    async def assinar(self, assinatura):
+        with self.lock:
+            self.assinaturas.add(assinatura)
+
+    async def cancelar(self, assinatura):
+        with self.lock:
+            self.assinaturas.discard(assinatura)
+
+
+class RedisBackend:
+    """
+    Pub/sub do Redis (EVENTOS_REDIS_URL) para vários processos. Cada
+    processo repassa as mensagens recebidas para as suas assinaturas.
+    Requer o pacote `redis`.
+    """
+
+    def __init__(self):
+        import redis
+        import redis.asyncio
+
+        self.cliente = redis.Redis.from_url(settings.EVENTOS_REDIS_URL)
+        self.cliente_async = redis.asyncio.Redis.from_url(settings.EVENTOS_REDIS_URL)
+        self.tarefas = {}
+
+    def publicar(self, canal, evento):
+        self.cliente.publish(canal, json.dumps(evento))
+
+    async def assinar(self, assinatura):
+        pubsub = self.cliente_async.pubsub()
+        await pubsub.subscribe(*assinatura.canais)
+
+        async def repassar():
+            async for mensagem in pubsub.listen():
+                if mensagem['type'] == 'message':
+                    assinatura.entregar(json.loads(mensagem['data']))
+
+        self.tarefas[assinatura] = (pubsub, asyncio.create_task(repassar()))
+
+    async def cancelar(self, assinatura):
+        pubsub, tarefa = self.tarefas.pop(assinatura, (None, None))
+        if tarefa:
+            tarefa.cancel()
+            await pubsub.aclose()
+
+
+_backend = None
+_backend_lock = threading.Lock()
+_sequencia = itertools.count(1)
+
+
+def get_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = import_string(settings.EVENTOS_BACKEND)()
+        return _backend
+
+
+def publicar(canais, tipo, **dados):
+    """Publica já, em todos os canais. Use publicar_no_commit dentro de transações."""
+    evento = {'id': next(_sequencia), 'tipo': tipo, 'dados': dados}
+    backend = get_backend()
+    for canal in canais:
+        backend.publicar(canal, evento)
+
+
+def publicar_no_commit(canais, tipo, **dados):
+    """
+    Publica quando a transação confirmar, para nunca anunciar algo desfeito.
+    Uma falha do broker nessa hora é só registrada no log: a escrita já foi
+    confirmada e a resposta não pode virar erro.
+    """
+    transaction.on_commit(lambda: publicar(canais, tipo, **dados), robust=True)
+
+
+def publicar_horario(tipo, medico_id, agenda_id, dia, horario):
+    publicar_no_commit(
+        [canal_medico(medico_id)], tipo,
+        agenda=agenda_id, medico=medico_id, dia=str(dia), horario=str(horario),
+    )
+
+
+def publicar_agenda(medico_id, **dados):
+    """Mudança na grade do médico que não cabe num só horário: o cliente recarrega a agenda."""
+    publicar_no_commit([canal_medico(medico_id)], 'agenda_atualizada', medico=medico_id, **dados)
+
+
+def publicar_consulta(tipo, consulta_id, medico_id, paciente_id, status, versao):
+    publicar_no_commit(
+        [canal_consultas_medico(medico_id), canal_consultas_paciente(paciente_id)], tipo,
+        consulta=consulta_id, status=status, versao=versao,
+    )
+
+
+async def escutar(canais, keepalive):
+    """
+    Gerador assíncrono de eventos dos canais. Produz None a cada
+    `keepalive` segundos sem eventos, para o stream mandar um ping.
+    """
+    backend = get_backend()
+    assinatura = Assinatura(canais)
+    await backend.assinar(assinatura)
+    try:
+        while True:
+            try:
+                yield await assinatura.proximo(keepalive)
+            except asyncio.TimeoutError:
+                yield None
+    finally:
+        await backend.cancelar(assinatura)
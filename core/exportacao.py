@@ -0,0 +1,96 @@
+import csv
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Consulta, ConsultaArquivada
+
+
+TAMANHO_LOTE = 2000
+FORMATOS = ['csv', 'ndjson']
+ORIGENS = ['ativas', 'arquivadas', 'todas']
+
+# Coluna do arquivo -> campo em Consulta e em ConsultaArquivada. Projeção
+# plana com values_list: sem instanciar modelos nem serializers aninhados.
+COLUNAS = {
+    'id': ('id', 'id'),
+    'dia': ('agenda__dia', 'dia'),
+    'horario': ('agenda__horario', 'horario'),
+    'status': ('status', 'status'),
+    'medico_id': ('agenda__medico_id', 'medico_id'),
+    'medico_nome': ('agenda__medico__nome', 'medico__nome'),
+    'medico_crm': ('agenda__medico__crm', 'medico__crm'),
+    'especialidade': ('agenda__medico__especialidade', 'medico__especialidade'),
+    'paciente_id': ('paciente_id', 'paciente_id'),
+    'paciente_nome': ('paciente__nome', 'paciente__nome'),
+    'data_agendamento': ('data_agendamento', 'data_agendamento'),
+    'motivo_cancelamento': ('motivo_cancelamento', 'motivo_cancelamento'),
+}
+
+
+def _filtrar(queryset, prefixo, data_inicio, data_fim, medico_id, status):
+    filtros = {}
+    if data_inicio:
+        filtros[f'{prefixo}dia__gte'] = data_inicio
+    if data_fim:
+        filtros[f'{prefixo}dia__lte'] = data_fim
+    if medico_id:
+        filtros[f'{prefixo}medico_id'] = medico_id
+    if status:
+        filtros['status__in'] = status
+    return queryset.filter(**filtros)
+
+
+def linhas(origem='ativas', data_inicio=None, data_fim=None, medico_id=None, status=None):
+    """
+    Tuplas na ordem de COLUNAS, das consultas ativas e/ou arquivadas.
+    iterator() usa cursor do lado do servidor no PostgreSQL e busca em
+    lotes: a memória fica constante qualquer que seja o número de linhas.
+    Ordena pela chave primária, que o banco percorre pelo índice sem sort.
+    """
+    fontes = []
+    if origem in ('ativas', 'todas'):
+        fontes.append((Consulta.objects.all(), 'agenda__', 0))
+    if origem in ('arquivadas', 'todas'):
+        fontes.append((ConsultaArquivada.objects.all(), '', 1))
+
+    for queryset, prefixo, indice in fontes:
+        campos = [campos[indice] for campos in COLUNAS.values()]
+        consulta = _filtrar(queryset, prefixo, data_inicio, data_fim, medico_id, status)
+        yield from consulta.order_by('id').values_list(*campos).iterator(chunk_size=TAMANHO_LOTE)
+
+
+class _Linhas:
+    """Destino do csv.writer que só devolve a linha formatada."""
+
+    def write(self, valor):
+        return valor
+
+
+def em_csv(tuplas):
+    escritor = csv.writer(_Linhas())
+    lote = [escritor.writerow(list(COLUNAS))]
+    for tupla in tuplas:
+        lote.append(escritor.writerow(tupla))
+        if len(lote) >= TAMANHO_LOTE:
+            yield ''.join(lote)
+            lote = []
+    yield ''.join(lote)
+
+
+def em_ndjson(tuplas):
+    colunas = list(COLUNAS)
+    codificador = DjangoJSONEncoder(ensure_ascii=False)
+    lote = []
+    for tupla in tuplas:
+        lote.append(codificador.encode(dict(zip(colunas, tupla))) + '\n')
+        if len(lote) >= TAMANHO_LOTE:
+            yield ''.join(lote)
+            lote = []
+    if lote:
+        yield ''.join(lote)
+
+
+def exportar(formato, **filtros):
+    """Pedaços de texto do arquivo no formato pedido ('csv' ou 'ndjson')."""
+    gerador = em_csv if formato == 'csv' else em_ndjson
+    return gerador(linhas(**filtros))
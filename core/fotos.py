@@ -0,0 +1,153 @@
+import hashlib
+import logging
+import warnings
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from .cache import invalidar_medico
+from .models import Medico, Paciente
+
+
+logger = logging.getLogger(__name__)
+
+# Variantes geradas para cada foto: nome -> lado do quadrado em pixels
+VARIANTES = {
+    'miniatura': 128,
+    'perfil': 512,
+}
+QUALIDADE_JPEG = 82
+TAMANHO_BLOCO = 64 * 1024
+TAMANHO_LOTE = 50
+FORMATOS_ACEITOS = {'JPEG': '.jpg', 'PNG': '.png', 'WEBP': '.webp', 'GIF': '.gif'}
+
+
+class FotoInvalida(Exception):
+    pass
+
+
+def _hash_arquivo(arquivo):
+    digest = hashlib.sha256()
+    arquivo.seek(0)
+    for bloco in iter(lambda: arquivo.read(TAMANHO_BLOCO), b''):
+        digest.update(bloco)
+    arquivo.seek(0)
+    return digest.hexdigest()
+
+
+def caminho_original(foto_hash, extensao):
+    return f'fotos/originais/{foto_hash[:2]}/{foto_hash}{extensao}'
+
+
+def caminho_variante(foto_hash, variante):
+    return f'fotos/{variante}/{foto_hash[:2]}/{foto_hash}.jpg'
+
+
+def salvar_foto(arquivo):
+    """
+    Grava o upload com nome derivado do SHA-256 do conteúdo, lendo em
+    blocos do arquivo temporário em disco. Se o mesmo conteúdo já foi
+    enviado (por qualquer perfil), reaproveita o arquivo existente.
+    Retorna (nome no storage, hash).
+    """
+    try:
+        # Acima de Image.MAX_IMAGE_PIXELS o Pillow só avisa: aqui o aviso
+        # vira erro, para não deixar a bomba para o worker de variantes
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', Image.DecompressionBombWarning)
+            with Image.open(arquivo) as imagem:
+                formato = imagem.format
+    except (Image.DecompressionBombError, Image.DecompressionBombWarning):
+        raise FotoInvalida('A imagem enviada tem pixels demais.')
+    except (UnidentifiedImageError, OSError):
+        raise FotoInvalida('O arquivo enviado não é uma imagem válida.')
+    if formato not in FORMATOS_ACEITOS:
+        raise FotoInvalida('Formato de imagem não suportado.')
+
+    foto_hash = _hash_arquivo(arquivo)
+    nome = caminho_original(foto_hash, FORMATOS_ACEITOS[formato])
+    if not default_storage.exists(nome):
+        nome = default_storage.save(nome, arquivo)
+    return nome, foto_hash
+
+
+def gerar_variantes(nome, foto_hash):
+    """Gera as variantes redimensionadas e recomprimidas de uma foto."""
+    with default_storage.open(nome, 'rb') as arquivo:
+        with Image.open(arquivo) as imagem:
+            imagem = ImageOps.exif_transpose(imagem).convert('RGB')
+            for variante, lado in VARIANTES.items():
+                destino = caminho_variante(foto_hash, variante)
+                if default_storage.exists(destino):
+                    continue
+                reduzida = ImageOps.fit(imagem, (lado, lado), Image.LANCZOS)
+                saida = BytesIO()
+                reduzida.save(saida, 'JPEG', quality=QUALIDADE_JPEG, optimize=True, progressive=True)
+                default_storage.save(destino, ContentFile(saida.getvalue()))
+
+
+def remover_foto_se_orfa(nome, foto_hash):
+    """
+    Apaga o original e as variantes de uma foto substituída, a menos que
+    outro perfil ainda use o mesmo conteúdo (dedupe por hash).
+    """
+    if not nome:
+        return
+    if foto_hash:
+        if Medico.objects.filter(foto_hash=foto_hash).exists() or Paciente.objects.filter(foto_hash=foto_hash).exists():
+            return
+        for variante in VARIANTES:
+            default_storage.delete(caminho_variante(foto_hash, variante))
+    elif Medico.objects.filter(foto=nome).exists() or Paciente.objects.filter(foto=nome).exists():
+        return
+    default_storage.delete(nome)
+
+
+def processar_fotos_pendentes(tamanho=TAMANHO_LOTE):
+    """
+    Etapa fora da requisição: gera as variantes das fotos ainda não
+    processadas. Fotos antigas, enviadas antes do hash existir, recebem o
+    hash do arquivo já gravado. Retorna (processadas, falhas).
+    """
+    processadas = falhas = 0
+    for model in (Medico, Paciente):
+        pendentes = (
+            model.objects.filter(foto_processada=False)
+            .exclude(foto='').exclude(foto__isnull=True)
+            .only('id', 'foto', 'foto_hash')
+            .order_by('id')[:tamanho]
+        )
+        for perfil in pendentes:
+            foto_hash = perfil.foto_hash
+            try:
+                if not foto_hash:
+                    with default_storage.open(perfil.foto.name, 'rb') as arquivo:
+                        foto_hash = _hash_arquivo(arquivo)
+                gerar_variantes(perfil.foto.name, foto_hash)
+            except (OSError, UnidentifiedImageError) as e:
+                # Arquivo ausente ou corrompido: marca como processada para
+                # não tentar de novo a cada rodada; o serializer usa o original.
+                logger.warning('Erro ao processar foto de %s %s: %s', model.__name__, perfil.id, e)
+                model.objects.filter(pk=perfil.pk, foto=perfil.foto.name).update(foto_hash='', foto_processada=True)
+                falhas += 1
+                continue
+
+            # Só marca se a foto não foi trocada enquanto processava
+            atualizadas = model.objects.filter(pk=perfil.pk, foto=perfil.foto.name).update(
+                foto_hash=foto_hash, foto_processada=True
+            )
+            if atualizadas and model is Medico:
+                invalidar_medico(perfil.pk)
+            processadas += 1
+    return processadas, falhas
+
+
+def url_variante(perfil, variante):
+    """URL da variante, ou da foto original enquanto ela não foi processada."""
+    if not perfil.foto:
+        return None
+    if perfil.foto_processada and perfil.foto_hash:
+        return default_storage.url(caminho_variante(perfil.foto_hash, variante))
+    return perfil.foto.url
@@ -0,0 +1,170 @@
+import csv
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import IntegrityError, transaction
+
+from .authentication import invalidar_usuarios
+from .cache import invalidar_medicos
+from .models import Medico, normalizar_busca
+
+
+TAMANHO_LOTE = 1000
+# O relatório lista só os primeiros erros; o total vem em `com_erro`
+MAX_ERROS_REPORTADOS = 1000
+COLUNAS_OBRIGATORIAS = ['nome', 'crm', 'especialidade']
+CAMPOS_ATUALIZADOS = ['nome', 'especialidade', 'email', 'nome_busca', 'especialidade_busca']
+
+
+class ArquivoInvalido(Exception):
+    pass
+
+
+class Relatorio:
+    def __init__(self):
+        self.criados = 0
+        self.atualizados = 0
+        self.com_erro = 0
+        self.erros = []
+
+    def erro(self, linha, crm, mensagens):
+        self.com_erro += 1
+        if len(self.erros) < MAX_ERROS_REPORTADOS:
+            self.erros.append({'linha': linha, 'crm': crm, 'erros': mensagens})
+
+    def como_dict(self):
+        return {'criados': self.criados, 'atualizados': self.atualizados, 'com_erro': self.com_erro, 'erros': self.erros}
+
+
+def _limpar(registro):
+    """(dados normalizados, lista de erros) de uma linha do CSV."""
+    dados = {
+        'nome': (registro.get('nome') or '').strip(),
+        'crm': (registro.get('crm') or '').strip(),
+        'especialidade': (registro.get('especialidade') or '').strip(),
+        'email': (registro.get('email') or '').strip() or None,
+    }
+    erros = []
+    for campo in COLUNAS_OBRIGATORIAS:
+        limite = Medico._meta.get_field(campo).max_length
+        if not dados[campo]:
+            erros.append(f'{campo} é obrigatório.')
+        elif len(dados[campo]) > limite:
+            erros.append(f'{campo} tem mais de {limite} caracteres.')
+    if dados['email']:
+        try:
+            validate_email(dados['email'])
+        except ValidationError:
+            erros.append('email inválido.')
+    return dados, erros
+
+
+def _gravar(validos):
+    """
+    Upsert do lote pelo CRM com INSERT ... ON CONFLICT: médicos novos são
+    criados, os existentes têm nome, especialidade e e-mail atualizados (o
+    usuário vinculado e a foto ficam como estão). Linha sem e-mail não
+    apaga o e-mail já cadastrado.
+    """
+    # bulk_create não passa pelo Medico.save: os campos de busca vão à mão
+    medicos = [
+        Medico(**dados, nome_busca=normalizar_busca(dados['nome']), especialidade_busca=normalizar_busca(dados['especialidade']))
+        for _, dados in validos
+    ]
+    com_email = [medico for medico in medicos if medico.email]
+    sem_email = [medico for medico in medicos if not medico.email]
+    sem_email_campos = [campo for campo in CAMPOS_ATUALIZADOS if campo != 'email']
+    for medicos, campos in ((com_email, CAMPOS_ATUALIZADOS), (sem_email, sem_email_campos)):
+        if medicos:
+            Medico.objects.bulk_create(medicos, update_conflicts=True, unique_fields=['crm'], update_fields=campos)
+
+
+def _importar_lote(lote, relatorio, vistos_crm, vistos_email):
+    validos = []
+    for numero, registro in lote:
+        dados, erros = _limpar(registro)
+        if dados['crm'] and dados['crm'] in vistos_crm:
+            erros.append(f'CRM repetido no arquivo (linha {vistos_crm[dados["crm"]]}).')
+        if dados['email'] and dados['email'] in vistos_email:
+            erros.append(f'email repetido no arquivo (linha {vistos_email[dados["email"]]}).')
+        if dados['crm']:
+            vistos_crm.setdefault(dados['crm'], numero)
+        if dados['email']:
+            vistos_email.setdefault(dados['email'], numero)
+        if erros:
+            relatorio.erro(numero, dados['crm'], erros)
+        else:
+            validos.append((numero, dados))
+    if not validos:
+        return
+
+    # Duas consultas por lote para a unicidade contra o banco: CRMs que já
+    # existem (serão atualizados) e e-mails que já pertencem a outro CRM.
+    existentes = {
+        crm: (medico_id, user_id)
+        for crm, medico_id, user_id in Medico.objects.filter(crm__in=[dados['crm'] for _, dados in validos])
+        .values_list('crm', 'id', 'user_id')
+    }
+    donos_email = dict(
+        Medico.objects.filter(email__in=[dados['email'] for _, dados in validos if dados['email']])
+        .values_list('email', 'crm')
+    )
+    aceitos = []
+    for numero, dados in validos:
+        dono = donos_email.get(dados['email'])
+        if dono and dono != dados['crm']:
+            relatorio.erro(numero, dados['crm'], [f'email já cadastrado para o CRM {dono}.'])
+        else:
+            aceitos.append((numero, dados))
+
+    try:
+        with transaction.atomic():
+            _gravar(aceitos)
+    except IntegrityError:
+        # Outro processo gravou um CRM/e-mail do lote no meio do caminho:
+        # linha a linha, para saber qual falhou
+        aceitos = _gravar_um_a_um(aceitos, relatorio)
+
+    relatorio.atualizados += sum(1 for _, dados in aceitos if dados['crm'] in existentes)
+    relatorio.criados += sum(1 for _, dados in aceitos if dados['crm'] not in existentes)
+    # bulk_create não dispara os sinais que invalidam o cache: listagens,
+    # busca e perfil dos médicos atualizados, e o usuário vinculado (que
+    # leva o perfil junto)
+    atualizados = [existentes[dados['crm']] for _, dados in aceitos if dados['crm'] in existentes]
+    invalidar_medicos([medico_id for medico_id, _ in atualizados])
+    invalidar_usuarios([user_id for _, user_id in atualizados if user_id])
+
+
+def _gravar_um_a_um(aceitos, relatorio):
+    gravados = []
+    for numero, dados in aceitos:
+        try:
+            with transaction.atomic():
+                _gravar([(numero, dados)])
+        except IntegrityError:
+            relatorio.erro(numero, dados['crm'], ['CRM ou email já cadastrado.'])
+        else:
+            gravados.append((numero, dados))
+    return gravados
+
+
+def importar_medicos(linhas, tamanho=TAMANHO_LOTE):
+    """
+    Importa médicos de um CSV com cabeçalho (nome, crm, especialidade e,
+    opcionalmente, email), lido linha a linha e gravado em lotes. Linhas
+    inválidas não impedem as demais: voltam no relatório com o número da
+    linha no arquivo. Retorna o relatório como dict.
+    """
+    leitor = csv.DictReader(linhas)
+    faltando = [coluna for coluna in COLUNAS_OBRIGATORIAS if coluna not in (leitor.fieldnames or [])]
+    if faltando:
+        raise ArquivoInvalido(f'Colunas obrigatórias ausentes no cabeçalho: {", ".join(faltando)}.')
+
+    relatorio = Relatorio()
+    vistos_crm, vistos_email = {}, {}
+    # line_num conta o cabeçalho e as quebras dentro de aspas: é a linha no arquivo
+    numerados = ((leitor.line_num, registro) for registro in leitor)
+    while lote := list(islice(numerados, tamanho)):
+        _importar_lote(lote, relatorio, vistos_crm, vistos_email)
+    return relatorio.como_dict()
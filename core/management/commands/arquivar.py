@@ -0,0 +1,27 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.arquivamento import TAMANHO_LOTE, arquivar_consultas, purgar_agendas_expiradas, purgar_resumos_expirados
+
+
+class Command(BaseCommand):
+    help = (
+        'Move consultas encerradas antigas para o histórico (ConsultaArquivada) e apaga '
+        'slots de agenda vencidos sem consulta, mantendo Agenda e Consulta pequenas.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dias', type=int, default=180, help='Arquiva consultas encerradas com horário há mais de N dias')
+        parser.add_argument('--dias-agendas', type=int, default=0, help='Apaga slots sem consulta anteriores a hoje menos N dias')
+        parser.add_argument('--lote', type=int, default=TAMANHO_LOTE)
+
+    def handle(self, *args, **options):
+        hoje = timezone.localdate()
+        resumos = purgar_resumos_expirados(hoje)
+        consultas = arquivar_consultas(hoje - timedelta(days=options['dias']), options['lote'])
+        agendas = purgar_agendas_expiradas(hoje - timedelta(days=options['dias_agendas']), options['lote'])
+        self.stdout.write(self.style.SUCCESS(
+            f'{consultas} consultas arquivadas, {agendas} horários vencidos e {resumos} resumos antigos apagados.'
+        ))
@@ -0,0 +1,71 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.benchmark import MISTURA_PADRAO, comparar, rodar
+
+
+class Command(BaseCommand):
+    help = (
+        'Mede latência (p50/p95/p99), vazão e número de queries dos fluxos de navegação e agendamento. '
+        'As operações de escrita alteram o banco: rode contra uma base gerada pelo comando seed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requisicoes', type=int, default=500)
+        parser.add_argument('--concorrencia', type=int, default=1, help='Threads disparando requisições')
+        parser.add_argument('--url', help='Servidor a testar, ex.: http://localhost:8000 (padrão: no próprio processo)')
+        parser.add_argument(
+            '--mistura',
+            help='Pesos das operações, ex.: listar_medicos=30,reservar=10 (operações: %s)' % ', '.join(MISTURA_PADRAO),
+        )
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--senha', default='senha12345', help='Senha dos usuários usados no login')
+        parser.add_argument('--usuarios', type=int, default=20, help='Quantos médicos e pacientes fazem login')
+        parser.add_argument('--aquecimento', type=int, default=20, help='Requisições iniciais descartadas')
+        parser.add_argument('--saida', help='Arquivo JSON onde gravar o relatório')
+        parser.add_argument('--comparar', help='Relatório JSON anterior para comparar')
+
+    def handle(self, *args, **options):
+        mistura = None
+        if options['mistura']:
+            try:
+                mistura = {nome: int(peso) for nome, peso in (item.split('=') for item in options['mistura'].split(','))}
+            except ValueError:
+                raise CommandError('Use o formato operacao=peso,operacao=peso.')
+            desconhecidas = set(mistura) - set(MISTURA_PADRAO)
+            if desconhecidas:
+                raise CommandError(f"Operações desconhecidas: {', '.join(sorted(desconhecidas))}")
+
+        relatorio = rodar(
+            requisicoes=options['requisicoes'],
+            concorrencia=options['concorrencia'],
+            url=options['url'],
+            mistura=mistura,
+            seed=options['seed'],
+            senha=options['senha'],
+            usuarios=options['usuarios'],
+            aquecimento=options['aquecimento'],
+        )
+
+        self.stdout.write(f"{'operação':<18} {'n':>6} {'erros':>6} {'p50':>8} {'p95':>8} {'p99':>8} {'req/s':>8} {'queries':>8}")
+        for nome, dados in [*relatorio['operacoes'].items(), ('total', relatorio['total'])]:
+            self.stdout.write(
+                f"{nome:<18} {dados['requisicoes']:>6} {dados['erros']:>6} {dados['p50_ms'] or '-':>8} "
+                f"{dados['p95_ms'] or '-':>8} {dados['p99_ms'] or '-':>8} {dados['vazao_rps'] or '-':>8} "
+                f"{dados['queries_media'] if dados['queries_media'] is not None else '-':>8}"
+            )
+        if relatorio['puladas']:
+            self.stdout.write(f"Puladas por falta de dados: {relatorio['puladas']}")
+
+        if options['comparar']:
+            with open(options['comparar'], encoding='utf-8') as arquivo:
+                anterior = json.load(arquivo)
+            self.stdout.write('Comparação com o relatório anterior:')
+            for linha in comparar(relatorio, anterior):
+                self.stdout.write(linha)
+
+        if options['saida']:
+            with open(options['saida'], 'w', encoding='utf-8') as arquivo:
+                json.dump(relatorio, arquivo, indent=2, ensure_ascii=False)
+            self.stdout.write(self.style.SUCCESS(f"Relatório gravado em {options['saida']}"))
@@ -0,0 +1,35 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from core.exportacao import FORMATOS, ORIGENS, exportar
+from core.models import Consulta
+
+
+class Command(BaseCommand):
+    help = 'Exporta consultas (com agenda, médico e paciente) em CSV ou NDJSON, em streaming, para relatórios.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--formato', choices=FORMATOS, default='csv')
+        parser.add_argument('--saida', help='Arquivo de destino (padrão: saída padrão)')
+        parser.add_argument('--de', type=date.fromisoformat, dest='data_inicio', help='Dia inicial (AAAA-MM-DD)')
+        parser.add_argument('--ate', type=date.fromisoformat, dest='data_fim', help='Dia final (AAAA-MM-DD)')
+        parser.add_argument('--medico', type=int, dest='medico_id', help='Id do médico')
+        parser.add_argument(
+            '--status', action='append', choices=[codigo for codigo, _ in Consulta.STATUS_CHOICES],
+            help='Status (pode repetir)',
+        )
+        parser.add_argument('--origem', choices=ORIGENS, default='ativas', help='Consultas ativas, arquivadas ou todas')
+
+    def handle(self, *args, **options):
+        filtros = {chave: options[chave] for chave in ('origem', 'data_inicio', 'data_fim', 'medico_id', 'status')}
+        pedacos = exportar(options['formato'], **filtros)
+        if not options['saida']:
+            for pedaco in pedacos:
+                self.stdout.write(pedaco, ending='')
+            return
+
+        with open(options['saida'], 'w', encoding='utf-8', newline='') as arquivo:
+            for pedaco in pedacos:
+                arquivo.write(pedaco)
+        self.stderr.write(self.style.SUCCESS(f'Exportação gravada em {options["saida"]}.'))
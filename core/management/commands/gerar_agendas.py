@@ -0,0 +1,50 @@
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError
+
+from core.agendas import criar_agendas_recorrentes
+from core.models import Medico
+from core.serializers import AgendaRecorrenteSerializer
+
+
+class Command(BaseCommand):
+    help = 'Gera em lote os horários de agenda de um médico a partir de um modelo recorrente.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--crm', required=True, help='CRM do médico')
+        parser.add_argument('--dias', required=True, help='Dias da semana separados por vírgula (segunda = 0), ex.: 0,2,4')
+        parser.add_argument('--inicio', required=True, help='Horário inicial, ex.: 08:00')
+        parser.add_argument('--fim', required=True, help='Horário final, ex.: 12:00')
+        parser.add_argument('--duracao', type=int, default=30, help='Duração de cada horário em minutos')
+        parser.add_argument('--de', required=True, dest='data_inicio', help='Data inicial (AAAA-MM-DD)')
+        parser.add_argument('--ate', required=True, dest='data_fim', help='Data final (AAAA-MM-DD)')
+        parser.add_argument('--excecao', action='append', default=[], help='Data a pular (pode repetir)')
+
+    def handle(self, *args, **options):
+        try:
+            medico = Medico.objects.get(crm=options['crm'])
+        except Medico.DoesNotExist:
+            raise CommandError(f"Médico com CRM {options['crm']} não encontrado.")
+
+        serializer = AgendaRecorrenteSerializer(data={
+            'dias_semana': [d for d in options['dias'].split(',') if d],
+            'hora_inicio': options['inicio'],
+            'hora_fim': options['fim'],
+            'duracao': options['duracao'],
+            'data_inicio': options['data_inicio'],
+            'data_fim': options['data_fim'],
+            'excecoes': options['excecao'],
+        })
+        if not serializer.is_valid():
+            raise CommandError(serializer.errors)
+
+        try:
+            criados, ignorados = criar_agendas_recorrentes(medico.id, **serializer.validated_data)
+        except ValidationError as e:
+            raise CommandError(e.messages[0])
+        except IntegrityError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{criados} horários criados para {medico.nome} ({ignorados} já existiam).'
+        ))
@@ -0,0 +1,31 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.importacao import TAMANHO_LOTE, ArquivoInvalido, importar_medicos
+
+
+class Command(BaseCommand):
+    help = 'Importa médicos de um CSV (nome, crm, especialidade, email), criando ou atualizando pelo CRM em lotes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('arquivo', help='Caminho do CSV, com cabeçalho')
+        parser.add_argument('--lote', type=int, default=TAMANHO_LOTE)
+        parser.add_argument('--encoding', default='utf-8-sig')
+        parser.add_argument('--relatorio', help='Grava o relatório (JSON) neste arquivo')
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['arquivo'], encoding=options['encoding'], newline='') as arquivo:
+                relatorio = importar_medicos(arquivo, options['lote'])
+        except (OSError, ArquivoInvalido) as e:
+            raise CommandError(str(e))
+
+        for erro in relatorio['erros']:
+            self.stderr.write(f'linha {erro["linha"]} ({erro["crm"] or "sem CRM"}): {" ".join(erro["erros"])}')
+        if options['relatorio']:
+            with open(options['relatorio'], 'w', encoding='utf-8') as saida:
+                json.dump(relatorio, saida, ensure_ascii=False, indent=2)
+        self.stdout.write(self.style.SUCCESS(
+            f'{relatorio["criados"]} médicos criados, {relatorio["atualizados"]} atualizados, {relatorio["com_erro"]} linhas com erro.'
+        ))
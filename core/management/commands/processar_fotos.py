@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.fotos import TAMANHO_LOTE, processar_fotos_pendentes
+
+
+class Command(BaseCommand):
+    help = 'Gera as variantes redimensionadas (miniatura e perfil) das fotos de perfil pendentes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=TAMANHO_LOTE, help='Fotos por lote, por tipo de perfil')
+        parser.add_argument('--continuo', action='store_true', help='Continua rodando e procura novas fotos periodicamente')
+        parser.add_argument('--intervalo', type=float, default=5, help='Segundos entre rodadas quando não há fotos pendentes')
+
+    def handle(self, *args, **options):
+        while True:
+            processadas, falhas = processar_fotos_pendentes(options['lote'])
+            if processadas or falhas:
+                self.stdout.write(f'{processadas} fotos processadas, {falhas} falhas.')
+
+            if not options['continuo']:
+                break
+            if not processadas and not falhas:
+                time.sleep(options['intervalo'])
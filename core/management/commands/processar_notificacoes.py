@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.notificacoes import processar_lote
+
+
+class Command(BaseCommand):
+    help = 'Entrega as notificações pendentes do outbox em lotes, com novas tentativas e espera exponencial.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=100, help='Notificações por lote')
+        parser.add_argument('--continuo', action='store_true', help='Continua rodando e consulta o outbox periodicamente')
+        parser.add_argument('--intervalo', type=float, default=5, help='Segundos entre consultas quando o outbox está vazio')
+
+    def handle(self, *args, **options):
+        while True:
+            enviadas, falhas = processar_lote(options['lote'])
+            if enviadas or falhas:
+                self.stdout.write(f'{enviadas} enviadas, {falhas} falhas.')
+
+            if not options['continuo']:
+                break
+            # Lote cheio: provavelmente há mais na fila, não espera
+            if enviadas + falhas < options['lote']:
+                time.sleep(options['intervalo'])
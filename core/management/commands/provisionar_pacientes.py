@@ -0,0 +1,66 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, transaction
+
+from core.models import Paciente, dados_paciente_provisorio
+
+
+TENTATIVAS = 3
+
+
+class Command(BaseCommand):
+    help = 'Cria o perfil de Paciente dos usuários que não têm perfil de médico nem de paciente.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=1000, help='Quantidade de usuários por inserção')
+
+    def pacientes(self, bloco):
+        # E-mail de Paciente é único: quem colidir fica sem e-mail no perfil
+        emails = {user.email for user in bloco if user.email}
+        em_uso = set(Paciente.objects.filter(email__in=emails).values_list('email', flat=True))
+        pacientes = []
+        for user in bloco:
+            dados = dados_paciente_provisorio(user)
+            if dados['email'] in em_uso:
+                dados['email'] = None
+            elif dados['email']:
+                em_uso.add(dados['email'])
+            pacientes.append(Paciente(**dados))
+        return pacientes
+
+    def criar(self, bloco):
+        """
+        Cria os perfis do bloco e retorna quantos entraram de fato. Sem
+        ignore_conflicts, que contaria como criados os perfis que um cadastro
+        concorrente criou antes: numa colisão o bloco volta no savepoint e é
+        refeito só com quem continua sem perfil.
+        """
+        for _ in range(TENTATIVAS):
+            com_perfil = set(Paciente.objects.filter(user__in=bloco).values_list('user_id', flat=True))
+            pacientes = self.pacientes([user for user in bloco if user.id not in com_perfil])
+            try:
+                with transaction.atomic():
+                    Paciente.objects.bulk_create(pacientes)
+            except IntegrityError:
+                continue
+            return len(pacientes)
+        raise CommandError('Perfis alterados por outro processo durante o provisionamento; rode o comando de novo.')
+
+    def handle(self, *args, **options):
+        lote = options['lote']
+        usuarios = (
+            User.objects.filter(medico__isnull=True, paciente__isnull=True)
+            .only('id', 'username', 'email')
+            .order_by('id')
+        )
+
+        total = 0
+        ultimo_id = 0
+        while True:
+            bloco = list(usuarios.filter(id__gt=ultimo_id)[:lote])
+            if not bloco:
+                break
+            ultimo_id = bloco[-1].id
+            total += self.criar(bloco)
+
+        self.stdout.write(self.style.SUCCESS(f'{total} perfis de paciente criados.'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core.disponibilidade import reconstruir_disponibilidade
+
+
+class Command(BaseCommand):
+    help = 'Reconstrói o resumo de horários livres (ResumoDisponibilidade) a partir da tabela de Agenda.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--medico', type=int, action='append', dest='medicos', help='Id do médico (pode repetir)')
+
+    def handle(self, *args, **options):
+        total = reconstruir_disponibilidade(options['medicos'])
+        self.stdout.write(self.style.SUCCESS(f'{total} linhas de resumo geradas.'))
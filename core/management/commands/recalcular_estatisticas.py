@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core.estatisticas import reconstruir_estatisticas
+
+
+class Command(BaseCommand):
+    help = 'Reconstrói os contadores do painel (EstatisticaDiaria) a partir das consultas e do histórico arquivado.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--medico', type=int, action='append', dest='medicos', help='Id do médico (pode repetir)')
+
+    def handle(self, *args, **options):
+        total = reconstruir_estatisticas(options['medicos'])
+        self.stdout.write(self.style.SUCCESS(f'{total} linhas de estatística geradas.'))
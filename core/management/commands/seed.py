@@ -0,0 +1,249 @@
+import io
+import json
+import random
+from datetime import date, datetime, time, timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from core.cache import invalidar_agenda, invalidar_medico
+from core.disponibilidade import reconstruir_disponibilidade
+from core.estatisticas import reconstruir_estatisticas
+from core.models import Agenda, Consulta, Medico, Paciente, normalizar_busca
+
+
+NOMES = [
+    'Ana', 'Beatriz', 'Bruno', 'Camila', 'Carlos', 'Daniel', 'Eduarda', 'Felipe', 'Fernanda', 'Gabriel',
+    'Helena', 'Igor', 'Isabela', 'João', 'Júlia', 'Larissa', 'Lucas', 'Marcos', 'Mariana', 'Matheus',
+    'Natália', 'Otávio', 'Patrícia', 'Pedro', 'Rafael', 'Renata', 'Rodrigo', 'Sofia', 'Thiago', 'Vitória',
+]
+SOBRENOMES = [
+    'Almeida', 'Araújo', 'Barbosa', 'Cardoso', 'Carvalho', 'Costa', 'Dias', 'Ferreira', 'Gomes', 'Lima',
+    'Martins', 'Melo', 'Oliveira', 'Pereira', 'Ribeiro', 'Rocha', 'Santos', 'Silva', 'Souza', 'Teixeira',
+]
+ESPECIALIDADES = [
+    'Cardiologista', 'Dermatologista', 'Ortopedista', 'Pediatra', 'Clínico Geral', 'Neurologista',
+    'Oftalmologista', 'Ginecologista', 'Psiquiatra', 'Endocrinologista', 'Urologista', 'Otorrinolaringologista',
+]
+MOTIVOS = ['Imprevisto pessoal', 'Médico indisponível', 'Paciente remarcou', 'Agenda em conflito']
+
+# Pesos de status para consultas em horários passados e futuros
+STATUS_PASSADO = {'FINALIZADA': 75, 'CANCELADA': 12, 'REJEITADA': 8, 'AGENDADA': 3, 'PENDENTE': 2}
+STATUS_FUTURO = {'PENDENTE': 50, 'AGENDADA': 40, 'CANCELADA': 7, 'REJEITADA': 3}
+
+
+def _valor_copy(valor):
+    if valor is None:
+        return '\\N'
+    if isinstance(valor, bool):
+        return 't' if valor else 'f'
+    if isinstance(valor, (dict, list)):
+        valor = json.dumps(valor)
+    return str(valor).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+class Escritor:
+    """
+    Insere linhas (dicts por attname) em lotes: COPY no PostgreSQL e
+    bulk_create nos demais bancos. Campos não informados recebem o
+    default do model, e os auto_now/auto_now_add, o momento atual.
+    """
+
+    def __init__(self, lote):
+        self.lote = lote
+        self.copy = connection.vendor == 'postgresql'
+        self.totais = {}
+
+    def inserir(self, model, linhas):
+        if not linhas:
+            return
+        if self.copy:
+            self._copy(model, linhas)
+        else:
+            model.objects.bulk_create([model(**linha) for linha in linhas], batch_size=self.lote)
+        self.totais[model] = self.totais.get(model, 0) + len(linhas)
+
+    def _copy(self, model, linhas):
+        campos = model._meta.concrete_fields
+        instancia = model()
+        buffer = io.StringIO()
+        for linha in linhas:
+            buffer.write('\t'.join(_valor_copy(valor) for valor in self._valores(campos, instancia, linha)) + '\n')
+        buffer.seek(0)
+
+        colunas = ', '.join(connection.ops.quote_name(campo.column) for campo in campos)
+        sql = f'COPY {connection.ops.quote_name(model._meta.db_table)} ({colunas}) FROM STDIN'
+        with connection.cursor() as cursor:
+            bruto = cursor.cursor
+            if hasattr(bruto, 'copy'):  # psycopg 3
+                with bruto.copy(sql) as copy:
+                    copy.write(buffer.getvalue())
+            else:  # psycopg2
+                bruto.copy_expert(sql, buffer)
+
+    def _valores(self, campos, instancia, linha):
+        # O COPY não passa por pre_save: sem isto, um auto_now não informado
+        # iria como NULL
+        valores = []
+        for campo in campos:
+            if campo.attname in linha:
+                valor = linha[campo.attname]
+            elif getattr(campo, 'auto_now', False) or getattr(campo, 'auto_now_add', False):
+                valor = campo.pre_save(instancia, add=True)
+            else:
+                valor = campo.get_default()
+            valores.append(campo.get_db_prep_save(valor, connection))
+        return valores
+
+
+class Command(BaseCommand):
+    help = (
+        'Gera dados sintéticos e determinísticos (médicos, pacientes, usuários, agendas e consultas) '
+        'com inserções em lote, para reproduzir tabelas do tamanho de produção.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--medicos', type=int, default=100)
+        parser.add_argument('--pacientes', type=int, default=1000)
+        parser.add_argument('--meses-passados', type=int, default=6, help='Meses de histórico antes de hoje')
+        parser.add_argument('--meses-futuros', type=int, default=2, help='Meses de agenda depois de hoje')
+        parser.add_argument('--duracao', type=int, default=30, help='Duração de cada horário em minutos')
+        parser.add_argument('--ocupacao', type=float, default=0.5, help='Fração dos horários com consulta (0 a 1)')
+        parser.add_argument('--seed', type=int, default=42, help='Semente do gerador pseudoaleatório')
+        parser.add_argument('--lote', type=int, default=5000, help='Linhas por inserção')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        escritor = Escritor(options['lote'])
+        hoje = timezone.now().date()
+        inicio = hoje - timedelta(days=30 * options['meses_passados'])
+        fim = hoje + timedelta(days=30 * options['meses_futuros'])
+        horarios = self._horarios(options['duracao'])
+        senha = make_password('senha12345')
+
+        with transaction.atomic():
+            proximo = {
+                model: (model.objects.aggregate(maior=Max('id'))['maior'] or 0) + 1
+                for model in (User, Medico, Paciente, Agenda, Consulta)
+            }
+
+            medico_ids = self._perfis(escritor, rng, proximo, senha, options['medicos'], 'medico')
+            paciente_ids = self._perfis(escritor, rng, proximo, senha, options['pacientes'], 'paciente')
+            self._agendas(escritor, rng, proximo, medico_ids, paciente_ids, inicio, fim, hoje, horarios, options)
+
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(no_style(), [User, Medico, Paciente, Agenda, Consulta]):
+                    cursor.execute(sql)
+
+            reconstruir_disponibilidade(medico_ids)
+            reconstruir_estatisticas(medico_ids)
+            invalidar_medico(None)
+            invalidar_agenda(None)
+
+        for model, total in escritor.totais.items():
+            self.stdout.write(f'{model.__name__}: {total} linhas')
+        self.stdout.write(self.style.SUCCESS('Dados sintéticos gerados.'))
+
+    def _horarios(self, duracao):
+        horarios = []
+        atual = datetime.combine(date.min, time(8, 0))
+        while atual.time() < time(18, 0):
+            if not time(12, 0) <= atual.time() < time(13, 0):
+                horarios.append(atual.time())
+            atual += timedelta(minutes=duracao)
+        return horarios
+
+    def _perfis(self, escritor, rng, proximo, senha, quantidade, tipo):
+        model = Medico if tipo == 'medico' else Paciente
+        agora = timezone.now()
+        ids = []
+        usuarios, perfis = [], []
+
+        for _ in range(quantidade):
+            user_id, perfil_id = proximo[User], proximo[model]
+            proximo[User] += 1
+            proximo[model] += 1
+            ids.append(perfil_id)
+
+            nome = f'{rng.choice(NOMES)} {rng.choice(SOBRENOMES)}'
+            email = f'{tipo}{perfil_id}@seed.grumosmed.dev'
+            usuarios.append({
+                'id': user_id, 'username': f'{tipo}{perfil_id}', 'email': email,
+                'password': senha, 'date_joined': agora,
+            })
+            if tipo == 'medico':
+                especialidade = rng.choice(ESPECIALIDADES)
+                perfis.append({
+                    'id': perfil_id, 'user_id': user_id, 'nome': nome, 'email': email,
+                    'crm': f'SEED{perfil_id:08d}', 'especialidade': especialidade,
+                    'nome_busca': normalizar_busca(nome), 'especialidade_busca': normalizar_busca(especialidade),
+                })
+            else:
+                perfis.append({
+                    'id': perfil_id, 'user_id': user_id, 'nome': nome, 'email': email,
+                    'cpf': f'{perfil_id:011d}', 'telefone': f'11{rng.randrange(10**8, 10**9)}',
+                })
+
+            if len(perfis) >= escritor.lote:
+                escritor.inserir(User, usuarios)
+                escritor.inserir(model, perfis)
+                usuarios, perfis = [], []
+
+        escritor.inserir(User, usuarios)
+        escritor.inserir(model, perfis)
+        return ids
+
+    def _agendas(self, escritor, rng, proximo, medico_ids, paciente_ids, inicio, fim, hoje, horarios, options):
+        agendas, consultas = [], []
+        status_passado = (list(STATUS_PASSADO), list(STATUS_PASSADO.values()))
+        status_futuro = (list(STATUS_FUTURO), list(STATUS_FUTURO.values()))
+
+        for medico_id in medico_ids:
+            # Cada médico atende em 3 a 5 dias úteis fixos da semana
+            dias_semana = set(rng.sample(range(5), rng.randint(3, 5)))
+            dia = inicio
+            while dia <= fim:
+                if dia.weekday() in dias_semana:
+                    for horario in horarios:
+                        agenda_id = proximo[Agenda]
+                        proximo[Agenda] += 1
+                        livre = True
+                        if paciente_ids and rng.random() < options['ocupacao']:
+                            consulta = self._consulta(rng, proximo, agenda_id, paciente_ids, dia, horario, hoje, status_passado, status_futuro)
+                            consultas.append(consulta)
+                            # Canceladas e rejeitadas devolvem o horário
+                            livre = consulta['status'] in Consulta.STATUS_QUE_LIBERAM
+                        agendas.append({
+                            'id': agenda_id, 'medico_id': medico_id, 'dia': dia,
+                            'horario': horario, 'disponivel': livre,
+                        })
+                dia += timedelta(days=1)
+
+            if len(agendas) >= escritor.lote:
+                escritor.inserir(Agenda, agendas)
+                escritor.inserir(Consulta, consultas)
+                agendas, consultas = [], []
+
+        escritor.inserir(Agenda, agendas)
+        escritor.inserir(Consulta, consultas)
+
+    def _consulta(self, rng, proximo, agenda_id, paciente_ids, dia, horario, hoje, status_passado, status_futuro):
+        consulta_id = proximo[Consulta]
+        proximo[Consulta] += 1
+        opcoes, pesos = status_passado if dia < hoje else status_futuro
+        status = rng.choices(opcoes, pesos)[0]
+        quando = timezone.make_aware(datetime.combine(dia, horario)) - timedelta(days=rng.randint(1, 30), minutes=rng.randint(0, 600))
+        return {
+            'id': consulta_id,
+            'agenda_id': agenda_id,
+            'paciente_id': rng.choice(paciente_ids),
+            'data_agendamento': quando,
+            'atualizada_em': quando,
+            'status': status,
+            'motivo_cancelamento': rng.choice(MOTIVOS) if status in ('CANCELADA', 'REJEITADA') else None,
+        }
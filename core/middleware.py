@@ -0,0 +1,252 @@
+import logging
+import random
+import time
+import traceback
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from . import replicas
+from .authentication import PerfilJWTAuthentication
+
+
+logger = logging.getLogger('core.requisicoes')
+logger_sql = logging.getLogger('core.sql_lento')
+
+MAX_SQL_LENTO_POR_REQUISICAO = 5
+QUADROS_DE_ORIGEM = 4
+
+
+def _origem():
+    """Últimos quadros da pilha que pertencem ao projeto (fora de bibliotecas e deste módulo)."""
+    base = str(settings.BASE_DIR)
+    quadros = [
+        quadro for quadro in traceback.extract_stack()
+        if quadro.filename.startswith(base)
+        and 'site-packages' not in quadro.filename
+        and quadro.filename != __file__
+    ]
+    return [f'{quadro.filename[len(base) + 1:]}:{quadro.lineno} em {quadro.name}' for quadro in quadros[-QUADROS_DE_ORIGEM:]]
+
+
+class Metricas:
+    """
+    Acumula número de queries e tempo de banco de uma requisição. É
+    instalado como execute_wrapper em cada conexão, então custa duas
+    leituras de relógio por query; a pilha só é extraída para queries
+    acima de INSTRUMENTACAO_SQL_LENTO_MS que caírem na amostragem.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.tempo_db = 0.0
+        self.sql_lento = []
+        self.inicio_view = None
+        self.fim_view = None
+        self.fim_render = None
+
+    def __call__(self, execute, sql, params, many, context):
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duracao = time.perf_counter() - inicio
+            self.queries += 1
+            self.tempo_db += duracao
+            if (
+                duracao * 1000 >= settings.INSTRUMENTACAO_SQL_LENTO_MS
+                and len(self.sql_lento) < MAX_SQL_LENTO_POR_REQUISICAO
+                and random.random() < settings.INSTRUMENTACAO_AMOSTRAGEM_SQL_LENTO
+            ):
+                self.sql_lento.append({
+                    'sql': sql[:1000],
+                    'ms': round(duracao * 1000, 2),
+                    'banco': context['connection'].alias,
+                    'origem': _origem(),
+                })
+
+
+def orcamento(caminho):
+    """(máximo de queries, máximo de ms) para o caminho, pelo prefixo mais longo em INSTRUMENTACAO_ORCAMENTOS."""
+    limites = (settings.INSTRUMENTACAO_MAX_QUERIES, settings.INSTRUMENTACAO_MAX_MS)
+    prefixos = [prefixo for prefixo in settings.INSTRUMENTACAO_ORCAMENTOS if caminho.startswith(prefixo)]
+    if prefixos:
+        especifico = settings.INSTRUMENTACAO_ORCAMENTOS[max(prefixos, key=len)]
+        limites = (especifico.get('queries', limites[0]), especifico.get('ms', limites[1]))
+    return limites
+
+
+class InstrumentacaoMiddleware:
+    """
+    Mede cada requisição: queries e tempo de banco, tempo da view e tempo
+    de renderização (serialização da resposta do DRF), e devolve tudo no
+    cabeçalho Server-Timing e numa linha de log `core.requisicoes`.
+    Requisições acima do orçamento são registradas como WARNING, e o SQL
+    lento amostrado vai para `core.sql_lento` com a origem no código.
+
+    Deve ficar no topo de MIDDLEWARE para medir toda a pilha. Funciona em
+    WSGI e em ASGI sem adaptação (ver __acall__).
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        metricas = request.metricas = Metricas()
+        inicio = time.perf_counter()
+        with self.instalar(metricas):
+            response = self.get_response(request)
+        return self.finalizar(request, response, metricas, inicio)
+
+    async def __acall__(self, request):
+        # As conexões são por thread: o wrapper é instalado na thread em que
+        # o código síncrono da requisição roda (sync_to_async thread-sensitive)
+        metricas = request.metricas = Metricas()
+        inicio = time.perf_counter()
+        pilha = await sync_to_async(self.instalar)(metricas)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(pilha.close)()
+        return self.finalizar(request, response, metricas, inicio)
+
+    def instalar(self, metricas):
+        pilha = ExitStack()
+        for alias in connections:
+            pilha.enter_context(connections[alias].execute_wrapper(metricas))
+        return pilha
+
+    def finalizar(self, request, response, metricas, inicio):
+        fim = time.perf_counter()
+
+        fim_view = metricas.fim_view or fim
+        tempos = {
+            'db': metricas.tempo_db * 1000,
+            'view': (fim_view - (metricas.inicio_view or inicio)) * 1000,
+            'render': ((metricas.fim_render or fim_view) - fim_view) * 1000,
+            'total': (fim - inicio) * 1000,
+        }
+        if settings.INSTRUMENTACAO_SERVER_TIMING:
+            response['Server-Timing'] = ', '.join([
+                f'db;dur={tempos["db"]:.1f};desc="{metricas.queries} queries"',
+                f'view;dur={tempos["view"]:.1f}',
+                f'render;dur={tempos["render"]:.1f}',
+                f'total;dur={tempos["total"]:.1f}',
+            ])
+
+        self.registrar(request, response, metricas, tempos)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.metricas.inicio_view = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        # Respostas do DRF são renderizadas depois daqui: o que vier até o
+        # callback pós-render é tempo de serialização.
+        metricas = request.metricas
+        metricas.fim_view = time.perf_counter()
+
+        def marcar_render(resposta):
+            metricas.fim_render = time.perf_counter()
+
+        response.add_post_render_callback(marcar_render)
+        return response
+
+    def registrar(self, request, response, metricas, tempos):
+        max_queries, max_ms = orcamento(request.path)
+        excedeu = []
+        if max_queries is not None and metricas.queries > max_queries:
+            excedeu.append(f'queries>{max_queries}')
+        if max_ms is not None and tempos['total'] > max_ms:
+            excedeu.append(f'ms>{max_ms}')
+
+        dados = {
+            'metodo': request.method,
+            'caminho': request.path,
+            'status': response.status_code,
+            'queries': metricas.queries,
+            **{f'{nome}_ms': round(valor, 1) for nome, valor in tempos.items()},
+            'orcamento_excedido': excedeu,
+        }
+        linha = ' '.join(f'{chave}={valor}' for chave, valor in dados.items() if chave != 'orcamento_excedido')
+        if excedeu:
+            logger.warning('%s orcamento_excedido=%s', linha, ','.join(excedeu), extra={'metricas': dados})
+        else:
+            logger.info(linha, extra={'metricas': dados})
+
+        for amostra in metricas.sql_lento:
+            logger_sql.warning(
+                'sql_lento ms=%s banco=%s caminho=%s sql=%r origem=%s',
+                amostra['ms'], amostra['banco'], request.path, amostra['sql'], ' <- '.join(reversed(amostra['origem'])),
+                extra={'sql_lento': amostra},
+            )
+
+
+class ReplicasMiddleware:
+    """
+    Leitura das próprias escritas com réplicas (core/replicas.py): uma
+    escrita bem-sucedida fixa o usuário no primário por alguns segundos, e
+    as requisições dele nesse intervalo leem do primário. O usuário vem do
+    access token, validado aqui porque a autenticação do DRF só roda
+    dentro da view. Sem DATABASE_REPLICAS, não faz nada.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not replicas.replicas():
+            return self.get_response(request)
+
+        user_id, escrita, fixado = self.preparar(request)
+        with replicas.fixar_no_primario(fixado):
+            response = self.get_response(request)
+        self.concluir(user_id, escrita, response)
+        return response
+
+    async def __acall__(self, request):
+        if not replicas.replicas():
+            return await self.get_response(request)
+
+        # O fixado está no cache: consultado fora do event loop
+        user_id, escrita, fixado = await sync_to_async(self.preparar)(request)
+        with replicas.fixar_no_primario(fixado):
+            response = await self.get_response(request)
+        await sync_to_async(self.concluir)(user_id, escrita, response)
+        return response
+
+    def preparar(self, request):
+        user_id = self.usuario(request)
+        escrita = request.method not in ('GET', 'HEAD', 'OPTIONS')
+        return user_id, escrita, escrita or (user_id is not None and replicas.usuario_fixado(user_id))
+
+    def concluir(self, user_id, escrita, response):
+        if escrita and user_id is not None and response.status_code < 400:
+            replicas.fixar_usuario(user_id)
+
+    def usuario(self, request):
+        # O token validado aqui fica na requisição e a autenticação do DRF
+        # não confere a assinatura de novo
+        try:
+            token = PerfilJWTAuthentication().token_da_requisicao(request)
+        except (InvalidToken, AuthenticationFailed):
+            return None
+        return token and token.get(api_settings.USER_ID_CLAIM)
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_paciente_foto'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='agenda',
+            index=models.Index(condition=models.Q(('disponivel', True)), fields=['medico', 'dia', 'horario', 'id'], name='agenda_livre_medico_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='agenda',
+            index=models.Index(condition=models.Q(('disponivel', True)), fields=['dia', 'horario', 'id'], name='agenda_livre_dia_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='consulta',
+            index=models.Index(fields=['paciente', 'status'], name='consulta_paciente_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='consulta',
+            index=models.Index(fields=['status', 'data_agendamento'], name='consulta_status_data_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='consulta',
+            index=models.Index(condition=models.Q(('status', 'PENDENTE')), fields=['agenda'], name='consulta_pendente_idx'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Min
+from django.db.models.functions import ExtractHour
+
+
+def preencher_resumo(apps, schema_editor):
+    Agenda = apps.get_model('core', 'Agenda')
+    ResumoDisponibilidade = apps.get_model('core', 'ResumoDisponibilidade')
+
+    grupos = (
+        Agenda.objects.filter(disponivel=True)
+        .annotate(hora=ExtractHour('horario'))
+        .values('medico_id', 'dia', 'hora')
+        .annotate(livres=Count('id'), primeiro_horario=Min('horario'))
+        .order_by()
+    )
+    resumos = []
+    for grupo in grupos:
+        primeira = Agenda.objects.filter(
+            medico_id=grupo['medico_id'], dia=grupo['dia'], horario=grupo['primeiro_horario']
+        ).values_list('id', flat=True).first()
+        resumos.append(ResumoDisponibilidade(primeira_agenda_id=primeira, **grupo))
+    ResumoDisponibilidade.objects.bulk_create(resumos, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_indices_agenda_consulta'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumoDisponibilidade',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dia', models.DateField()),
+                ('hora', models.PositiveSmallIntegerField()),
+                ('livres', models.PositiveIntegerField(default=0)),
+                ('primeiro_horario', models.TimeField(blank=True, null=True)),
+                ('medico', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='resumos_disponibilidade', to='core.medico')),
+                ('primeira_agenda', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.agenda')),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('livres__gt', 0)), fields=['dia', 'hora', 'medico'], name='resumo_livre_dia_idx')],
+                'unique_together': {('medico', 'dia', 'hora')},
+            },
+        ),
+        migrations.RunPython(preencher_resumo, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_notificacao'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='medico',
+            name='foto_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='medico',
+            name='foto_processada',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='paciente',
+            name='foto_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='paciente',
+            name='foto_processada',
+            field=models.BooleanField(default=False),
+        ),
+    ]
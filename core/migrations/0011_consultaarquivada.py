@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_foto_variantes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConsultaArquivada',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('dia', models.DateField()),
+                ('horario', models.TimeField()),
+                ('status', models.CharField(choices=[('PENDENTE', 'Pendente'), ('REJEITADA', 'Rejeitada'), ('AGENDADA', 'Agendada'), ('FINALIZADA', 'Finalizada'), ('CANCELADA', 'Cancelada')], max_length=10)),
+                ('data_agendamento', models.DateTimeField(blank=True, null=True)),
+                ('observacoes', models.TextField(blank=True, null=True)),
+                ('observacoes_paciente', models.TextField(blank=True)),
+                ('prontuario_medico', models.TextField(blank=True, null=True)),
+                ('motivo_cancelamento', models.TextField(blank=True, null=True)),
+                ('arquivado_em', models.DateTimeField(auto_now_add=True)),
+                ('medico', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='consultas_arquivadas', to='core.medico')),
+                ('paciente', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='consultas_arquivadas', to='core.paciente')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['paciente', 'dia', 'horario', 'id'], name='arquivada_paciente_idx'), models.Index(fields=['medico', 'dia', 'horario', 'id'], name='arquivada_medico_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:35
+
+from datetime import date
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Min
+from django.db.models.functions import ExtractHour
+
+
+LIBERAM = ['CANCELADA', 'REJEITADA']
+
+
+def liberar_horarios_cancelados(apps, schema_editor):
+    """
+    Até aqui cancelar ou rejeitar não devolvia o horário. Libera os slots
+    futuros cujas consultas estão todas canceladas/rejeitadas e refaz o
+    resumo de disponibilidade dos médicos afetados.
+    """
+    Agenda = apps.get_model('core', 'Agenda')
+    Consulta = apps.get_model('core', 'Consulta')
+    ResumoDisponibilidade = apps.get_model('core', 'ResumoDisponibilidade')
+
+    ocupadas = Consulta.objects.exclude(status__in=LIBERAM).exclude(agenda__isnull=True).values('agenda_id')
+    liberar = Agenda.objects.filter(
+        disponivel=False, dia__gte=date.today(), consultas__status__in=LIBERAM
+    ).exclude(id__in=ocupadas)
+    medico_ids = set(liberar.values_list('medico_id', flat=True))
+    if not medico_ids:
+        return
+    Agenda.objects.filter(id__in=liberar.values('id')).update(disponivel=True)
+
+    ResumoDisponibilidade.objects.filter(medico_id__in=medico_ids).delete()
+    grupos = (
+        Agenda.objects.filter(disponivel=True, medico_id__in=medico_ids)
+        .annotate(hora=ExtractHour('horario'))
+        .values('medico_id', 'dia', 'hora')
+        .annotate(livres=Count('id'), primeiro_horario=Min('horario'))
+        .order_by()
+    )
+    resumos = []
+    for grupo in grupos:
+        primeira = Agenda.objects.filter(
+            medico_id=grupo['medico_id'], dia=grupo['dia'], horario=grupo['primeiro_horario']
+        ).values_list('id', flat=True).first()
+        resumos.append(ResumoDisponibilidade(primeira_agenda_id=primeira, **grupo))
+    ResumoDisponibilidade.objects.bulk_create(resumos, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_consultaarquivada'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='consulta',
+            name='versao',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AlterField(
+            model_name='consulta',
+            name='agenda',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='consultas', to='core.agenda'),
+        ),
+        migrations.AddConstraint(
+            model_name='consulta',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['CANCELADA', 'REJEITADA']), _negated=True), fields=('agenda',), name='consulta_agenda_ocupada_uniq'),
+        ),
+        migrations.RunPython(liberar_horarios_cancelados, migrations.RunPython.noop),
+    ]
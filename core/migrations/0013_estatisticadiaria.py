@@ -0,0 +1,60 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+
+CAMPO_POR_STATUS = {
+    'PENDENTE': 'pendentes',
+    'AGENDADA': 'agendadas',
+    'FINALIZADA': 'finalizadas',
+    'CANCELADA': 'canceladas',
+    'REJEITADA': 'rejeitadas',
+}
+
+
+def contar_consultas_existentes(apps, schema_editor):
+    """Preenche os contadores com as consultas e o histórico arquivado que já existem."""
+    Consulta = apps.get_model('core', 'Consulta')
+    ConsultaArquivada = apps.get_model('core', 'ConsultaArquivada')
+    EstatisticaDiaria = apps.get_model('core', 'EstatisticaDiaria')
+
+    linhas = {}
+    grupos = [
+        Consulta.objects.filter(agenda__isnull=False).values_list('agenda__medico_id', 'agenda__dia', 'status'),
+        ConsultaArquivada.objects.filter(medico__isnull=False).values_list('medico_id', 'dia', 'status'),
+    ]
+    for grupo in grupos:
+        for medico_id, dia, status, total in grupo.annotate(total=Count('id')).order_by():
+            linha = linhas.setdefault((medico_id, dia), EstatisticaDiaria(medico_id=medico_id, dia=dia))
+            campo = CAMPO_POR_STATUS[status]
+            setattr(linha, campo, getattr(linha, campo) + total)
+    EstatisticaDiaria.objects.bulk_create(linhas.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_consulta_versao_transicoes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EstatisticaDiaria',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dia', models.DateField()),
+                ('pendentes', models.IntegerField(default=0)),
+                ('agendadas', models.IntegerField(default=0)),
+                ('finalizadas', models.IntegerField(default=0)),
+                ('canceladas', models.IntegerField(default=0)),
+                ('rejeitadas', models.IntegerField(default=0)),
+                ('medico', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='estatisticas', to='core.medico')),
+            ],
+            options={
+                'unique_together': {('medico', 'dia')},
+            },
+        ),
+        migrations.RunPython(contar_consultas_existentes, migrations.RunPython.noop),
+    ]
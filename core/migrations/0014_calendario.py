@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_estatisticadiaria'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='consulta',
+            name='atualizada_em',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='medico',
+            name='token_calendario',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:05
+
+import re
+import unicodedata
+
+from django.db import migrations, models
+
+
+def normalizar(texto):
+    sem_acentos = unicodedata.normalize('NFKD', texto or '').encode('ascii', 'ignore').decode('ascii')
+    return ' '.join(re.sub(r'[^a-z0-9]+', ' ', sem_acentos.lower()).split())
+
+
+def preencher_busca(apps, schema_editor):
+    Medico = apps.get_model('core', 'Medico')
+    lote = []
+    for medico in Medico.objects.only('id', 'nome', 'especialidade').iterator(chunk_size=1000):
+        medico.nome_busca = normalizar(medico.nome)
+        medico.especialidade_busca = normalizar(medico.especialidade)
+        lote.append(medico)
+        if len(lote) >= 1000:
+            Medico.objects.bulk_update(lote, ['nome_busca', 'especialidade_busca'])
+            lote = []
+    Medico.objects.bulk_update(lote, ['nome_busca', 'especialidade_busca'])
+
+
+def criar_indices_trigrama(apps, schema_editor):
+    # Só no PostgreSQL: GIN com pg_trgm atende LIKE 'termo%' e '% termo%'.
+    # CREATE EXTENSION pede um usuário com permissão (ou a extensão já criada).
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute('CREATE INDEX IF NOT EXISTS medico_nome_trgm_idx ON core_medico USING gin (nome_busca gin_trgm_ops)')
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS medico_especialidade_trgm_idx ON core_medico USING gin (especialidade_busca gin_trgm_ops)'
+    )
+
+
+def remover_indices_trigrama(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS medico_nome_trgm_idx')
+    schema_editor.execute('DROP INDEX IF EXISTS medico_especialidade_trgm_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_calendario'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='medico',
+            name='especialidade_busca',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='medico',
+            name='nome_busca',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddIndex(
+            model_name='medico',
+            index=models.Index(fields=['nome_busca'], name='medico_nome_busca_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='medico',
+            index=models.Index(fields=['especialidade_busca'], name='medico_especialidade_busca_idx'),
+        ),
+        migrations.RunPython(preencher_busca, migrations.RunPython.noop),
+        migrations.RunPython(criar_indices_trigrama, remover_indices_trigrama),
+    ]
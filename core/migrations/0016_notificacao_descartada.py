@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_busca_medicos'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='notificacao',
+            name='status',
+            field=models.CharField(choices=[('PENDENTE', 'Pendente'), ('ENVIADA', 'Enviada'), ('FALHOU', 'Falhou'), ('DESCARTADA', 'Descartada')], default='PENDENTE', max_length=10),
+        ),
+    ]
@@ -1,9 +1,18 @@
+import re
+import unicodedata
+
 from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
 from django.core.exceptions import ValidationError
 
 
+def normalizar_busca(texto):
+    """Minúsculas, sem acentos nem pontuação e com espaços simples: "Dra. Ângela" -> "dra angela"."""
+    sem_acentos = unicodedata.normalize('NFKD', texto or '').encode('ascii', 'ignore').decode('ascii')
+    return ' '.join(re.sub(r'[^a-z0-9]+', ' ', sem_acentos.lower()).split())
+
+
 class Medico(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='medico', null=True, blank=True)
     nome = models.CharField(max_length=100)
@@ -11,7 +20,30 @@ class Medico(models.Model):
     especialidade = models.CharField(max_length=100)
     email = models.EmailField(unique=True, blank=True, null=True)
     foto = models.ImageField(upload_to='medicos', blank=True, null=True)
+    foto_hash = models.CharField(max_length=64, blank=True, default='')
+    foto_processada = models.BooleanField(default=False)
+    # Segredo da URL do feed iCalendar da agenda (ver core/calendario.py)
+    token_calendario = models.CharField(max_length=64, unique=True, null=True, blank=True)
+    # nome/especialidade normalizados para a busca (ver core/busca.py);
+    # preenchidos no save, e à mão nas gravações em massa
+    nome_busca = models.CharField(max_length=100, blank=True, default='')
+    especialidade_busca = models.CharField(max_length=100, blank=True, default='')
 
+    class Meta:
+        indexes = [
+            # Prefixo por faixa (>= termo e < termo + '\uffff') fora do
+            # PostgreSQL; lá a busca usa os índices de trigramas da migração 0015
+            models.Index(fields=['nome_busca'], name='medico_nome_busca_idx'),
+            models.Index(fields=['especialidade_busca'], name='medico_especialidade_busca_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.nome_busca = normalizar_busca(self.nome)
+        self.especialidade_busca = normalizar_busca(self.especialidade)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'nome', 'especialidade'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'nome_busca', 'especialidade_busca'}
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f" {self.nome} ({self.crm})"
@@ -24,11 +56,28 @@ class Paciente(models.Model):
     email = models.EmailField(unique=True, blank=True, null=True)
     telefone = models.CharField(max_length=11, blank=True, null=True)
     foto = models.ImageField(upload_to='pacientes', blank=True, null=True)
+    foto_hash = models.CharField(max_length=64, blank=True, default='')
+    foto_processada = models.BooleanField(default=False)
+    # Entra no ETag do feed .ics, que mostra o nome do paciente
+    atualizado_em = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f" {self.nome} ({self.cpf})"
 
 
+def dados_paciente_provisorio(user):
+    """
+    Campos do Paciente criado junto com o usuário, até ele completar o
+    perfil (o CPF provisório mantém a unicidade de cpf).
+    """
+    return {
+        'user': user,
+        'nome': user.username,
+        'cpf': f'temp_{user.id}',
+        'email': user.email or None,
+    }
+
+
 class Agenda(models.Model):
     medico = models.ForeignKey(Medico, on_delete=models.CASCADE, related_name='agendas')
     dia = models.DateField()
@@ -37,6 +86,20 @@ class Agenda(models.Model):
 
     class Meta:
         unique_together = ['medico', 'dia', 'horario']
+        indexes = [
+            # Horários livres de um médico, na ordem da listagem (?medico=)
+            models.Index(
+                fields=['medico', 'dia', 'horario', 'id'],
+                condition=models.Q(disponivel=True),
+                name='agenda_livre_medico_idx',
+            ),
+            # Horários livres de todos os médicos, por data (faixas futuras)
+            models.Index(
+                fields=['dia', 'horario', 'id'],
+                condition=models.Q(disponivel=True),
+                name='agenda_livre_dia_idx',
+            ),
+        ]
 
     
     def clean(self):
@@ -53,6 +116,33 @@ class Agenda(models.Model):
     def __str__(self):
         return f" {self.medico.nome} em {self.dia} às {self.horario}"
 
+class ResumoDisponibilidade(models.Model):
+    """
+    Quantidade de horários livres por médico, dia e hora cheia, mantida
+    por core.disponibilidade a cada reserva ou criação de horário. A busca
+    de disponibilidade lê só esta tabela, nunca a de Agenda.
+    """
+    medico = models.ForeignKey(Medico, on_delete=models.CASCADE, related_name='resumos_disponibilidade')
+    dia = models.DateField()
+    hora = models.PositiveSmallIntegerField()
+    livres = models.PositiveIntegerField(default=0)
+    primeira_agenda = models.ForeignKey(Agenda, on_delete=models.SET_NULL, related_name='+', null=True, blank=True)
+    primeiro_horario = models.TimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ['medico', 'dia', 'hora']
+        indexes = [
+            models.Index(
+                fields=['dia', 'hora', 'medico'],
+                condition=models.Q(livres__gt=0),
+                name='resumo_livre_dia_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f" {self.medico_id} em {self.dia} às {self.hora}h: {self.livres} livres"
+
+
 class Consulta (models.Model):
     STATUS_CHOICES = [
         ('PENDENTE', 'Pendente'),
@@ -62,7 +152,20 @@ class Consulta (models.Model):
         ('CANCELADA', 'Cancelada'),
     ]
 
-    agenda = models.OneToOneField(Agenda, on_delete=models.CASCADE, related_name='consulta', null=True, blank=True)
+    # Transições permitidas: status atual -> status de destino
+    TRANSICOES = {
+        'PENDENTE': ['AGENDADA', 'REJEITADA', 'CANCELADA'],
+        'AGENDADA': ['FINALIZADA', 'CANCELADA'],
+        'REJEITADA': [],
+        'FINALIZADA': [],
+        'CANCELADA': [],
+    }
+    # Status que devolvem o horário para a agenda; os demais ocupam o slot
+    STATUS_QUE_LIBERAM = ['CANCELADA', 'REJEITADA']
+
+    # Um slot pode ter várias consultas ao longo do tempo (canceladas ou
+    # rejeitadas), mas só uma que o ocupe; ver a constraint abaixo
+    agenda = models.ForeignKey(Agenda, on_delete=models.CASCADE, related_name='consultas', null=True, blank=True)
     paciente = models.ForeignKey(Paciente, on_delete=models.CASCADE, related_name='consultas', null=True, blank=True)
     data_agendamento = models.DateTimeField(auto_now_add=True, null=True, blank=True)
     observacoes = models.TextField(blank=True, null=True)
@@ -71,7 +174,30 @@ class Consulta (models.Model):
     observacoes_paciente = models.TextField(blank = True, verbose_name='Motivo da visita')
     prontuario_medico = models.TextField(blank = True, null=True, verbose_name='Anotações médicas')
     motivo_cancelamento = models.TextField(blank=True, null=True, verbose_name='Motivo de Cancelamento/Rejeição')
-    
+    # Incrementada a cada alteração; usada no ETag/If-Match
+    versao = models.PositiveIntegerField(default=1)
+    # Atualizações em massa (QuerySet.update) precisam preencher à mão
+    atualizada_em = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['agenda'],
+                condition=~models.Q(status__in=['CANCELADA', 'REJEITADA']),
+                name='consulta_agenda_ocupada_uniq',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['paciente', 'status'], name='consulta_paciente_status_idx'),
+            models.Index(fields=['status', 'data_agendamento'], name='consulta_status_data_idx'),
+            # Fila de pedidos aguardando o médico
+            models.Index(
+                fields=['agenda'],
+                condition=models.Q(status='PENDENTE'),
+                name='consulta_pendente_idx',
+            ),
+        ]
+
     def __str__(self):
         paciente_nome = self.paciente.nome if self.paciente else "N/A"
         medico_nome = self.agenda.medico.nome if self.agenda and self.agenda.medico else "N/A"
@@ -79,4 +205,96 @@ class Consulta (models.Model):
         return f" {paciente_nome} com Dr(a). {medico_nome} em {data_hora}"
 
 
+class EstatisticaDiaria(models.Model):
+    """
+    Contadores de consultas por médico, dia da consulta e status, mantidos
+    por core.estatisticas a cada agendamento e transição de status. O
+    painel do médico lê só esta tabela. Consultas arquivadas continuam
+    contadas.
+    """
+    medico = models.ForeignKey(Medico, on_delete=models.CASCADE, related_name='estatisticas')
+    dia = models.DateField()
+    pendentes = models.IntegerField(default=0)
+    agendadas = models.IntegerField(default=0)
+    finalizadas = models.IntegerField(default=0)
+    canceladas = models.IntegerField(default=0)
+    rejeitadas = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ['medico', 'dia']
 
+    def __str__(self):
+        return f" {self.medico_id} em {self.dia}"
+
+
+class ConsultaArquivada(models.Model):
+    """
+    Histórico de consultas encerradas, movidas pelo comando `arquivar`
+    para fora das tabelas quentes. Guarda uma cópia do horário (o slot
+    de Agenda é apagado junto) e mantém o id original da consulta.
+    """
+    STATUS_ARQUIVAVEIS = ['FINALIZADA', 'CANCELADA', 'REJEITADA']
+
+    id = models.IntegerField(primary_key=True)
+    medico = models.ForeignKey(Medico, on_delete=models.SET_NULL, related_name='consultas_arquivadas', null=True, blank=True)
+    paciente = models.ForeignKey(Paciente, on_delete=models.SET_NULL, related_name='consultas_arquivadas', null=True, blank=True)
+    dia = models.DateField()
+    horario = models.TimeField()
+    status = models.CharField(max_length=10, choices=Consulta.STATUS_CHOICES)
+    data_agendamento = models.DateTimeField(null=True, blank=True)
+    observacoes = models.TextField(blank=True, null=True)
+    observacoes_paciente = models.TextField(blank=True)
+    prontuario_medico = models.TextField(blank=True, null=True)
+    motivo_cancelamento = models.TextField(blank=True, null=True)
+    arquivado_em = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['paciente', 'dia', 'horario', 'id'], name='arquivada_paciente_idx'),
+            models.Index(fields=['medico', 'dia', 'horario', 'id'], name='arquivada_medico_idx'),
+        ]
+
+    def __str__(self):
+        return f" Consulta {self.id} de {self.dia} às {self.horario} ({self.status}, arquivada)"
+
+
+class Notificacao(models.Model):
+    """
+    Outbox de notificações: a linha é gravada na mesma transação da
+    mudança na consulta e entregue depois pelo comando
+    processar_notificacoes (ver core/notificacoes.py).
+    """
+    EVENTO_CHOICES = [
+        ('CONSULTA_CRIADA', 'Consulta criada'),
+        ('CONSULTA_CANCELADA', 'Consulta cancelada'),
+        ('STATUS_ALTERADO', 'Status alterado'),
+    ]
+    STATUS_CHOICES = [
+        ('PENDENTE', 'Pendente'),
+        ('ENVIADA', 'Enviada'),
+        ('FALHOU', 'Falhou'),
+        # A consulta não existe mais (excluída): nada foi enviado
+        ('DESCARTADA', 'Descartada'),
+    ]
+
+    evento = models.CharField(max_length=20, choices=EVENTO_CHOICES)
+    consulta = models.ForeignKey(Consulta, on_delete=models.SET_NULL, related_name='notificacoes', null=True, blank=True)
+    dados = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='PENDENTE')
+    tentativas = models.PositiveSmallIntegerField(default=0)
+    proxima_tentativa = models.DateTimeField(default=timezone.now)
+    ultimo_erro = models.TextField(blank=True)
+    criado_em = models.DateTimeField(auto_now_add=True)
+    enviado_em = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['proxima_tentativa', 'id'],
+                condition=models.Q(status='PENDENTE'),
+                name='notificacao_pendente_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f" {self.evento} da consulta {self.consulta_id} ({self.status})"
@@ -0,0 +1,168 @@
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import send_mail
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Notificacao
+
+
+def enfileirar(evento, consulta_id, **dados):
+    """
+    Grava a notificação no outbox. Deve ser chamada dentro da transação
+    que altera a consulta, para que as duas coisas sejam confirmadas ou
+    desfeitas juntas.
+    """
+    return Notificacao.objects.create(evento=evento, consulta_id=consulta_id, dados=dados)
+
+
+def enfileirar_lote(evento, consulta_ids, **dados):
+    Notificacao.objects.bulk_create(
+        [Notificacao(evento=evento, consulta_id=consulta_id, dados=dados) for consulta_id in consulta_ids]
+    )
+
+
+def montar_mensagem(notificacao):
+    """
+    Retorna (assunto, texto, destinatarios) de uma notificação, com os
+    dados já carregados por select_related em processar_lote.
+    """
+    consulta = notificacao.consulta
+    if consulta is None or consulta.agenda is None:
+        return None
+
+    medico = consulta.agenda.medico
+    paciente = consulta.paciente
+    paciente_nome = paciente.nome if paciente else 'N/A'
+    quando = f"{consulta.agenda.dia} às {consulta.agenda.horario}"
+    motivo = notificacao.dados.get('motivo')
+
+    if notificacao.evento == 'CONSULTA_CRIADA':
+        assunto = 'Nova consulta'
+        texto = f"Olá Dr(a). {medico.nome}!\nO paciente {paciente_nome} agendou uma consulta para {quando}."
+        destinatarios = [medico.email]
+    elif notificacao.evento == 'CONSULTA_CANCELADA':
+        assunto = 'Consulta cancelada'
+        texto = f"A consulta de {paciente_nome} com Dr(a). {medico.nome} em {quando} foi cancelada."
+        destinatarios = [medico.email, paciente.email if paciente else None]
+    else:
+        assunto = 'Consulta atualizada'
+        texto = (
+            f"Olá {paciente_nome}!\nSua consulta com Dr(a). {medico.nome} em {quando} "
+            f"agora está {notificacao.dados.get('status', consulta.status)}."
+        )
+        destinatarios = [paciente.email if paciente else None]
+
+    if motivo:
+        texto += f"\nMotivo: {motivo}"
+    return assunto, texto, [email for email in destinatarios if email]
+
+
+class ConsoleBackend:
+    def enviar(self, notificacao, assunto, texto, destinatarios):
+        print("--- NOTIFICAÇÃO ---")
+        print(texto)
+        print("---------------------")
+
+
+class ArquivoBackend:
+    """Acrescenta cada notificação como uma linha JSON em NOTIFICACOES_ARQUIVO."""
+
+    def enviar(self, notificacao, assunto, texto, destinatarios):
+        linha = json.dumps({
+            'id': notificacao.id,
+            'evento': notificacao.evento,
+            'consulta': notificacao.consulta_id,
+            'assunto': assunto,
+            'texto': texto,
+            'destinatarios': destinatarios,
+        }, ensure_ascii=False)
+        with open(settings.NOTIFICACOES_ARQUIVO, 'a', encoding='utf-8') as arquivo:
+            arquivo.write(linha + '\n')
+
+
+class EmailBackend:
+    """
+    Envia pelo EMAIL_BACKEND do Django. Em desenvolvimento, aponte
+    EMAIL_HOST/EMAIL_PORT para um servidor SMTP local de testes.
+    """
+
+    def enviar(self, notificacao, assunto, texto, destinatarios):
+        if destinatarios:
+            send_mail(assunto, texto, settings.DEFAULT_FROM_EMAIL, destinatarios)
+
+
+def get_backend():
+    return import_string(settings.NOTIFICACOES_BACKEND)()
+
+
+def _espera(tentativas):
+    return timedelta(seconds=min(settings.NOTIFICACOES_ESPERA_BASE * 2 ** (tentativas - 1), 3600))
+
+
+def _reservar(tamanho, agora):
+    """
+    Pega o lote numa transação curta: as linhas são travadas com SKIP
+    LOCKED (onde o banco suporta) só o tempo de empurrar proxima_tentativa
+    para depois do prazo de entrega, o que as tira do alcance dos outros
+    workers sem manter trava nem transação aberta durante os envios.
+    """
+    with transaction.atomic():
+        lote = list(
+            Notificacao.objects.select_for_update(skip_locked=True, of=('self',))
+            .filter(status='PENDENTE', proxima_tentativa__lte=agora)
+            .select_related('consulta__agenda__medico', 'consulta__paciente')
+            .order_by('proxima_tentativa', 'id')[:tamanho]
+        )
+        if lote:
+            Notificacao.objects.filter(id__in=[notificacao.id for notificacao in lote]).update(
+                proxima_tentativa=agora + timedelta(seconds=settings.NOTIFICACOES_PRAZO_ENTREGA)
+            )
+    return lote
+
+
+def processar_lote(tamanho=100, backend=None):
+    """
+    Entrega um lote de notificações pendentes e vencidas.
+
+    O lote é reservado antes (ver _reservar) e entregue fora de transação,
+    então vários workers podem rodar ao mesmo tempo sem entregar a mesma
+    notificação duas vezes. Se o worker morrer no meio, as notificações
+    não entregues voltam depois de NOTIFICACOES_PRAZO_ENTREGA. Uma falha
+    agenda nova tentativa com espera exponencial; depois de
+    NOTIFICACOES_MAX_TENTATIVAS a notificação fica como FALHOU. Sem a
+    consulta, não há o que enviar: fica como DESCARTADA. Retorna
+    (enviadas, falhas).
+    """
+    backend = backend or get_backend()
+    agora = timezone.now()
+    enviadas = falhas = 0
+
+    lote = _reservar(tamanho, agora)
+    for notificacao in lote:
+        try:
+            mensagem = montar_mensagem(notificacao)
+            if mensagem is None:
+                notificacao.status = 'DESCARTADA'
+                continue
+            backend.enviar(notificacao, *mensagem)
+        except Exception as e:
+            notificacao.tentativas += 1
+            notificacao.ultimo_erro = str(e)
+            if notificacao.tentativas >= settings.NOTIFICACOES_MAX_TENTATIVAS:
+                notificacao.status = 'FALHOU'
+            else:
+                notificacao.proxima_tentativa = agora + _espera(notificacao.tentativas)
+            falhas += 1
+        else:
+            notificacao.status = 'ENVIADA'
+            notificacao.enviado_em = timezone.now()
+            enviadas += 1
+
+    Notificacao.objects.bulk_update(
+        lote, ['status', 'tentativas', 'proxima_tentativa', 'ultimo_erro', 'enviado_em']
+    )
+    return enviadas, falhas
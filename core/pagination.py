@@ -0,0 +1,213 @@
+import base64
+import json
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+def _nullable(model, path):
+    """True se o campo (com lookups entre relações) pode ser NULL na linha."""
+    for name in path.split('__'):
+        field = model._meta.get_field(name)
+        if field.null:
+            return True
+        model = field.related_model
+    return False
+
+
+class KeysetPagination(BasePagination):
+    """
+    Paginação por cursor (keyset) sobre uma ordenação composta.
+
+    O cursor guarda os valores de todos os campos de `ordering` da última
+    linha entregue, e a próxima página é buscada com uma comparação
+    lexicográfica (a > x) OR (a = x AND b > y) OR ... em vez de OFFSET, de
+    modo que o custo de cada página não cresce com o tamanho da tabela.
+    O último campo da ordenação precisa ser único (normalmente `id`).
+
+    Toda listagem é paginada (page_size 50 por padrão). Até
+    PAGINACAO_LISTA_SIMPLES_ATE, clientes antigos ainda podem pedir o array
+    completo com `?paginar=0`; depois dessa data o parâmetro é ignorado.
+    """
+
+    ordering = ('id',)
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    cursor_query_param = 'cursor'
+    opt_out_query_param = 'paginar'
+    invalid_cursor_message = 'Cursor inválido.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        if self.lista_simples(request):
+            return None
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        reverse, position = self.decode_cursor(request)
+        self.nullable = {field for field in self.ordering if _nullable(queryset.model, field)}
+
+        if position is not None:
+            queryset = queryset.filter(self.build_filter(position, reverse))
+
+        rows = list(queryset.order_by(*self.get_order(reverse))[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        if reverse:
+            self.has_next = position is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+
+        self.page = rows
+        return rows
+
+    def lista_simples(self, request):
+        if request.query_params.get(self.opt_out_query_param) != '0':
+            return False
+        return timezone.localdate().isoformat() <= settings.PAGINACAO_LISTA_SIMPLES_ATE
+
+    def get_page_size(self, request):
+        if self.page_size_query_param:
+            try:
+                value = int(request.query_params[self.page_size_query_param])
+                if value > 0:
+                    return min(value, self.max_page_size)
+            except (KeyError, ValueError):
+                pass
+        return self.page_size
+
+    def get_order(self, reverse):
+        # Campos que podem ser NULL (ex.: consulta sem agenda) vêm por último
+        # na ordem crescente, explicitamente, para o cursor saber onde estão
+        order = []
+        for field in self.ordering:
+            if field in self.nullable:
+                order.append(F(field).desc(nulls_first=True) if reverse else F(field).asc(nulls_last=True))
+            else:
+                order.append(f'-{field}' if reverse else field)
+        return order
+
+    def build_filter(self, position, reverse):
+        clauses = []
+        for i, field in enumerate(self.ordering):
+            equal = Q()
+            for j in range(i):
+                equal &= self.equal_to(self.ordering[j], position[j])
+            after = self.after(field, position[i], reverse)
+            if after is not None:
+                clauses.append(equal & after)
+        return reduce(or_, clauses)
+
+    def equal_to(self, field, value):
+        if value is None:
+            return Q(**{f'{field}__isnull': True})
+        return Q(**{field: value})
+
+    def after(self, field, value, reverse):
+        """Linhas que vêm depois de `value` em `field`, com NULLs por último."""
+        nullable = field in self.nullable
+        if value is None:
+            # Nada vem depois de NULL; voltando, tudo que não é NULL vem antes
+            return Q(**{f'{field}__isnull': False}) if reverse else None
+        if reverse:
+            return Q(**{f'{field}__lt': value})
+        clause = Q(**{f'{field}__gt': value})
+        return clause | Q(**{f'{field}__isnull': True}) if nullable else clause
+
+    def get_position(self, instance):
+        position = []
+        for field in self.ordering:
+            value = instance
+            for attr in field.split('__'):
+                value = getattr(value, attr)
+                if value is None:
+                    break
+            position.append(value if value is None or isinstance(value, (int, str)) else str(value))
+        return position
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return False, None
+
+        try:
+            data = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            reverse = bool(data['r'])
+            position = data['p']
+            if not isinstance(position, list) or len(position) != len(self.ordering):
+                raise ValueError
+        except (TypeError, ValueError, KeyError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+        return reverse, position
+
+    def encode_cursor(self, reverse, position):
+        data = json.dumps({'r': int(reverse), 'p': position}, separators=(',', ':'))
+        encoded = base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii')
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if not self.page:
+            url = self.request.build_absolute_uri()
+            return remove_query_param(url, self.cursor_query_param)
+        return self.encode_cursor(False, self.get_position(self.page[-1]))
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(True, self.get_position(self.page[0]))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class MedicoPagination(KeysetPagination):
+    ordering = ('nome', 'id')
+
+
+class PacientePagination(KeysetPagination):
+    ordering = ('nome', 'id')
+
+
+class AgendaPagination(KeysetPagination):
+    ordering = ('dia', 'horario', 'id')
+
+
+class ConsultaPagination(KeysetPagination):
+    ordering = ('agenda__dia', 'agenda__horario', 'id')
+
+
+class HistoricoPagination(KeysetPagination):
+    ordering = ('dia', 'horario', 'id')
@@ -0,0 +1,87 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+# Verdadeiro enquanto as leituras devem ir para o primário: requisição de
+# escrita, usuário que escreveu há pouco ou bloco usar_primario().
+_fixado = ContextVar('replicas_fixado', default=False)
+
+
+def _cache():
+    return caches[settings.API_CACHE_ALIAS]
+
+
+def _chave(user_id):
+    return f'replicas:fixado:{user_id}'
+
+
+def replicas():
+    return settings.DATABASE_REPLICAS
+
+
+def fixar_usuario(user_id):
+    """Manda as leituras do usuário para o primário por REPLICA_FIXACAO_SEGUNDOS."""
+    _cache().set(_chave(user_id), True, timeout=settings.REPLICA_FIXACAO_SEGUNDOS)
+
+
+def usuario_fixado(user_id):
+    return bool(_cache().get(_chave(user_id)))
+
+
+def lendo_de_replica():
+    """Se uma leitura feita agora iria para uma réplica (podendo ver dados um pouco atrasados)."""
+    return bool(replicas()) and not _fixado.get() and not connections[DEFAULT_DB_ALIAS].in_atomic_block
+
+
+@contextmanager
+def fixar_no_primario(valor):
+    """Com `valor` verdadeiro, as leituras do bloco vão para o primário; usado pelo ReplicasMiddleware."""
+    token = _fixado.set(valor)
+    try:
+        yield
+    finally:
+        _fixado.reset(token)
+
+
+def usar_primario():
+    """Leituras do bloco vão para o primário (ex.: ler logo depois de escrever fora de uma requisição)."""
+    return fixar_no_primario(True)
+
+
+class RoteadorReplicas:
+    """
+    Escritas no primário (`default`); leituras numa das réplicas de
+    DATABASE_REPLICAS, exceto quando é preciso ler o que acabou de ser
+    escrito:
+
+    - dentro de transaction.atomic no primário (select_for_update, leitura
+      depois de um UPDATE na mesma transação);
+    - depois de qualquer escrita, até o fim da requisição;
+    - nas requisições de um usuário que escreveu há menos de
+      REPLICA_FIXACAO_SEGUNDOS (ver ReplicasMiddleware), para que o
+      paciente veja a consulta que acabou de agendar.
+
+    Sem réplicas configuradas, tudo vai para o primário.
+    """
+
+    def db_for_read(self, model, **hints):
+        if not lendo_de_replica():
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas())
+
+    def db_for_write(self, model, **hints):
+        if replicas():
+            _fixado.set(True)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Réplicas têm os mesmos dados do primário
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
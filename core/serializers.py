@@ -1,6 +1,10 @@
 from django.contrib.auth.models import User
+from django.db import transaction
 from rest_framework import serializers
-from .models import Medico, Consulta, Agenda, Paciente
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from .models import Medico, Consulta, ConsultaArquivada, Agenda, Paciente, dados_paciente_provisorio
+from .authentication import perfil_do_usuario
+from .fotos import url_variante
 
 
 class UserRegistrationSerializer(serializers.ModelSerializer):
@@ -11,24 +15,79 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
         model = User
         fields = ['username', 'email', 'password', 'confirm_password']
 
+    def validate_email(self, value):
+        if value and Paciente.objects.filter(email=value).exists():
+            raise serializers.ValidationError("Este e-mail já está em uso.")
+        return value
+
     def validate(self, data):
         if data['password'] != data['confirm_password']:
             raise serializers.ValidationError({"password": "As senhas não conferem."})
         return data
 
     def create(self, validated_data):
-        user = User.objects.create_user(
-            username=validated_data['username'],
-            email=validated_data['email'],
-            password=validated_data['password']
-        )
+        with transaction.atomic():
+            user = User.objects.create_user(
+                username=validated_data['username'],
+                email=validated_data['email'],
+                password=validated_data['password']
+            )
+            # Patient profile is created here, once, so the consulta read
+            # paths never have to provision it.
+            Paciente.objects.create(**dados_paciente_provisorio(user))
         return user
 
 
-class MedicoSerializer(serializers.ModelSerializer):
+class PerfilTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """
+    Inclui no token o tipo de usuário e os ids do perfil, para que
+    PerfilJWTAuthentication não precise buscar User/Medico/Paciente.
+    """
+
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        perfil = perfil_do_usuario(user)
+        token['username'] = user.username
+        token['email'] = user.email
+        token['type'] = perfil.tipo
+        if perfil.medico_id:
+            token['medico_id'] = perfil.medico_id
+            token['crm'] = perfil.crm
+        if perfil.paciente_id:
+            token['paciente_id'] = perfil.paciente_id
+        # Lido pelo TokenUser (is_staff) para as rotas de administração;
+        # PerfilJWTAuthentication confere o valor atual a cada requisição
+        token['is_staff'] = user.is_staff
+        return token
+
+
+class FotoVariantesMixin(serializers.Serializer):
+    """
+    URLs das variantes redimensionadas da foto (ver core/fotos.py). Até o
+    processamento terminar, apontam para a foto original.
+    """
+    foto_miniatura = serializers.SerializerMethodField()
+    foto_perfil = serializers.SerializerMethodField()
+
+    def _url_variante(self, obj, variante):
+        url = url_variante(obj, variante)
+        request = self.context.get('request')
+        if url and request is not None:
+            return request.build_absolute_uri(url)
+        return url
+
+    def get_foto_miniatura(self, obj):
+        return self._url_variante(obj, 'miniatura')
+
+    def get_foto_perfil(self, obj):
+        return self._url_variante(obj, 'perfil')
+
+
+class MedicoSerializer(FotoVariantesMixin, serializers.ModelSerializer):
     class Meta:
         model = Medico
-        fields = ['id', 'nome', 'crm', 'especialidade', 'email', 'foto']
+        fields = ['id', 'nome', 'crm', 'especialidade', 'email', 'foto', 'foto_miniatura', 'foto_perfil']
 
 
 class AgendaSerializer(serializers.ModelSerializer):
@@ -37,10 +96,35 @@ class AgendaSerializer(serializers.ModelSerializer):
         fields = ['id', 'medico', 'dia', 'horario', 'disponivel']
 
 
-class PacienteSerializer(serializers.ModelSerializer):
+class AgendaRecorrenteSerializer(serializers.Serializer):
+    dias_semana = serializers.ListField(
+        child=serializers.IntegerField(min_value=0, max_value=6),
+        allow_empty=False,
+        help_text='Dias da semana (segunda = 0, domingo = 6)'
+    )
+    hora_inicio = serializers.TimeField()
+    hora_fim = serializers.TimeField()
+    duracao = serializers.IntegerField(min_value=5, max_value=480, help_text='Duração de cada horário em minutos')
+    data_inicio = serializers.DateField()
+    data_fim = serializers.DateField()
+    excecoes = serializers.ListField(child=serializers.DateField(), required=False, default=list)
+
+    MAX_DIAS = 366
+
+    def validate(self, data):
+        if data['hora_fim'] <= data['hora_inicio']:
+            raise serializers.ValidationError({"hora_fim": "O horário final deve ser posterior ao inicial."})
+        if data['data_fim'] < data['data_inicio']:
+            raise serializers.ValidationError({"data_fim": "A data final deve ser igual ou posterior à inicial."})
+        if (data['data_fim'] - data['data_inicio']).days >= self.MAX_DIAS:
+            raise serializers.ValidationError({"data_fim": f"O período não pode passar de {self.MAX_DIAS} dias."})
+        return data
+
+
+class PacienteSerializer(FotoVariantesMixin, serializers.ModelSerializer):
     class Meta:
         model = Paciente
-        fields = ['id', 'nome', 'cpf', 'email', 'telefone', 'foto']
+        fields = ['id', 'nome', 'cpf', 'email', 'telefone', 'foto', 'foto_miniatura', 'foto_perfil']
         
 
 class ConsultaSerializer(serializers.ModelSerializer):
@@ -51,7 +135,53 @@ class ConsultaSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Consulta
-        fields = ['id', 'agenda', 'agenda_detalhes', 'paciente', 'paciente_detalhes', 'status', 'observacoes', 'motivo_cancelamento']
+        fields = ['id', 'agenda', 'agenda_detalhes', 'paciente', 'paciente_detalhes', 'status', 'observacoes', 'motivo_cancelamento', 'versao']
+        # Status e motivo mudam só pelas ações de transição (cancelar, atualizar_status)
+        read_only_fields = ['status', 'motivo_cancelamento', 'versao']
+        # O slot é reservado pelo UPDATE condicional em ConsultaViewSet.create
+        # (e garantido pela constraint consulta_agenda_ocupada_uniq); a
+        # checagem de unicidade do DRF seria só uma query a mais.
+        validators = []
+
+
+class AgendamentoSerializer(serializers.ModelSerializer):
+    """
+    Entrada do agendamento: a agenda é só um id, reservada pelo UPDATE
+    condicional em ConsultaViewSet.create (que já recusa um id que não
+    existe), e o paciente vem do usuário logado. Validar as chaves com
+    PrimaryKeyRelatedField custaria um SELECT de Agenda e um de Paciente.
+    """
+    agenda = serializers.IntegerField(min_value=1)
+
+    class Meta:
+        model = Consulta
+        fields = ['agenda', 'observacoes']
+        validators = []
+
+
+class AtualizacaoStatusLoteSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False, max_length=500)
+    status = serializers.ChoiceField(choices=Consulta.STATUS_CHOICES)
+    motivo = serializers.CharField(required=False, allow_blank=True)
+
+    def validate(self, data):
+        if data['status'] in ['REJEITADA', 'CANCELADA'] and not data.get('motivo'):
+            raise serializers.ValidationError({"motivo": "É obrigatório informar o motivo para cancelar ou rejeitar."})
+        # Mantém a ordem do pedido, sem repetir ids
+        data['ids'] = list(dict.fromkeys(data['ids']))
+        return data
+
+
+class ConsultaArquivadaSerializer(serializers.ModelSerializer):
+    medico_nome = serializers.CharField(source='medico.nome', read_only=True, default=None)
+    paciente_nome = serializers.CharField(source='paciente.nome', read_only=True, default=None)
+
+    class Meta:
+        model = ConsultaArquivada
+        fields = [
+            'id', 'medico', 'medico_nome', 'paciente', 'paciente_nome', 'dia', 'horario', 'status',
+            'observacoes', 'motivo_cancelamento', 'data_agendamento', 'arquivado_em',
+        ]
 
 
 class MedicoRegistrationSerializer(serializers.ModelSerializer):
@@ -1,16 +1,66 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
+from django.contrib.auth.models import User
 from django.dispatch import receiver
-from .models import Consulta    
+from .models import Consulta, Agenda, Medico, Paciente
+from .authentication import invalidar_usuario
+from .disponibilidade import atualizar_disponibilidade
+from .cache import invalidar_agenda, invalidar_medico
+from .notificacoes import enfileirar
+from .estatisticas import registrar
+from .eventos import publicar_agenda
 
 @receiver(post_save, sender=Consulta)
-def notificar_medico_nova_consulta(sender, instance, created, **kwargs):
-    if created:
-        medico = instance.agenda.medico.nome
-        paciente = instance.paciente.nome
-        data = instance.agenda.dia
-        horario = instance.agenda.horario
-        
-        print(f"--- NOTIFICAÇÃO ---")
-        print(f"Olá Dr(a). {medico}!")
-        print(f"O paciente {paciente} agendou uma consulta para {data} às {horario}.")
-        print(f"---------------------") 
+def notificar_medico_nova_consulta(sender, instance, created, raw=False, **kwargs):
+    # Only records the outbox row, in the booking transaction; delivery is
+    # done by the processar_notificacoes worker.
+    if created and not raw:
+        enfileirar('CONSULTA_CRIADA', instance.pk)
+
+
+@receiver(post_save, sender=Consulta)
+def contar_nova_consulta(sender, instance, created, raw=False, **kwargs):
+    # Contador do painel do médico (EstatisticaDiaria), na mesma transação
+    if created and not raw and instance.agenda_id:
+        registrar(instance.agenda.medico_id, instance.agenda.dia, None, instance.status)
+
+
+@receiver(post_save, sender=Agenda)
+def atualizar_resumo_agenda_salva(sender, instance, raw=False, **kwargs):
+    if not raw:
+        atualizar_disponibilidade(instance.medico_id, [(instance.dia, instance.horario)])
+        invalidar_agenda(instance.medico_id)
+        publicar_agenda(instance.medico_id, agenda=instance.pk, dia=str(instance.dia), horario=str(instance.horario))
+
+
+@receiver(post_delete, sender=Agenda)
+def atualizar_resumo_agenda_excluida(sender, instance, **kwargs):
+    atualizar_disponibilidade(instance.medico_id, [(instance.dia, instance.horario)], criar=False)
+    invalidar_agenda(instance.medico_id)
+    publicar_agenda(instance.medico_id, agenda=instance.pk, dia=str(instance.dia), horario=str(instance.horario), excluida=True)
+
+
+@receiver(post_save, sender=Medico)
+@receiver(post_delete, sender=Medico)
+def invalidar_cache_medico(sender, instance, **kwargs):
+    invalidar_medico(instance.pk)
+
+
+@receiver(post_save, sender=User)
+def invalidar_usuario_salvo(sender, instance, raw=False, **kwargs):
+    if not raw:
+        invalidar_usuario(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def invalidar_usuario_excluido(sender, instance, **kwargs):
+    invalidar_usuario(instance.pk)
+
+
+@receiver(post_save, sender=Medico)
+@receiver(post_delete, sender=Medico)
+@receiver(post_save, sender=Paciente)
+@receiver(post_delete, sender=Paciente)
+def invalidar_usuario_do_perfil(sender, instance, raw=False, **kwargs):
+    # O usuário em cache leva o perfil junto
+    if instance.user_id and not raw:
+        invalidar_usuario(instance.user_id)
@@ -1,3 +1,1863 @@
-from django.test import TestCase
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time, timedelta
+from contextlib import contextmanager
+from io import BytesIO, StringIO
+from unittest import mock
+import asyncio
+import csv
+import json
+import os
+import tempfile
+import threading
+import time as relogio
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import checks, eventos, replicas
+from .management.commands import seed
+from .disponibilidade import atualizar_disponibilidade, reconstruir_disponibilidade
+from .estatisticas import reconstruir_estatisticas
+from .models import Medico, Paciente, Agenda, Consulta, ConsultaArquivada, EstatisticaDiaria, ResumoDisponibilidade, Notificacao
+from .notificacoes import processar_lote
+from .pagination import AgendaPagination
+from .fotos import caminho_variante
+from PIL import Image
+
+
+# Hash de senha barato: os testes criam muitos usuários e fazem login
+hash_rapido = override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+
+
+@hash_rapido
+class AgendamentoConcorrenteTest(TransactionTestCase):
+    """
+    Dispara varias reservas em paralelo para o mesmo horario e garante
+    que apenas uma consulta e criada.
+    """
+
+    NUM_PACIENTES = 12
+
+    def setUp(self):
+        medico = Medico.objects.create(nome='Ana Paula', crm='123456', especialidade='Cardiologista')
+        self.agenda = Agenda.objects.create(
+            medico=medico,
+            dia=timezone.now().date() + timedelta(days=1),
+            horario=time(9, 0),
+        )
+        self.usuarios = []
+        for i in range(self.NUM_PACIENTES):
+            user = User.objects.create_user(username=f'paciente{i}', email=f'paciente{i}@exemplo.com', password='senha12345')
+            Paciente.objects.create(user=user, nome=user.username, cpf=f'0000000000{i:02d}', email=user.email)
+            self.usuarios.append(user)
+
+    def test_apenas_uma_reserva_vence(self):
+        barreira = threading.Barrier(self.NUM_PACIENTES)
+
+        def reservar(user):
+            try:
+                client = APIClient()
+                client.force_authenticate(user=user)
+                barreira.wait()
+                return client.post('/api/consultas/', {'agenda': self.agenda.id}, format='json').status_code
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=self.NUM_PACIENTES) as executor:
+            codigos = list(executor.map(reservar, self.usuarios))
+
+        self.assertEqual(codigos.count(201), 1)
+        self.assertEqual(codigos.count(400), self.NUM_PACIENTES - 1)
+        self.assertEqual(Consulta.objects.filter(agenda=self.agenda).count(), 1)
+
+        self.agenda.refresh_from_db()
+        self.assertFalse(self.agenda.disponivel)
+
+    def test_horario_ja_reservado(self):
+        client = APIClient()
+        client.force_authenticate(user=self.usuarios[0])
+        resposta = client.post('/api/consultas/', {'agenda': self.agenda.id}, format='json')
+        self.assertEqual(resposta.status_code, 201)
+        self.assertFalse(resposta.data['agenda_detalhes']['disponivel'])
+
+        client.force_authenticate(user=self.usuarios[1])
+        resposta = client.post('/api/consultas/', {'agenda': self.agenda.id}, format='json')
+        self.assertEqual(resposta.status_code, 400)
+        self.assertEqual(Consulta.objects.count(), 1)
+
+        resposta = client.post('/api/consultas/', {'agenda': self.agenda.id + 1000}, format='json')
+        self.assertEqual(resposta.status_code, 400)
+        self.assertEqual(client.post('/api/consultas/', {'agenda': 'x'}, format='json').status_code, 400)
+
+    def test_falha_do_broker_depois_do_commit_nao_desfaz_a_resposta(self):
+        client = APIClient()
+        client.force_authenticate(user=self.usuarios[0])
+        with mock.patch.object(eventos, 'publicar', side_effect=ConnectionError('redis down')):
+            with self.assertLogs('django.db.backends.base', 'ERROR'):
+                resposta = client.post('/api/consultas/', {'agenda': self.agenda.id}, format='json')
+        self.assertEqual(resposta.status_code, 201)
+        self.assertEqual(Consulta.objects.filter(agenda=self.agenda).count(), 1)
+
+
+class PaginacaoKeysetTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        amanha = timezone.now().date() + timedelta(days=1)
+        medicos = [
+            Medico.objects.create(nome=nome, crm=f'90{i}', especialidade='Pediatra')
+            for i, nome in enumerate(['Bruno', 'Ana', 'Ana', 'Carla', 'Ana'])
+        ]
+        for medico in medicos:
+            for d in range(3):
+                for h in (8, 9):
+                    Agenda.objects.create(medico=medico, dia=amanha + timedelta(days=d), horario=time(h, 0))
+
+    def setUp(self):
+        cache.clear()
+
+    def percorrer(self, url):
+        client = APIClient()
+        vistos = []
+        while url:
+            resposta = client.get(url)
+            self.assertEqual(resposta.status_code, 200)
+            vistos.extend(item['id'] for item in resposta.data['results'])
+            url = resposta.data['next']
+        return vistos
+
+    def test_agendas_em_ordem_sem_repeticao(self):
+        vistos = self.percorrer('/api/agendas/?page_size=4')
+        esperado = list(Agenda.objects.order_by('dia', 'horario', 'id').values_list('id', flat=True))
+        self.assertEqual(vistos, esperado)
+
+    def test_medicos_com_nomes_repetidos(self):
+        vistos = self.percorrer('/api/medicos/?page_size=2')
+        esperado = list(Medico.objects.order_by('nome', 'id').values_list('id', flat=True))
+        self.assertEqual(vistos, esperado)
+
+    def test_pagina_anterior(self):
+        client = APIClient()
+        primeira = client.get('/api/agendas/?page_size=5').data
+        segunda = client.get(primeira['next']).data
+        self.assertIsNone(primeira['previous'])
+        voltou = client.get(segunda['previous']).data
+        self.assertEqual(voltou['results'], primeira['results'])
+
+    def test_limite_de_page_size(self):
+        resposta = APIClient().get('/api/agendas/?page_size=100000')
+        self.assertEqual(len(resposta.data['results']), Agenda.objects.count())
+        self.assertEqual(resposta.data['next'], None)
+
+    def test_consulta_sem_agenda_entra_por_ultimo(self):
+        user = User.objects.create_user(username='paciente', password='senha12345')
+        paciente = Paciente.objects.create(user=user, nome='Paciente', cpf='12345678900')
+        agendas = Agenda.objects.order_by('-dia', 'horario', 'id')[:2]
+        consultas = [Consulta.objects.create(agenda=agenda, paciente=paciente) for agenda in agendas]
+        sem_agenda = [Consulta.objects.create(agenda=None, paciente=paciente) for _ in range(2)]
+        client = APIClient()
+        client.force_authenticate(user=user)
+
+        vistos, url, paginas = [], '/api/consultas/?page_size=1', []
+        while url:
+            pagina = client.get(url).data
+            paginas.append(pagina)
+            vistos.extend(item['id'] for item in pagina['results'])
+            url = pagina['next']
+        esperado = sorted(consultas, key=lambda c: (c.agenda.dia, c.agenda.horario, c.id)) + sem_agenda
+        self.assertEqual(vistos, [consulta.id for consulta in esperado])
+        # Voltando a partir das linhas sem agenda
+        anterior = client.get(paginas[-1]['previous']).data
+        self.assertEqual(anterior['results'], paginas[-2]['results'])
+        anterior = client.get(paginas[-2]['previous']).data
+        self.assertEqual(anterior['results'], paginas[-3]['results'])
+
+    def test_sem_parametros_pagina_por_padrao(self):
+        with mock.patch.object(AgendaPagination, 'page_size', 20):
+            resposta = APIClient().get('/api/agendas/')
+        self.assertEqual(len(resposta.data['results']), 20)
+        self.assertIsNotNone(resposta.data['next'])
+
+    def test_lista_simples_so_ate_o_prazo(self):
+        ids = list(Agenda.objects.order_by('dia', 'horario', 'id').values_list('id', flat=True))
+        with self.settings(PAGINACAO_LISTA_SIMPLES_ATE=timezone.localdate().isoformat()):
+            resposta = APIClient().get('/api/agendas/?paginar=0')
+        self.assertEqual([agenda['id'] for agenda in resposta.data], ids)
+
+        cache.clear()
+        with self.settings(PAGINACAO_LISTA_SIMPLES_ATE=(timezone.localdate() - timedelta(days=1)).isoformat()):
+            resposta = APIClient().get('/api/agendas/?paginar=0')
+        self.assertEqual([agenda['id'] for agenda in resposta.data['results']], ids)
+
+    def test_cursor_invalido(self):
+        resposta = APIClient().get('/api/agendas/?cursor=invalido')
+        self.assertEqual(resposta.status_code, 404)
+
+
+class PlanoDeConsultaTest(TestCase):
+    """
+    Verifica com EXPLAIN que o otimizador usa os índices parciais de
+    core/models.py nas consultas quentes. A base é semeada com alguns
+    milhares de horários e estatísticas atualizadas (ANALYZE) para que o
+    plano seja o mesmo de uma tabela grande em produção.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        inicio = timezone.now().date() + timedelta(days=1)
+        medicos = Medico.objects.bulk_create(
+            Medico(nome=f'Medico {i}', crm=f'CRM{i:05d}', especialidade='Clínico Geral') for i in range(40)
+        )
+        cls.medico = medicos[0]
+        Agenda.objects.bulk_create(
+            Agenda(
+                medico=medico,
+                dia=inicio + timedelta(days=d),
+                horario=time(h, 0),
+                disponivel=(d + h) % 5 != 0,
+            )
+            for medico in medicos
+            for d in range(60)
+            for h in range(8, 18)
+        )
+        paciente = Paciente.objects.create(nome='Paciente', cpf='00000000000')
+        status_comuns = ['PENDENTE', 'AGENDADA', 'FINALIZADA', 'CANCELADA']
+        Consulta.objects.bulk_create(
+            Consulta(
+                agenda=agenda,
+                paciente=paciente,
+                status='REJEITADA' if i % 50 == 0 else status_comuns[i % 4],
+            )
+            for i, agenda in enumerate(Agenda.objects.filter(disponivel=False))
+        )
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def assertUsaIndice(self, queryset, indice):
+        plano = queryset.explain()
+        self.assertIn(indice, plano, msg=plano)
+
+    def test_agendas_livres_do_medico(self):
+        queryset = Agenda.objects.filter(disponivel=True, medico_id=self.medico.id).order_by('dia', 'horario', 'id')[:51]
+        self.assertUsaIndice(queryset, 'agenda_livre_medico_idx')
+
+    def test_agendas_livres_a_partir_de_uma_data(self):
+        queryset = Agenda.objects.filter(disponivel=True, dia__gte=timezone.now().date()).order_by('dia', 'horario', 'id')[:51]
+        self.assertUsaIndice(queryset, 'agenda_livre_dia_idx')
+
+    def test_consultas_por_status(self):
+        queryset = Consulta.objects.filter(status='REJEITADA', data_agendamento__lt=timezone.now())
+        self.assertUsaIndice(queryset, 'consulta_status_data_idx')
+
+
+@hash_rapido
+class AgendaRecorrenteTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='dra.ana', email='ana@exemplo.com', password='senha12345')
+        self.medico = Medico.objects.create(user=self.user, nome='Ana Paula', crm='123456', especialidade='Cardiologista')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        # Primeira segunda-feira depois de amanhã
+        inicio = timezone.now().date() + timedelta(days=2)
+        self.segunda = inicio + timedelta(days=(7 - inicio.weekday()) % 7)
+
+    def modelo(self, **kwargs):
+        dados = {
+            'dias_semana': [0, 2],
+            'hora_inicio': '08:00',
+            'hora_fim': '12:00',
+            'duracao': 30,
+            'data_inicio': self.segunda.isoformat(),
+            'data_fim': (self.segunda + timedelta(days=13)).isoformat(),
+            'excecoes': [(self.segunda + timedelta(days=2)).isoformat()],
+        }
+        dados.update(kwargs)
+        return dados
+
+    def test_gera_horarios_em_lote(self):
+        # Inclui o savepoint da inserção, que é refeita se houver conflito
+        with self.assertNumQueries(10):
+            resposta = self.client.post('/api/agendas/gerar/', self.modelo(), format='json')
+        self.assertEqual(resposta.status_code, 201)
+        # 2 semanas x 2 dias - 1 exceção = 3 dias com 8 horários de 30 min
+        self.assertEqual(resposta.data, {'criados': 24, 'ignorados': 0})
+        self.assertEqual(Agenda.objects.filter(medico=self.medico).count(), 24)
+        self.assertFalse(Agenda.objects.filter(dia=self.segunda + timedelta(days=2)).exists())
+
+    def test_ignora_horarios_existentes(self):
+        Agenda.objects.create(medico=self.medico, dia=self.segunda, horario=time(8, 0))
+        resposta = self.client.post('/api/agendas/gerar/', self.modelo(), format='json')
+        self.assertEqual(resposta.data, {'criados': 23, 'ignorados': 1})
+        self.assertEqual(Agenda.objects.filter(medico=self.medico).count(), 24)
+
+    def test_horario_criado_no_meio_nao_conta_como_criado(self):
+        # Outra requisição cria um dos horários logo depois da leitura dos existentes
+        original, leituras = Agenda.objects.filter, []
+
+        def concorrente(*args, **kwargs):
+            leituras.append(kwargs)
+            if len(leituras) == 1:
+                Agenda.objects.create(medico=self.medico, dia=self.segunda, horario=time(8, 0))
+                return Agenda.objects.none()
+            return original(*args, **kwargs)
+
+        with mock.patch.object(Agenda.objects, 'filter', side_effect=concorrente):
+            resposta = self.client.post('/api/agendas/gerar/', self.modelo(), format='json')
+        self.assertEqual(resposta.data, {'criados': 23, 'ignorados': 1})
+        self.assertEqual(Agenda.objects.filter(medico=self.medico).count(), 24)
+
+    def test_rejeita_periodo_no_passado(self):
+        ontem = timezone.now().date() - timedelta(days=1)
+        resposta = self.client.post('/api/agendas/gerar/', self.modelo(data_inicio=ontem.isoformat()), format='json')
+        self.assertEqual(resposta.status_code, 400)
+        self.assertFalse(Agenda.objects.exists())
+
+    def test_apenas_medicos(self):
+        paciente = User.objects.create_user(username='paciente', password='senha12345')
+        self.client.force_authenticate(user=paciente)
+        resposta = self.client.post('/api/agendas/gerar/', self.modelo(), format='json')
+        self.assertEqual(resposta.status_code, 403)
+
+    def test_comando(self):
+        call_command(
+            'gerar_agendas', crm='123456', dias='0', inicio='14:00', fim='16:00', duracao=60,
+            data_inicio=self.segunda.isoformat(), data_fim=self.segunda.isoformat(), stdout=StringIO(),
+        )
+        self.assertEqual(
+            list(Agenda.objects.values_list('horario', flat=True).order_by('horario')),
+            [time(14, 0), time(15, 0)],
+        )
+
+
+@hash_rapido
+class DisponibilidadeTest(TestCase):
+
+    def setUp(self):
+        self.amanha = timezone.now().date() + timedelta(days=1)
+        self.cardio = Medico.objects.create(nome='Ana Paula', crm='111', especialidade='Cardiologista')
+        self.derma = Medico.objects.create(nome='Fernanda Lima', crm='222', especialidade='Dermatologista')
+        for medico in (self.cardio, self.derma):
+            for d in range(2):
+                for h in (8, 9, 14):
+                    Agenda.objects.create(medico=medico, dia=self.amanha + timedelta(days=d), horario=time(h, 30))
+        self.user = User.objects.create_user(username='paciente', password='senha12345')
+        Paciente.objects.create(user=self.user, nome='Paciente', cpf='12345678900')
+
+    def buscar(self, **params):
+        resposta = APIClient().get('/api/disponibilidade/', params)
+        self.assertEqual(resposta.status_code, 200)
+        return resposta.data
+
+    def test_busca_por_especialidade(self):
+        resultado = self.buscar(especialidade='cardiologista')
+        self.assertEqual(len(resultado), 1)
+        self.assertEqual(resultado[0]['medico']['id'], self.cardio.id)
+        self.assertEqual(
+            [(dia['dia'], dia['livres']) for dia in resultado[0]['dias']],
+            [(self.amanha, 3), (self.amanha + timedelta(days=1), 3)],
+        )
+        primeira = Agenda.objects.get(medico=self.cardio, dia=self.amanha, horario=time(8, 30))
+        self.assertEqual(resultado[0]['primeiro_horario']['agenda'], primeira.id)
+
+    def test_busca_por_faixa_de_horario(self):
+        resultado = self.buscar(hora_inicio=12, hora_fim=18)
+        self.assertEqual(len(resultado), 2)
+        for item in resultado:
+            self.assertEqual([dia['livres'] for dia in item['dias']], [1, 1])
+            self.assertEqual(item['primeiro_horario']['horario'], time(14, 30))
+
+    def test_busca_nao_le_a_tabela_de_agenda(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.buscar(especialidade='Cardiologista')
+        self.assertEqual(len(queries), 3)
+        self.assertFalse(any('core_agenda' in query['sql'] for query in queries))
+
+    def test_limite_pelo_primeiro_horario(self):
+        Agenda.objects.filter(medico=self.cardio, dia=self.amanha).delete()
+        reconstruir_disponibilidade()
+        resultado = self.buscar(limite=1)
+        self.assertEqual([item['medico']['id'] for item in resultado], [self.derma.id])
+
+    def test_ignora_horas_que_ja_passaram(self):
+        meio_dia = timezone.make_aware(datetime.combine(self.amanha, time(12, 0)))
+        localtime = timezone.localtime
+        with mock.patch.object(timezone, 'localtime', lambda *args, **kwargs: localtime(*args, **kwargs) if args else meio_dia):
+            resultado = self.buscar(especialidade='Cardiologista')
+        self.assertEqual(resultado[0]['primeiro_horario']['horario'], time(14, 30))
+        self.assertEqual(resultado[0]['dias'][0], {'dia': self.amanha, 'livres': 1})
+
+    def test_reserva_atualiza_resumo(self):
+        primeira = Agenda.objects.get(medico=self.cardio, dia=self.amanha, horario=time(8, 30))
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        self.assertEqual(client.post('/api/consultas/', {'agenda': primeira.id}, format='json').status_code, 201)
+
+        resultado = self.buscar(especialidade='Cardiologista')
+        self.assertEqual(resultado[0]['dias'][0]['livres'], 2)
+        self.assertEqual(resultado[0]['primeiro_horario']['horario'], time(9, 30))
+
+    def test_reconstrucao_igual_ao_incremental(self):
+        Agenda.objects.filter(medico=self.derma, horario=time(9, 30)).update(disponivel=False)
+        atualizar_disponibilidade(self.derma.id, [(self.amanha, time(9, 30)), (self.amanha + timedelta(days=1), time(9, 30))])
+        campos = ('medico_id', 'dia', 'hora', 'livres', 'primeira_agenda_id', 'primeiro_horario')
+        resumos = ResumoDisponibilidade.objects.filter(livres__gt=0).order_by(*campos)
+        incremental = list(resumos.values_list(*campos))
+        call_command('recalcular_disponibilidade', stdout=StringIO())
+        self.assertEqual(list(resumos.values_list(*campos)), incremental)
+
+
+@hash_rapido
+class CacheVersionadoTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        amanha = timezone.now().date() + timedelta(days=1)
+        self.medico = Medico.objects.create(nome='Ana Paula', crm='111', especialidade='Cardiologista')
+        self.outro = Medico.objects.create(nome='Fernanda Lima', crm='222', especialidade='Dermatologista')
+        self.agenda = Agenda.objects.create(medico=self.medico, dia=amanha, horario=time(9, 0))
+        Agenda.objects.create(medico=self.outro, dia=amanha, horario=time(9, 0))
+        self.client = APIClient()
+
+    def test_304_sem_consultar_o_banco(self):
+        url = f'/api/agendas/?medico={self.medico.id}'
+        resposta = self.client.get(url)
+        self.assertEqual(resposta.status_code, 200)
+        etag = resposta['ETag']
+
+        with self.assertNumQueries(0):
+            resposta = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resposta.status_code, 304)
+        self.assertEqual(resposta['ETag'], etag)
+
+    def test_resposta_servida_do_cache(self):
+        self.client.get('/api/medicos/')
+        with self.assertNumQueries(0):
+            resposta = self.client.get('/api/medicos/')
+        self.assertEqual(len(resposta.data['results']), 2)
+
+    def test_alteracao_invalida_apenas_o_medico(self):
+        url = f'/api/agendas/?medico={self.medico.id}'
+        url_outro = f'/api/agendas/?medico={self.outro.id}'
+        etag = self.client.get(url)['ETag']
+        etag_outro = self.client.get(url_outro)['ETag']
+
+        user = User.objects.create_user(username='paciente', password='senha12345')
+        Paciente.objects.create(user=user, nome='Paciente', cpf='12345678900')
+        self.client.force_authenticate(user=user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/consultas/', {'agenda': self.agenda.id}, format='json')
+        self.client.force_authenticate(user=None)
+
+        resposta = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(resposta.data['results'], [])
+        self.assertEqual(self.client.get(url_outro, HTTP_IF_NONE_MATCH=etag_outro).status_code, 304)
+
+    def test_agendamento_nao_invalida_listagem_de_medicos(self):
+        etags = [self.client.get(url)['ETag'] for url in ('/api/medicos/', '/api/medicos/buscar/?q=ana', '/api/agendas/')]
+
+        user = User.objects.create_user(username='paciente', password='senha12345')
+        Paciente.objects.create(user=user, nome='Paciente', cpf='12345678900')
+        self.client.force_authenticate(user=user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/consultas/', {'agenda': self.agenda.id}, format='json')
+        self.client.force_authenticate(user=None)
+
+        self.assertEqual(self.client.get('/api/medicos/', HTTP_IF_NONE_MATCH=etags[0]).status_code, 304)
+        self.assertEqual(self.client.get('/api/medicos/buscar/?q=ana', HTTP_IF_NONE_MATCH=etags[1]).status_code, 304)
+        self.assertEqual(self.client.get('/api/agendas/', HTTP_IF_NONE_MATCH=etags[2]).status_code, 200)
+
+    def test_falha_do_cache_no_commit_nao_vira_erro(self):
+        user = User.objects.create_user(username='paciente', password='senha12345')
+        Paciente.objects.create(user=user, nome='Paciente', cpf='12345678900')
+        self.client.force_authenticate(user=user)
+        with mock.patch.object(cache, 'incr', side_effect=ConnectionError('redis down')):
+            with self.assertLogs('django', 'ERROR'):
+                with self.captureOnCommitCallbacks(execute=True):
+                    resposta = self.client.post('/api/consultas/', {'agenda': self.agenda.id}, format='json')
+        self.assertEqual(resposta.status_code, 201)
+
+    def test_edicao_do_medico_invalida_detalhe(self):
+        url = f'/api/medicos/{self.medico.id}/'
+        etag = self.client.get(url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Medico.objects.filter(pk=self.medico.pk).first().save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+@hash_rapido
+class ClaimsJWTTest(TestCase):
+
+    def setUp(self):
+        self.medico_user = User.objects.create_user(username='dra.ana', email='ana@exemplo.com', password='senha12345')
+        self.medico = Medico.objects.create(user=self.medico_user, nome='Ana Paula', crm='123456', especialidade='Cardiologista')
+        self.paciente_user = User.objects.create_user(username='joao', email='joao@exemplo.com', password='senha12345')
+        self.paciente = Paciente.objects.create(user=self.paciente_user, nome='João', cpf='12345678900')
+        agenda = Agenda.objects.create(medico=self.medico, dia=timezone.now().date() + timedelta(days=1), horario=time(9, 0))
+        Consulta.objects.create(agenda=agenda, paciente=self.paciente)
+
+    def autenticar(self, username):
+        client = APIClient()
+        resposta = client.post('/api/token/', {'username': username, 'password': 'senha12345'}, format='json')
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {resposta.data['access']}")
+        return client
+
+    def test_me_sem_carregar_usuario_e_perfil(self):
+        # Só a conferência de is_active/is_staff, sem User, Medico ou
+        # Paciente; depois ela também vem do cache
+        client = self.autenticar('dra.ana')
+        with self.assertNumQueries(1):
+            resposta = client.get('/api/me/')
+        with self.assertNumQueries(0):
+            client.get('/api/me/')
+        self.assertEqual(resposta.data, {
+            'id': self.medico_user.id,
+            'username': 'dra.ana',
+            'email': 'ana@exemplo.com',
+            'type': 'medico',
+            'medico_id': self.medico.id,
+            'crm': '123456',
+        })
+
+        client = self.autenticar('joao')
+        with self.assertNumQueries(1):
+            resposta = client.get('/api/me/')
+        self.assertEqual(resposta.data['type'], 'paciente')
+        self.assertEqual(resposta.data['paciente_id'], self.paciente.id)
+
+    def test_listagem_de_consultas_do_medico_em_uma_consulta(self):
+        client = self.autenticar('dra.ana')
+        # A listagem e a conferência do usuário ativo
+        with self.assertNumQueries(2):
+            resposta = client.get('/api/consultas/')
+        self.assertEqual(len(resposta.data['results']), 1)
+
+    def test_token_sem_claims_continua_valido(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.medico_user)}')
+        resposta = client.get('/api/me/')
+        self.assertEqual(resposta.data['type'], 'medico')
+        self.assertEqual(resposta.data['medico_id'], self.medico.id)
+
+    def test_token_sem_claims_usa_usuario_em_cache(self):
+        cache.clear()
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.medico_user)}')
+        # Usuário e perfil num SELECT só; depois, do cache
+        with self.assertNumQueries(1):
+            client.get('/api/me/')
+        with self.assertNumQueries(0):
+            self.assertEqual(client.get('/api/me/').data['crm'], '123456')
+        guardado = cache.get(f'autenticacao:usuario:{self.medico_user.id}')
+        self.assertNotIn('password', guardado)
+        self.assertEqual(guardado['medico_id'], self.medico.id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Medico.objects.filter(pk=self.medico.pk).update(crm='654321')
+            Medico.objects.get(pk=self.medico.pk).save()
+        self.assertEqual(client.get('/api/me/').data['crm'], '654321')
+
+    def test_usuario_desativado_perde_o_acesso(self):
+        cache.clear()
+        client = self.autenticar('joao')
+        self.assertEqual(client.get('/api/me/').status_code, 200)
+
+        self.paciente_user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.paciente_user.save()
+        self.assertEqual(client.get('/api/me/').status_code, 401)
+        antigo = APIClient()
+        antigo.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.paciente_user)}')
+        self.assertEqual(antigo.get('/api/me/').status_code, 401)
+
+        self.paciente_user.is_active = True
+        with self.captureOnCommitCallbacks(execute=True):
+            self.paciente_user.save()
+        self.assertEqual(client.get('/api/me/').status_code, 200)
+
+    def test_usuario_excluido_ou_sem_staff(self):
+        admin = User.objects.create_user(username='admin', password='senha12345', is_staff=True)
+        client = self.autenticar('admin')
+        self.assertEqual(client.get('/api/exportacao/consultas/').status_code, 200)
+
+        admin.is_staff = False
+        with self.captureOnCommitCallbacks(execute=True):
+            admin.save()
+        self.assertEqual(client.get('/api/exportacao/consultas/').status_code, 403)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            admin.delete()
+        self.assertEqual(client.get('/api/me/').status_code, 401)
+
+    def test_rotas_de_administracao_conferem_no_banco(self):
+        admin = User.objects.create_user(username='admin', password='senha12345', is_staff=True)
+        client = self.autenticar('admin')
+        self.assertEqual(client.get('/api/me/').status_code, 200)
+        # Revogado sem invalidar este cache (como visto de outro worker)
+        User.objects.filter(pk=admin.pk).update(is_staff=False)
+        self.assertEqual(client.get('/api/exportacao/consultas/').status_code, 403)
+
+    def test_check_exige_cache_compartilhado(self):
+        with self.settings(CACHE_COMPARTILHADO_OBRIGATORIO=True):
+            self.assertEqual([erro.id for erro in checks.cache_compartilhado(None)], ['core.E001'])
+        with self.settings(CACHE_COMPARTILHADO_OBRIGATORIO=False):
+            self.assertEqual(checks.cache_compartilhado(None), [])
+
+
+@hash_rapido
+class ProvisionamentoPacienteTest(TestCase):
+
+    def test_registro_cria_paciente(self):
+        resposta = APIClient().post('/api/register/', {
+            'username': 'maria', 'email': 'maria@exemplo.com',
+            'password': 'senha12345', 'confirm_password': 'senha12345',
+        }, format='json')
+        self.assertEqual(resposta.status_code, 201)
+        paciente = Paciente.objects.get(user__username='maria')
+        self.assertEqual(paciente.cpf, f'temp_{paciente.user_id}')
+        self.assertEqual(paciente.email, 'maria@exemplo.com')
+
+    def test_registro_com_email_de_outro_paciente(self):
+        Paciente.objects.create(nome='Maria', cpf='12345678900', email='maria@exemplo.com')
+        resposta = APIClient().post('/api/register/', {
+            'username': 'maria', 'email': 'maria@exemplo.com',
+            'password': 'senha12345', 'confirm_password': 'senha12345',
+        }, format='json')
+        self.assertEqual(resposta.status_code, 400)
+        self.assertFalse(User.objects.filter(username='maria').exists())
+
+    def test_listagem_nao_escreve(self):
+        user = User.objects.create_user(username='sem.perfil', password='senha12345')
+        client = APIClient()
+        client.force_authenticate(user=user)
+        with CaptureQueriesContext(connection) as queries:
+            resposta = client.get('/api/consultas/')
+        self.assertEqual(resposta.data['results'], [])
+        self.assertTrue(all(query['sql'].startswith('SELECT') for query in queries))
+        self.assertFalse(Paciente.objects.exists())
+
+    def test_comando_de_provisionamento(self):
+        medico = User.objects.create_user(username='dra.ana', email='ana@exemplo.com')
+        Medico.objects.create(user=medico, nome='Ana', crm='123', especialidade='Pediatra')
+        Paciente.objects.create(nome='Outro', cpf='111', email='repetido@exemplo.com')
+        sem_perfil = [
+            User.objects.create_user(username='a', email='repetido@exemplo.com'),
+            User.objects.create_user(username='b', email='b@exemplo.com'),
+            User.objects.create_user(username='c', email=''),
+            User.objects.create_user(username='d', email=''),
+        ]
+
+        call_command('provisionar_pacientes', lote=3, stdout=StringIO())
+
+        self.assertEqual(Paciente.objects.filter(user__in=sem_perfil).count(), 4)
+        self.assertFalse(Paciente.objects.filter(user=medico).exists())
+        self.assertIsNone(Paciente.objects.get(user__username='a').email)
+        saida = StringIO()
+        call_command('provisionar_pacientes', stdout=saida)
+        self.assertEqual(Paciente.objects.count(), 5)
+        self.assertIn('0 perfis de paciente criados', saida.getvalue())
+
+    def test_provisionamento_conta_so_os_perfis_criados(self):
+        usuarios = [User.objects.create_user(username=nome) for nome in ('a', 'b', 'c')]
+        original, leituras = Paciente.objects.filter, []
+
+        def concorrente(*args, **kwargs):
+            # Um cadastro cria o perfil de 'a' logo depois da leitura do lote
+            leituras.append(kwargs)
+            if len(leituras) == 1:
+                Paciente.objects.create(user=usuarios[0], nome='a', cpf='999')
+                return Paciente.objects.none()
+            return original(*args, **kwargs)
+
+        saida = StringIO()
+        with mock.patch.object(Paciente.objects, 'filter', side_effect=concorrente):
+            call_command('provisionar_pacientes', stdout=saida)
+        self.assertIn('2 perfis de paciente criados', saida.getvalue())
+        self.assertEqual(Paciente.objects.count(), 3)
+
+
+@hash_rapido
+class OrcamentoDeConsultasTest(TestCase):
+    """
+    Orçamento de queries e de tempo por endpoint, com uma base semeada
+    de tamanho realista. Se uma mudança aumentar o número de queries de
+    algum endpoint (um N+1, por exemplo), o teste falha: ajuste o número
+    aqui só se o aumento for intencional.
+    """
+
+    LIMITE_SEGUNDOS = 0.5
+
+    # Contam também os SAVEPOINTs do transaction.atomic de cada view, e o
+    # UPDATE do contador do painel (EstatisticaDiaria) em cada mudança.
+    # O agendamento é o primeiro do dia do médico: o contador ainda não
+    # existe e custa UPDATE vazio, INSERT e UPDATE.
+    # A primeira requisição de cada usuário confere is_active no banco; as
+    # seguintes leem do cache (ver estado_em_cache). Mexer no resumo de
+    # disponibilidade trava as linhas antes de recalcular (um SELECT a mais).
+    # O agendamento reserva com UPDATE ... RETURNING, sem SELECT de Agenda
+    # e Paciente para validar; o paciente só é lido para a resposta.
+    QUERIES_AGENDAMENTO = 12
+    # Cancelar devolve o horário: inclui o UPDATE da agenda e do resumo
+    QUERIES_CANCELAMENTO = 10
+    QUERIES_ATUALIZACAO_STATUS = 7
+
+    @classmethod
+    def setUpTestData(cls):
+        amanha = timezone.now().date() + timedelta(days=1)
+        cls.medicos = []
+        for i in range(10):
+            user = User.objects.create_user(username=f'medico{i}', email=f'medico{i}@exemplo.com', password='senha12345')
+            cls.medicos.append(Medico.objects.create(user=user, nome=f'Medico {i}', crm=f'CRM{i}', especialidade='Pediatra'))
+        cls.pacientes = []
+        for i in range(20):
+            user = User.objects.create_user(username=f'paciente{i}', email=f'paciente{i}@exemplo.com', password='senha12345')
+            cls.pacientes.append(Paciente.objects.create(user=user, nome=f'Paciente {i}', cpf=f'{i:011d}', email=user.email))
+        Agenda.objects.bulk_create(
+            Agenda(medico=medico, dia=amanha + timedelta(days=d), horario=time(h, 0))
+            for medico in cls.medicos
+            for d in range(5)
+            for h in range(8, 14)
+        )
+        reconstruir_disponibilidade()
+
+        status_possiveis = [codigo for codigo, _ in Consulta.STATUS_CHOICES]
+        agendas = list(Agenda.objects.filter(medico=cls.medicos[0]).order_by('id')[:20])
+        for i, agenda in enumerate(agendas):
+            Consulta.objects.create(agenda=agenda, paciente=cls.pacientes[i % 3], status=status_possiveis[i % 5])
+        Agenda.objects.filter(id__in=[agenda.id for agenda in agendas]).update(disponivel=False)
+        cls.livre = Agenda.objects.filter(disponivel=True).exclude(medico=cls.medicos[0]).first()
+        cls.pendente = Consulta.objects.filter(status='PENDENTE').first()
+
+    def setUp(self):
+        cache.clear()
+
+    def autenticar(self, username):
+        client = APIClient()
+        resposta = client.post('/api/token/', {'username': username, 'password': 'senha12345'}, format='json')
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {resposta.data['access']}")
+        return client
+
+    @contextmanager
+    def orcamento(self, queries):
+        inicio = relogio.perf_counter()
+        with self.assertNumQueries(queries):
+            yield
+        self.assertLess(relogio.perf_counter() - inicio, self.LIMITE_SEGUNDOS)
+
+    def test_medicos(self):
+        with self.orcamento(1):
+            resposta = APIClient().get('/api/medicos/')
+        self.assertEqual(resposta.status_code, 200)
+
+    def test_agendas(self):
+        with self.orcamento(1):
+            resposta = APIClient().get('/api/agendas/')
+        self.assertEqual(resposta.status_code, 200)
+
+    def test_agendas_do_medico(self):
+        with self.orcamento(1):
+            resposta = APIClient().get(f'/api/agendas/?medico={self.medicos[1].id}')
+        self.assertEqual(len(resposta.data['results']), 30)
+
+    def test_disponibilidade(self):
+        with self.orcamento(3):
+            resposta = APIClient().get('/api/disponibilidade/?especialidade=Pediatra')
+        self.assertEqual(len(resposta.data), 10)
+
+    def test_consultas_do_medico(self):
+        client = self.autenticar('medico0')
+        with self.orcamento(2):
+            resposta = client.get('/api/consultas/')
+        self.assertEqual(len(resposta.data['results']), 20)
+
+    def test_consultas_do_paciente(self):
+        client = self.autenticar('paciente0')
+        with self.orcamento(2):
+            resposta = client.get('/api/consultas/')
+        self.assertEqual(len(resposta.data['results']), 7)
+
+    def test_me(self):
+        client = self.autenticar('paciente0')
+        with self.orcamento(1):
+            resposta = client.get('/api/me/')
+        self.assertEqual(resposta.status_code, 200)
+
+    def test_agendamento(self):
+        client = self.autenticar('paciente5')
+        with self.orcamento(self.QUERIES_AGENDAMENTO):
+            resposta = client.post('/api/consultas/', {'agenda': self.livre.id}, format='json')
+        self.assertEqual(resposta.status_code, 201)
+
+    def test_cancelamento(self):
+        client = self.autenticar(self.pendente.paciente.user.username)
+        with self.orcamento(self.QUERIES_CANCELAMENTO):
+            resposta = client.post(f'/api/consultas/{self.pendente.id}/cancelar/', {'motivo': 'Imprevisto'}, format='json')
+        self.assertEqual(resposta.status_code, 200)
+
+    def test_atualizacao_de_status(self):
+        client = self.autenticar('medico0')
+        with self.orcamento(self.QUERIES_ATUALIZACAO_STATUS):
+            resposta = client.patch(f'/api/consultas/{self.pendente.id}/atualizar_status/', {'status': 'AGENDADA'}, format='json')
+        self.assertEqual(resposta.status_code, 200)
+
+
+class BackendDeTeste:
+    def __init__(self, falhar=False):
+        self.falhar = falhar
+        self.enviadas = []
+
+    def enviar(self, notificacao, assunto, texto, destinatarios):
+        if self.falhar:
+            raise ConnectionError('SMTP indisponível')
+        self.enviadas.append((notificacao.evento, destinatarios, texto))
+
+
+@hash_rapido
+@override_settings(NOTIFICACOES_MAX_TENTATIVAS=3, NOTIFICACOES_ESPERA_BASE=30)
+class OutboxNotificacoesTest(TestCase):
+
+    def setUp(self):
+        medico = Medico.objects.create(nome='Ana Paula', crm='111', especialidade='Cardiologista', email='ana@exemplo.com')
+        self.agenda = Agenda.objects.create(medico=medico, dia=timezone.now().date() + timedelta(days=1), horario=time(9, 0))
+        self.user = User.objects.create_user(username='joao', password='senha12345')
+        Paciente.objects.create(user=self.user, nome='João', cpf='12345678900', email='joao@exemplo.com')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def agendar(self):
+        resposta = self.client.post('/api/consultas/', {'agenda': self.agenda.id}, format='json')
+        self.assertEqual(resposta.status_code, 201)
+        return resposta.data['id']
+
+    def test_agendamento_grava_no_outbox_sem_entregar(self):
+        consulta_id = self.agendar()
+        notificacao = Notificacao.objects.get()
+        self.assertEqual((notificacao.evento, notificacao.consulta_id, notificacao.status), ('CONSULTA_CRIADA', consulta_id, 'PENDENTE'))
+
+    def test_entrega_em_lote(self):
+        consulta_id = self.agendar()
+        self.client.post(f'/api/consultas/{consulta_id}/cancelar/', {'motivo': 'Imprevisto'}, format='json')
+
+        backend = BackendDeTeste()
+        # Reserva (SAVEPOINT, SELECT do lote com os joins, UPDATE do prazo,
+        # RELEASE) e, depois dos envios, o UPDATE em lote
+        with self.assertNumQueries(5):
+            self.assertEqual(processar_lote(backend=backend), (2, 0))
+        self.assertEqual([evento for evento, _, _ in backend.enviadas], ['CONSULTA_CRIADA', 'CONSULTA_CANCELADA'])
+        self.assertEqual(backend.enviadas[1][1], ['ana@exemplo.com', 'joao@exemplo.com'])
+        self.assertIn('Motivo: Imprevisto', backend.enviadas[1][2])
+        self.assertFalse(Notificacao.objects.exclude(status='ENVIADA').exists())
+        self.assertEqual(processar_lote(backend=backend), (0, 0))
+
+    def test_nova_tentativa_com_espera_exponencial(self):
+        self.agendar()
+        backend = BackendDeTeste(falhar=True)
+
+        self.assertEqual(processar_lote(backend=backend), (0, 1))
+        notificacao = Notificacao.objects.get()
+        self.assertEqual((notificacao.status, notificacao.tentativas), ('PENDENTE', 1))
+        self.assertAlmostEqual((notificacao.proxima_tentativa - timezone.now()).total_seconds(), 30, delta=5)
+
+        # Ainda não venceu a espera
+        self.assertEqual(processar_lote(backend=backend), (0, 0))
+
+        for tentativas, espera in ((2, 60), (3, None)):
+            Notificacao.objects.update(proxima_tentativa=timezone.now())
+            processar_lote(backend=backend)
+            notificacao.refresh_from_db()
+            self.assertEqual(notificacao.tentativas, tentativas)
+            if espera:
+                self.assertAlmostEqual((notificacao.proxima_tentativa - timezone.now()).total_seconds(), espera, delta=5)
+        self.assertEqual(notificacao.status, 'FALHOU')
+        self.assertEqual(notificacao.ultimo_erro, 'SMTP indisponível')
+
+    def test_entrega_fora_da_transacao_da_reserva(self):
+        self.agendar()
+        profundidade = len(connection.atomic_blocks)
+        durante_o_envio = []
+
+        class Espiao(BackendDeTeste):
+            def enviar(backend, notificacao, *mensagem):
+                # Sem transação aberta, e a reserva tira a linha de outro worker
+                durante_o_envio.append((len(connection.atomic_blocks), processar_lote(backend=BackendDeTeste())))
+                super().enviar(notificacao, *mensagem)
+
+        self.assertEqual(processar_lote(backend=Espiao()), (1, 0))
+        self.assertEqual(durante_o_envio, [(profundidade, (0, 0))])
+        self.assertEqual(Notificacao.objects.get().status, 'ENVIADA')
+
+    def test_sem_consulta_fica_descartada(self):
+        consulta_id = self.agendar()
+        Consulta.objects.filter(id=consulta_id).delete()
+        backend = BackendDeTeste()
+        self.assertEqual(processar_lote(backend=backend), (0, 0))
+        self.assertEqual((Notificacao.objects.get().status, backend.enviadas), ('DESCARTADA', []))
+
+    def test_comando_com_backend_de_arquivo(self):
+        self.agendar()
+        with tempfile.TemporaryDirectory() as diretorio:
+            arquivo = os.path.join(diretorio, 'notificacoes.log')
+            with self.settings(NOTIFICACOES_BACKEND='core.notificacoes.ArquivoBackend', NOTIFICACOES_ARQUIVO=arquivo):
+                call_command('processar_notificacoes', stdout=StringIO())
+            with open(arquivo, encoding='utf-8') as f:
+                linhas = [json.loads(linha) for linha in f]
+        self.assertEqual(len(linhas), 1)
+        self.assertEqual(linhas[0]['destinatarios'], ['ana@exemplo.com'])
+
+
+def imagem_png(cor, tamanho=(1200, 900)):
+    saida = BytesIO()
+    Image.new('RGB', tamanho, cor).save(saida, 'PNG')
+    return SimpleUploadedFile('foto.png', saida.getvalue(), content_type='image/png')
+
+
+@hash_rapido
+class FotoPerfilTest(TestCase):
+
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        override = self.settings(MEDIA_ROOT=self.media.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        cache.clear()
+
+        self.user = User.objects.create_user(username='dra.ana', password='senha12345')
+        self.medico = Medico.objects.create(user=self.user, nome='Ana Paula', crm='111', especialidade='Cardiologista')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def enviar(self, client, arquivo):
+        with self.captureOnCommitCallbacks(execute=True):
+            return client.patch('/api/profile/photo/', {'foto': arquivo}, format='multipart')
+
+    def test_upload_dedupe_e_variantes(self):
+        self.assertEqual(self.enviar(self.client, imagem_png('red')).status_code, 200)
+        self.medico.refresh_from_db()
+        self.assertEqual(len(self.medico.foto_hash), 64)
+        self.assertIn(self.medico.foto_hash, self.medico.foto.name)
+        self.assertFalse(self.medico.foto_processada)
+
+        # Mesmo conteúdo enviado por outro perfil reaproveita o arquivo
+        outro = User.objects.create_user(username='joao', password='senha12345')
+        paciente = Paciente.objects.create(user=outro, nome='João', cpf='123')
+        client = APIClient()
+        client.force_authenticate(user=outro)
+        self.enviar(client, imagem_png('red'))
+        paciente.refresh_from_db()
+        self.assertEqual(paciente.foto.name, self.medico.foto.name)
+
+        # Antes do processamento a listagem aponta para o original
+        dados = APIClient().get('/api/medicos/').data['results'][0]
+        self.assertTrue(dados['foto_miniatura'].endswith(self.medico.foto.name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('processar_fotos', stdout=StringIO())
+        self.medico.refresh_from_db()
+        self.assertTrue(self.medico.foto_processada)
+        for variante, lado in (('miniatura', 128), ('perfil', 512)):
+            with default_storage.open(caminho_variante(self.medico.foto_hash, variante)) as arquivo:
+                with Image.open(arquivo) as imagem:
+                    self.assertEqual((imagem.format, imagem.size), ('JPEG', (lado, lado)))
+
+        dados = APIClient().get('/api/medicos/').data['results'][0]
+        self.assertTrue(dados['foto_miniatura'].endswith(caminho_variante(self.medico.foto_hash, 'miniatura')))
+
+    def test_troca_de_foto_remove_a_anterior(self):
+        self.enviar(self.client, imagem_png('red'))
+        call_command('processar_fotos', stdout=StringIO())
+        self.medico.refresh_from_db()
+        antiga = (self.medico.foto.name, caminho_variante(self.medico.foto_hash, 'miniatura'))
+
+        self.enviar(self.client, imagem_png('blue'))
+        for nome in antiga:
+            self.assertFalse(default_storage.exists(nome))
+
+    def test_arquivo_que_nao_e_imagem(self):
+        arquivo = SimpleUploadedFile('foto.png', b'nao sou uma imagem', content_type='image/png')
+        self.assertEqual(self.enviar(self.client, arquivo).status_code, 400)
+        self.medico.refresh_from_db()
+        self.assertFalse(self.medico.foto)
+
+    def test_bomba_de_descompressao(self):
+        # Acima do limite só avisa; acima do dobro o Pillow já recusa
+        for limite in (1200 * 900 - 1, 1200 * 900 // 2 - 1):
+            with mock.patch.object(Image, 'MAX_IMAGE_PIXELS', limite):
+                resposta = self.enviar(self.client, imagem_png('red'))
+            self.assertEqual(resposta.status_code, 400)
+        self.medico.refresh_from_db()
+        self.assertFalse(self.medico.foto)
+
+
+class SeedTest(TestCase):
+    def gerar(self, **opcoes):
+        call_command('seed', medicos=3, pacientes=20, meses_passados=1, meses_futuros=1, stdout=StringIO(), **opcoes)
+
+    def retrato(self):
+        return (
+            list(Medico.objects.order_by('id').values_list('nome', 'crm', 'especialidade')),
+            list(Agenda.objects.order_by('id').values_list('medico__crm', 'dia', 'horario', 'disponivel')),
+            list(Consulta.objects.order_by('id').values_list('agenda_id', 'paciente__cpf', 'status')),
+        )
+
+    def test_mesma_semente_gera_os_mesmos_dados(self):
+        self.gerar(seed=7)
+        primeiro = self.retrato()
+        for model in (Consulta, Agenda, Medico, Paciente, User):
+            model.objects.all().delete()
+        self.gerar(seed=7)
+        self.assertEqual(self.retrato(), primeiro)
+
+    def test_dados_consistentes(self):
+        self.gerar(seed=1, ocupacao=0.8)
+        self.assertEqual(Medico.objects.count(), 3)
+        self.assertEqual(Paciente.objects.count(), 20)
+        self.assertEqual(User.objects.count(), 23)
+
+        status = set(Consulta.objects.values_list('status', flat=True))
+        self.assertEqual(status, {codigo for codigo, _ in Consulta.STATUS_CHOICES})
+        ativas = Consulta.objects.exclude(status__in=Consulta.STATUS_QUE_LIBERAM)
+        self.assertFalse(ativas.filter(agenda__disponivel=True).exists())
+        self.assertEqual(Agenda.objects.filter(disponivel=False).count(), ativas.count())
+
+        # Resumo de disponibilidade refeito depois da carga
+        livres = sum(ResumoDisponibilidade.objects.values_list('livres', flat=True))
+        self.assertEqual(livres, Agenda.objects.filter(disponivel=True).count())
+
+        # Sequências ajustadas: inserções normais continuam funcionando
+        medico = Medico.objects.first()
+        Agenda.objects.create(medico=medico, dia=timezone.localdate() + timedelta(days=400), horario=time(7, 0))
+
+    def test_valores_do_copy_preenchem_colunas_obrigatorias(self):
+        # O COPY do PostgreSQL grava None como NULL: nenhuma linha gerada pode
+        # deixar vazia uma coluna NOT NULL (ex.: auto_now sem pre_save)
+        inseridas = []
+        inserir = seed.Escritor.inserir
+
+        def capturar(escritor, model, linhas):
+            inseridas.append((model, list(linhas)))
+            inserir(escritor, model, linhas)
+
+        with mock.patch.object(seed.Escritor, 'inserir', autospec=True, side_effect=capturar):
+            self.gerar(seed=2)
+        self.assertEqual({model for model, _ in inseridas}, {User, Medico, Paciente, Agenda, Consulta})
+
+        escritor = seed.Escritor(lote=100)
+        for model, linhas in inseridas:
+            campos = model._meta.concrete_fields
+            obrigatorios = [posicao for posicao, campo in enumerate(campos) if not campo.null]
+            instancia = model()
+            for linha in linhas:
+                valores = escritor._valores(campos, instancia, linha)
+                with self.subTest(model=model.__name__, linha=linha['id']):
+                    self.assertNotIn(None, [valores[posicao] for posicao in obrigatorios])
+
+        # auto_now não informado recebe o momento atual, como no bulk_create
+        campos = Consulta._meta.concrete_fields
+        consulta = next(linhas[0] for model, linhas in inseridas if model is Consulta and linhas)
+        linha = {chave: valor for chave, valor in consulta.items() if chave != 'atualizada_em'}
+        valores = dict(zip((campo.attname for campo in campos), escritor._valores(campos, Consulta(), linha)))
+        self.assertIsNotNone(valores['atualizada_em'])
+
+
+@hash_rapido
+class BenchmarkTest(TestCase):
+    def test_relatorio_com_todas_as_operacoes(self):
+        call_command('seed', medicos=3, pacientes=10, meses_passados=0, meses_futuros=1, seed=3, stdout=StringIO())
+        with tempfile.TemporaryDirectory() as pasta:
+            saida = os.path.join(pasta, 'resultado.json')
+            call_command('benchmark', requisicoes=60, aquecimento=5, usuarios=3, saida=saida, stdout=StringIO())
+            with open(saida, encoding='utf-8') as arquivo:
+                relatorio = json.load(arquivo)
+
+            # O relatório anterior pode ser comparado com uma nova rodada
+            saida_comparacao = StringIO()
+            call_command('benchmark', requisicoes=20, aquecimento=0, usuarios=3, comparar=saida, stdout=saida_comparacao)
+            self.assertIn('p95_ms', saida_comparacao.getvalue())
+
+        self.assertEqual(set(relatorio['operacoes']), {'listar_medicos', 'listar_agendas', 'reservar', 'cancelar', 'atualizar_status'})
+        self.assertEqual(relatorio['total']['requisicoes'] + sum(relatorio['puladas'].values()), 60)
+        self.assertEqual(relatorio['total']['erros'], 0)
+        for dados in relatorio['operacoes'].values():
+            self.assertLessEqual(dados['p50_ms'], dados['p95_ms'])
+            self.assertLessEqual(dados['p95_ms'], dados['p99_ms'])
+            self.assertGreaterEqual(dados['queries_media'], 0)
+
+
+@hash_rapido
+class InstrumentacaoTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username='medico', password='senha12345')
+        cls.medico = Medico.objects.create(user=user, nome='Dra. Ana', crm='111', especialidade='Pediatra')
+        amanha = timezone.now().date() + timedelta(days=1)
+        paciente = Paciente.objects.create(nome='João', cpf='123')
+        for h in range(8, 11):
+            agenda = Agenda.objects.create(medico=cls.medico, dia=amanha, horario=time(h, 0), disponivel=False)
+            Consulta.objects.create(agenda=agenda, paciente=paciente)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.medico.user)
+
+    def test_server_timing_com_queries_e_tempos(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/consultas/')
+        timing = {item.split(';')[0]: item for item in response['Server-Timing'].split(', ')}
+        self.assertEqual(set(timing), {'db', 'view', 'render', 'total'})
+        self.assertIn(f'desc="{len(queries)} queries"', timing['db'])
+        duracoes = {nome: float(item.split('dur=')[1].split(';')[0]) for nome, item in timing.items()}
+        self.assertLessEqual(duracoes['view'] + duracoes['render'], duracoes['total'])
+
+    async def test_server_timing_em_asgi_conta_queries(self):
+        # Em ASGI o middleware roda sem adaptação e o wrapper fica na thread da view
+        response = await self.async_client.get('/api/medicos/')
+        self.assertEqual(response.status_code, 200)
+        timing = {item.split(';')[0]: item for item in response['Server-Timing'].split(', ')}
+        self.assertNotIn('desc="0 queries"', timing['db'])
+
+    def test_orcamento_excedido_e_sql_lento(self):
+        with self.settings(INSTRUMENTACAO_ORCAMENTOS={'/api/consultas/': {'queries': 0}}, INSTRUMENTACAO_SQL_LENTO_MS=0):
+            with self.assertLogs('core', 'WARNING') as logs:
+                self.client.get('/api/consultas/?page_size=10')
+        requisicao = [linha for linha in logs.output if 'core.requisicoes' in linha]
+        self.assertEqual(len(requisicao), 1)
+        self.assertIn('orcamento_excedido=queries>0', requisicao[0])
+        self.assertTrue(any('sql_lento' in linha and 'core/pagination.py' in linha for linha in logs.output))
+
+        # Dentro do orçamento não há WARNING
+        with self.assertNoLogs('core', 'WARNING'):
+            self.client.get('/api/consultas/')
+
+
+@hash_rapido
+class ArquivamentoTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        hoje = timezone.localdate()
+        user = User.objects.create_user(username='medico', password='senha12345')
+        cls.medico = Medico.objects.create(user=user, nome='Dra. Ana', crm='111', especialidade='Pediatra')
+        user = User.objects.create_user(username='joao', password='senha12345')
+        cls.paciente = Paciente.objects.create(user=user, nome='João', cpf='123')
+
+        # Slots passados entram por bulk_create (o save valida a data)
+        antigos = Agenda.objects.bulk_create([
+            Agenda(medico=cls.medico, dia=hoje - timedelta(days=400), horario=time(h, 0), disponivel=False)
+            for h in range(8, 12)
+        ])
+        cls.recente = Agenda.objects.bulk_create([Agenda(medico=cls.medico, dia=hoje - timedelta(days=10), horario=time(9, 0), disponivel=False)])[0]
+        cls.livre_vencido = Agenda.objects.bulk_create([Agenda(medico=cls.medico, dia=hoje - timedelta(days=3), horario=time(9, 0))])[0]
+        cls.livre_futuro = Agenda.objects.create(medico=cls.medico, dia=hoje + timedelta(days=3), horario=time(9, 0))
+
+        cls.finalizada, cls.cancelada, cls.rejeitada, cls.pendente = [
+            Consulta.objects.create(agenda=agenda, paciente=cls.paciente, status=status, motivo_cancelamento='motivo')
+            for agenda, status in zip(antigos, ['FINALIZADA', 'CANCELADA', 'REJEITADA', 'PENDENTE'])
+        ]
+        cls.finalizada_recente = Consulta.objects.create(agenda=cls.recente, paciente=cls.paciente, status='FINALIZADA')
+        reconstruir_disponibilidade()
+
+    def setUp(self):
+        cache.clear()
+
+    def test_listagem_de_agendas_ignora_horarios_vencidos(self):
+        ids = [agenda['id'] for agenda in APIClient().get(f'/api/agendas/?medico={self.medico.id}').data['results']]
+        self.assertEqual(ids, [self.livre_futuro.id])
+
+    def test_listagem_em_cache_nao_mostra_horario_que_ja_comecou(self):
+        url = f'/api/agendas/?medico={self.medico.id}'
+        localtime = timezone.localtime
+
+        def listar(hora, **headers):
+            agora = timezone.make_aware(datetime.combine(self.livre_futuro.dia, hora))
+            with mock.patch.object(timezone, 'localtime', lambda *args, **kwargs: localtime(*args, **kwargs) if args else agora):
+                return APIClient().get(url, headers=headers)
+
+        antes = listar(time(8, 59, 30))
+        self.assertEqual([agenda['id'] for agenda in antes.data['results']], [self.livre_futuro.id])
+        depois = listar(time(9, 1, 10), if_none_match=antes['ETag'])
+        self.assertEqual(depois.status_code, 200)
+        self.assertEqual(depois.data['results'], [])
+
+    def test_arquiva_encerradas_e_apaga_slots_vencidos(self):
+        # Com a notificação de criação ainda pendente, a consulta espera a entrega
+        call_command('arquivar', dias=180, lote=2, stdout=StringIO())
+        self.assertFalse(ConsultaArquivada.objects.exists())
+        processar_lote(backend=BackendDeTeste())
+
+        call_command('arquivar', dias=180, lote=2, stdout=StringIO())
+
+        self.assertEqual(
+            set(ConsultaArquivada.objects.values_list('id', flat=True)),
+            {self.finalizada.id, self.cancelada.id, self.rejeitada.id},
+        )
+        self.assertEqual(set(Consulta.objects.values_list('id', flat=True)), {self.pendente.id, self.finalizada_recente.id})
+        self.assertEqual(
+            set(Agenda.objects.values_list('id', flat=True)),
+            {self.pendente.agenda_id, self.recente.id, self.livre_futuro.id},
+        )
+        self.assertFalse(ResumoDisponibilidade.objects.filter(dia__lt=timezone.localdate()).exists())
+
+        arquivada = ConsultaArquivada.objects.get(id=self.cancelada.id)
+        self.assertEqual(
+            (arquivada.medico_id, arquivada.paciente_id, arquivada.dia, arquivada.status, arquivada.motivo_cancelamento),
+            (self.medico.id, self.paciente.id, timezone.localdate() - timedelta(days=400), 'CANCELADA', 'motivo'),
+        )
+        # A notificação já entregue continua no outbox, sem a consulta
+        self.assertTrue(Notificacao.objects.filter(consulta__isnull=True, evento='CONSULTA_CRIADA', status='ENVIADA').exists())
+
+        # Rodar de novo não encontra mais nada
+        call_command('arquivar', dias=180, stdout=StringIO())
+        self.assertEqual(ConsultaArquivada.objects.count(), 3)
+
+    def test_historico_do_paciente_e_do_medico(self):
+        processar_lote(backend=BackendDeTeste())
+        call_command('arquivar', dias=180, stdout=StringIO())
+        outro = User.objects.create_user(username='maria', password='senha12345')
+        Paciente.objects.create(user=outro, nome='Maria', cpf='456')
+
+        for user, esperado in ((self.paciente.user, 3), (self.medico.user, 3), (outro, 0)):
+            client = APIClient()
+            client.force_authenticate(user=user)
+            response = client.get('/api/historico/')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data['results']), esperado)
+        self.assertEqual(response.data['results'], [])
+        self.assertEqual(APIClient().get('/api/historico/').status_code, 401)
+
+
+@hash_rapido
+class AtualizacaoStatusLoteTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        amanha = timezone.localdate() + timedelta(days=1)
+        cls.medicos = []
+        for i in range(2):
+            user = User.objects.create_user(username=f'medico{i}', password='senha12345')
+            cls.medicos.append(Medico.objects.create(user=user, nome=f'Medico {i}', crm=f'CRM{i}', especialidade='Pediatra'))
+        user = User.objects.create_user(username='joao', password='senha12345')
+        cls.paciente = Paciente.objects.create(user=user, nome='João', cpf='123')
+        cls.consultas = {medico.id: [] for medico in cls.medicos}
+        for medico in cls.medicos:
+            for h in range(8, 20):
+                agenda = Agenda.objects.create(medico=medico, dia=amanha, horario=time(h, 0), disponivel=False)
+                cls.consultas[medico.id].append(Consulta.objects.create(agenda=agenda, paciente=cls.paciente))
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.medicos[0].user)
+
+    def enviar(self, ids, **dados):
+        return self.client.post('/api/consultas/atualizar_status_lote/', {'ids': ids, **dados}, format='json')
+
+    def test_resultado_por_item_e_posse(self):
+        minhas = [consulta.id for consulta in self.consultas[self.medicos[0].id][:3]]
+        alheia = self.consultas[self.medicos[1].id][0].id
+        Consulta.objects.filter(id=minhas[2]).update(status='AGENDADA')
+
+        response = self.enviar([*minhas, alheia, 999999, minhas[0]], status='AGENDADA')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['atualizadas'], 2)
+        self.assertEqual(
+            [(item['id'], item['resultado']) for item in response.data['resultados']],
+            [(minhas[0], 'atualizada'), (minhas[1], 'atualizada'), (minhas[2], 'inalterada'),
+             (alheia, 'nao_encontrada'), (999999, 'nao_encontrada')],
+        )
+        self.assertEqual(Consulta.objects.get(id=alheia).status, 'PENDENTE')
+        self.assertEqual(
+            Notificacao.objects.filter(evento='STATUS_ALTERADO').count(), 2
+        )
+
+    def test_rejeicao_exige_motivo_e_grava_para_todas(self):
+        ids = [consulta.id for consulta in self.consultas[self.medicos[0].id][:2]]
+        self.assertEqual(self.enviar(ids, status='REJEITADA').status_code, 400)
+        self.assertEqual(self.enviar(ids, status='INVALIDO', motivo='x').status_code, 400)
+
+        self.assertEqual(self.enviar(ids, status='REJEITADA', motivo='Agenda lotada').status_code, 200)
+        self.assertEqual(
+            set(Consulta.objects.filter(id__in=ids).values_list('status', 'motivo_cancelamento')),
+            {('REJEITADA', 'Agenda lotada')},
+        )
+
+    def test_paciente_nao_pode(self):
+        self.client.force_authenticate(user=self.paciente.user)
+        response = self.enviar([self.consultas[self.medicos[0].id][0].id], status='AGENDADA')
+        self.assertEqual(response.status_code, 403)
+
+    def test_queries_nao_crescem_com_o_lote(self):
+        consultas = self.consultas[self.medicos[0].id]
+        with CaptureQueriesContext(connection) as poucas:
+            self.enviar([consulta.id for consulta in consultas[:2]], status='AGENDADA')
+        with CaptureQueriesContext(connection) as muitas:
+            self.enviar([consulta.id for consulta in consultas[2:]], status='AGENDADA')
+        self.assertEqual(len(poucas), len(muitas))
+
+
+@hash_rapido
+class TransicoesConsultaTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        amanha = timezone.localdate() + timedelta(days=1)
+        user = User.objects.create_user(username='medico', password='senha12345')
+        cls.medico = Medico.objects.create(user=user, nome='Dra. Ana', crm='111', especialidade='Pediatra')
+        cls.pacientes = []
+        for nome in ('joao', 'maria'):
+            user = User.objects.create_user(username=nome, password='senha12345')
+            cls.pacientes.append(Paciente.objects.create(user=user, nome=nome, cpf=nome))
+        cls.agenda = Agenda.objects.create(medico=cls.medico, dia=amanha, horario=time(9, 0))
+
+    def setUp(self):
+        cache.clear()
+        self.medico_client = APIClient()
+        self.medico_client.force_authenticate(user=self.medico.user)
+        self.paciente_client = APIClient()
+        self.paciente_client.force_authenticate(user=self.pacientes[0].user)
+        resposta = self.paciente_client.post('/api/consultas/', {'agenda': self.agenda.id}, format='json')
+        self.consulta_id = resposta.data['id']
+        self.url = f'/api/consultas/{self.consulta_id}/'
+
+    def mudar(self, client, novo_status, **headers):
+        return client.patch(f'{self.url}atualizar_status/', {'status': novo_status, 'motivo': 'motivo'}, format='json', headers=headers)
+
+    def test_transicoes_permitidas_e_invalidas(self):
+        self.assertEqual(self.mudar(self.medico_client, 'CONFIRMADA').status_code, 400)
+        self.assertEqual(self.mudar(self.medico_client, 'FINALIZADA').status_code, 409)
+        self.assertEqual(self.mudar(self.paciente_client, 'AGENDADA').status_code, 403)
+
+        resposta = self.mudar(self.medico_client, 'AGENDADA')
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual((resposta.data['status'], resposta.data['versao']), ('AGENDADA', 2))
+        self.assertEqual(resposta['ETag'], f'"{self.consulta_id}-2"')
+
+        self.assertEqual(self.mudar(self.medico_client, 'FINALIZADA').status_code, 200)
+        resposta = self.paciente_client.post(f'{self.url}cancelar/', {'motivo': 'Imprevisto'}, format='json')
+        self.assertEqual(resposta.status_code, 409)
+        self.assertEqual(Consulta.objects.get(id=self.consulta_id).status, 'FINALIZADA')
+
+    def test_if_match_desatualizado(self):
+        etag = self.medico_client.get(self.url)['ETag']
+        # O paciente cancela antes de o médico confirmar
+        self.assertEqual(self.paciente_client.post(f'{self.url}cancelar/', {'motivo': 'x'}, format='json').status_code, 200)
+
+        resposta = self.mudar(self.medico_client, 'AGENDADA', if_match=etag)
+        self.assertEqual(resposta.status_code, 412)
+        self.assertEqual(self.mudar(self.medico_client, 'REJEITADA', if_match='"lixo"').status_code, 412)
+        self.assertEqual(Consulta.objects.get(id=self.consulta_id).status, 'CANCELADA')
+
+        etag = self.medico_client.get(self.url)['ETag']
+        resposta = self.medico_client.patch(self.url, {'observacoes': 'Trazer exames'}, format='json', headers={'if_match': etag})
+        self.assertEqual(resposta.status_code, 200)
+        resposta = self.medico_client.patch(self.url, {'observacoes': 'Outra coisa'}, format='json', headers={'if_match': etag})
+        self.assertEqual(resposta.status_code, 412)
+        self.assertEqual(Consulta.objects.get(id=self.consulta_id).observacoes, 'Trazer exames')
+
+    def test_status_nao_muda_pelo_update_generico(self):
+        self.medico_client.patch(self.url, {'status': 'FINALIZADA'}, format='json')
+        self.assertEqual(Consulta.objects.get(id=self.consulta_id).status, 'PENDENTE')
+
+    def test_cancelamento_devolve_o_horario(self):
+        self.assertFalse(Agenda.objects.get(id=self.agenda.id).disponivel)
+        self.paciente_client.post(f'{self.url}cancelar/', {'motivo': 'Imprevisto'}, format='json')
+        self.assertTrue(Agenda.objects.get(id=self.agenda.id).disponivel)
+        self.assertEqual(ResumoDisponibilidade.objects.get(medico=self.medico).livres, 1)
+
+        # Outro paciente pode reservar o mesmo horário
+        outro = APIClient()
+        outro.force_authenticate(user=self.pacientes[1].user)
+        resposta = outro.post('/api/consultas/', {'agenda': self.agenda.id}, format='json')
+        self.assertEqual(resposta.status_code, 201)
+        self.assertEqual(self.agenda.consultas.count(), 2)
+        self.assertEqual(
+            outro.post('/api/consultas/', {'agenda': self.agenda.id}, format='json').status_code, 400
+        )
+
+    def test_rejeicao_em_lote_devolve_os_horarios(self):
+        resposta = self.medico_client.post(
+            '/api/consultas/atualizar_status_lote/',
+            {'ids': [self.consulta_id], 'status': 'FINALIZADA'}, format='json',
+        )
+        self.assertEqual(resposta.data['resultados'][0]['resultado'], 'transicao_invalida')
+
+        resposta = self.medico_client.post(
+            '/api/consultas/atualizar_status_lote/',
+            {'ids': [self.consulta_id], 'status': 'REJEITADA', 'motivo': 'Agenda lotada'}, format='json',
+        )
+        self.assertEqual(resposta.data['atualizadas'], 1)
+        self.assertTrue(Agenda.objects.get(id=self.agenda.id).disponivel)
+        self.assertEqual(Consulta.objects.get(id=self.consulta_id).versao, 2)
+
+
+class BrokerDeTeste:
+    def __init__(self):
+        self.publicados = []
+
+    def publicar(self, canal, evento):
+        self.publicados.append((canal, evento['tipo'], evento['dados']))
+
+
+@hash_rapido
+class EventosPublicadosTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.medico = Medico.objects.create(nome='Dra. Ana', crm='111', especialidade='Pediatra')
+        user = User.objects.create_user(username='joao', password='senha12345')
+        cls.paciente = Paciente.objects.create(user=user, nome='João', cpf='123')
+        cls.agenda = Agenda.objects.create(medico=cls.medico, dia=timezone.localdate() + timedelta(days=1), horario=time(9, 0))
+
+    def setUp(self):
+        self.broker = BrokerDeTeste()
+        patcher = mock.patch.object(eventos, '_backend', self.broker)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.paciente.user)
+
+    def test_agendar_e_cancelar_publicam_depois_do_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            consulta_id = self.client.post('/api/consultas/', {'agenda': self.agenda.id}, format='json').data['id']
+        self.assertEqual(self.broker.publicados, [])
+
+        for callback in callbacks:
+            callback()
+        self.assertEqual(
+            [(canal, tipo) for canal, tipo, _ in self.broker.publicados],
+            [
+                (f'medico:{self.medico.id}', 'horario_ocupado'),
+                (f'consultas:medico:{self.medico.id}', 'consulta_criada'),
+                (f'consultas:paciente:{self.paciente.id}', 'consulta_criada'),
+            ],
+        )
+        self.assertEqual(self.broker.publicados[0][2]['agenda'], self.agenda.id)
+
+        self.broker.publicados.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/consultas/{consulta_id}/cancelar/', {'motivo': 'Imprevisto'}, format='json')
+        self.assertEqual(
+            {(tipo, dados.get('status')) for _, tipo, dados in self.broker.publicados},
+            {('status_alterado', 'CANCELADA'), ('horario_liberado', None)},
+        )
+
+    def test_transicao_recusada_nao_publica(self):
+        consulta = Consulta.objects.create(agenda=self.agenda, paciente=self.paciente, status='FINALIZADA')
+        with self.captureOnCommitCallbacks(execute=True):
+            resposta = self.client.post(f'/api/consultas/{consulta.id}/cancelar/', {'motivo': 'x'}, format='json')
+        self.assertEqual(resposta.status_code, 409)
+        self.assertEqual(self.broker.publicados, [])
+
+
+class StreamEventosTest(SimpleTestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(eventos, '_backend', eventos.MemoriaBackend())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @mock.patch('core.authentication.estado_do_usuario', return_value=(True, False))
+    async def test_stream_entrega_eventos_dos_canais_assinados(self, estado):
+        token = AccessToken()
+        token['user_id'] = 1
+        token['type'] = 'paciente'
+        token['paciente_id'] = 7
+        resposta = await self.async_client.get('/api/eventos/', {'medico': '3', 'token': str(token)})
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(resposta['Content-Type'], 'text/event-stream')
+
+        stream = aiter(resposta.streaming_content)
+        self.assertEqual(await anext(stream), b'retry: 3000\n\n')
+        proximo = asyncio.ensure_future(anext(stream))
+        while not eventos._backend.assinaturas:
+            await asyncio.sleep(0)
+
+        eventos.publicar(['medico:4'], 'horario_ocupado', agenda=1)
+        eventos.publicar(['consultas:paciente:7'], 'status_alterado', consulta=9, status='CANCELADA')
+        bloco = (await asyncio.wait_for(proximo, 1)).decode()
+        self.assertIn('event: status_alterado\n', bloco)
+        self.assertIn('data: {"consulta": 9, "status": "CANCELADA"}', bloco)
+
+        # Cliente desconectado: o handler ASGI cancela a tarefa que espera o stream
+        proximo = asyncio.ensure_future(anext(stream))
+        await asyncio.sleep(0)
+        proximo.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await proximo
+        self.assertFalse(eventos._backend.assinaturas)
+
+    def test_wsgi_recusa_o_stream(self):
+        resposta = self.client.get('/api/eventos/', {'medico': '3'})
+        self.assertEqual(resposta.status_code, 501)
+
+    async def test_sem_canais_ou_token_invalido(self):
+        self.assertEqual((await self.async_client.get('/api/eventos/')).status_code, 400)
+        self.assertEqual((await self.async_client.get('/api/eventos/', {'medico': 'x'})).status_code, 400)
+        self.assertEqual((await self.async_client.get('/api/eventos/', {'token': 'lixo'})).status_code, 401)
+
+
+@hash_rapido
+class ReplicasTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.medico = Medico.objects.create(nome='Dra. Ana', crm='111', especialidade='Pediatra')
+        cls.agenda = Agenda.objects.create(medico=cls.medico, dia=timezone.localdate() + timedelta(days=1), horario=time(9, 0))
+        cls.users = []
+        for nome in ('joao', 'maria'):
+            user = User.objects.create_user(username=nome, password='senha12345')
+            Paciente.objects.create(user=user, nome=nome, cpf=nome)
+            cls.users.append(user)
+
+    def setUp(self):
+        cache.clear()
+        self.roteador = replicas.RoteadorReplicas()
+
+    def client_com_token(self, user):
+        client = APIClient()
+        token = self.client.post('/api/token/', {'username': user.username, 'password': 'senha12345'}).json()['access']
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        return client
+
+    @override_settings(DATABASE_REPLICAS=['replica1'])
+    def test_roteamento(self):
+        # O TestCase roda tudo dentro de uma transação no primário
+        self.assertEqual(self.roteador.db_for_read(Medico), 'default')
+
+        with mock.patch.object(connection, 'in_atomic_block', False):
+            self.assertEqual(self.roteador.db_for_read(Medico), 'replica1')
+            with replicas.usar_primario():
+                self.assertEqual(self.roteador.db_for_read(Medico), 'default')
+            self.assertEqual(self.roteador.db_for_read(Medico), 'replica1')
+        self.assertFalse(self.roteador.allow_migrate('replica1', 'core'))
+
+    def test_sem_replicas_tudo_no_primario(self):
+        with mock.patch.object(connection, 'in_atomic_block', False):
+            self.assertEqual(self.roteador.db_for_read(Medico), 'default')
+
+    # O próprio primário como "réplica": as requisições rodam de verdade e
+    # o que se observa é a fixação do usuário depois da escrita.
+    @override_settings(DATABASE_REPLICAS=['default'])
+    def test_escrita_fixa_so_quem_escreveu(self):
+        joao, maria = (self.client_com_token(user) for user in self.users)
+        resposta = joao.post('/api/consultas/', {'agenda': self.agenda.id}, format='json')
+        self.assertEqual(resposta.status_code, 201)
+        self.assertTrue(replicas.usuario_fixado(self.users[0].id))
+        self.assertFalse(replicas.usuario_fixado(self.users[1].id))
+
+        # Escrita recusada não fixa
+        self.assertEqual(maria.post('/api/consultas/', {'agenda': self.agenda.id}, format='json').status_code, 400)
+        self.assertFalse(replicas.usuario_fixado(self.users[1].id))
+
+    @override_settings(DATABASE_REPLICAS=['default'])
+    def test_token_validado_uma_vez_por_requisicao(self):
+        joao = self.client_com_token(self.users[0])
+        validar_token = JWTAuthentication.get_validated_token
+        with mock.patch.object(JWTAuthentication, 'get_validated_token', autospec=True, side_effect=validar_token) as validar:
+            self.assertEqual(joao.get('/api/consultas/').status_code, 200)
+        self.assertEqual(validar.call_count, 1)
+
+    def test_check_exige_cache_compartilhado_com_replicas(self):
+        with self.settings(DATABASE_REPLICAS=['replica1']):
+            self.assertEqual([erro.id for erro in checks.replicas_com_cache_compartilhado(None)], ['core.E002'])
+        with self.settings(DATABASE_REPLICAS=['replica1'], CACHES={'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache'}}):
+            self.assertEqual(checks.replicas_com_cache_compartilhado(None), [])
+        self.assertEqual(checks.replicas_com_cache_compartilhado(None), [])
+
+
+@hash_rapido
+class EstatisticasTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.amanha = timezone.localdate() + timedelta(days=1)
+        user = User.objects.create_user(username='medico', password='senha12345')
+        cls.medico = Medico.objects.create(user=user, nome='Dra. Ana', crm='111', especialidade='Pediatra')
+        cls.agendas = [
+            Agenda.objects.create(medico=cls.medico, dia=cls.amanha + timedelta(days=d), horario=time(h, 0))
+            for d in (0, 7) for h in (9, 10, 11)
+        ]
+        cls.pacientes = []
+        for nome in ('joao', 'maria', 'jose'):
+            user = User.objects.create_user(username=nome, password='senha12345')
+            cls.pacientes.append(Paciente.objects.create(user=user, nome=nome, cpf=nome))
+
+    def client_de(self, username):
+        client = APIClient()
+        token = client.post('/api/token/', {'username': username, 'password': 'senha12345'}).json()['access']
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        return client
+
+    def contadores(self):
+        return sorted(EstatisticaDiaria.objects.values_list('dia', 'pendentes', 'agendadas', 'finalizadas', 'canceladas', 'rejeitadas'))
+
+    def test_contadores_acompanham_agendamentos_e_transicoes(self):
+        ids = []
+        for paciente, agenda in zip(self.pacientes, [self.agendas[0], self.agendas[1], self.agendas[3]]):
+            resposta = self.client_de(paciente.user.username).post('/api/consultas/', {'agenda': agenda.id}, format='json')
+            ids.append(resposta.data['id'])
+
+        medico = self.client_de('medico')
+        medico.patch(f'/api/consultas/{ids[0]}/atualizar_status/', {'status': 'AGENDADA'}, format='json')
+        self.client_de('maria').post(f'/api/consultas/{ids[1]}/cancelar/', {'motivo': 'x'}, format='json')
+        medico.post('/api/consultas/atualizar_status_lote/', {'ids': [ids[2]], 'status': 'REJEITADA', 'motivo': 'x'}, format='json')
+
+        semana_seguinte = self.amanha + timedelta(days=7)
+        self.assertEqual(self.contadores(), [(self.amanha, 0, 1, 0, 1, 0), (semana_seguinte, 0, 0, 0, 0, 1)])
+        incrementais = self.contadores()
+        reconstruir_estatisticas()
+        self.assertEqual(self.contadores(), incrementais)
+
+        with self.assertNumQueries(2):
+            resposta = medico.get('/api/estatisticas/')
+        self.assertEqual(resposta.status_code, 200)
+        dia = resposta.data['dias'][0]
+        # Amanhã: uma agendada ocupa 1 dos 3 horários (o cancelado voltou a ficar livre)
+        self.assertEqual((dia['dia'], dia['agendadas'], dia['canceladas'], dia['livres'], dia['ocupacao']), (self.amanha, 1, 1, 2, round(1 / 3, 4)))
+        self.assertEqual(resposta.data['totais']['rejeitadas'], 1)
+        self.assertEqual(resposta.data['totais']['livres'], 5)
+        self.assertEqual(len(resposta.data['semanas']), 2)
+
+    def test_apenas_medicos(self):
+        self.assertEqual(self.client_de('joao').get('/api/estatisticas/').status_code, 403)
+        self.assertEqual(self.client_de('medico').get('/api/estatisticas/?data_inicio=ontem').status_code, 400)
+
+
+@hash_rapido
+class CalendarioTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        amanha = timezone.localdate() + timedelta(days=1)
+        user = User.objects.create_user(username='medico', password='senha12345')
+        cls.medico = Medico.objects.create(user=user, nome='Dra. Ana', crm='111', especialidade='Pediatra')
+        user = User.objects.create_user(username='joao', password='senha12345')
+        cls.paciente = Paciente.objects.create(user=user, nome='João, o Paciente', cpf='123')
+        cls.consultas = [
+            Consulta.objects.create(
+                agenda=Agenda.objects.create(medico=cls.medico, dia=amanha, horario=time(h, 0), disponivel=False),
+                paciente=cls.paciente, status=situacao, observacoes_paciente='Dor de cabeça há três semanas; ' * 4,
+            )
+            for h, situacao in ((9, 'AGENDADA'), (10, 'PENDENTE'), (11, 'CANCELADA'))
+        ]
+
+    def setUp(self):
+        self.medico_client = APIClient()
+        self.medico_client.force_authenticate(user=self.medico.user)
+        self.url = self.medico_client.post('/api/calendario/').data['url']
+
+    def feed(self, **headers):
+        return self.client.get(self.url, headers=headers)
+
+    def test_feed_so_com_consultas_confirmadas(self):
+        resposta = self.feed()
+        self.assertEqual(resposta.status_code, 200)
+        self.assertTrue(resposta.streaming)
+        corpo = b''.join(resposta.streaming_content).decode()
+        self.assertTrue(corpo.startswith('BEGIN:VCALENDAR\r\n') and corpo.endswith('END:VCALENDAR\r\n'))
+        self.assertEqual(corpo.count('BEGIN:VEVENT'), 1)
+        self.assertIn(f'UID:consulta-{self.consultas[0].id}@', corpo)
+        self.assertIn('SUMMARY:Consulta - João\\, o Paciente', corpo)
+        # Linhas longas são dobradas em até 75 octetos
+        self.assertTrue(all(len(linha.encode()) <= 75 for linha in corpo.split('\r\n')))
+
+    def test_get_condicional(self):
+        resposta = self.feed()
+        b''.join(resposta.streaming_content)
+        with self.assertNumQueries(2):
+            self.assertEqual(self.feed(if_none_match=resposta['ETag']).status_code, 304)
+        self.assertEqual(self.feed(if_modified_since=resposta['Last-Modified']).status_code, 304)
+
+        # Confirmar outra consulta muda o feed
+        self.medico_client.patch(f'/api/consultas/{self.consultas[1].id}/atualizar_status/', {'status': 'AGENDADA'}, format='json')
+        nova = self.feed(if_none_match=resposta['ETag'])
+        self.assertEqual(nova.status_code, 200)
+        self.assertEqual(b''.join(nova.streaming_content).decode().count('BEGIN:VEVENT'), 2)
+
+    def test_nome_do_paciente_ou_do_medico_muda_o_etag(self):
+        etag = self.feed()['ETag']
+        self.paciente.nome = 'João Novo'
+        self.paciente.save()
+        nova = self.feed(if_none_match=etag)
+        self.assertEqual(nova.status_code, 200)
+        self.assertIn('SUMMARY:Consulta - João Novo', b''.join(nova.streaming_content).decode())
+
+        etag = nova['ETag']
+        Medico.objects.filter(pk=self.medico.pk).update(nome='Dra. Renomeada')
+        self.assertEqual(self.feed(if_none_match=etag).status_code, 200)
+
+    def test_token_renovado_invalida_url_anterior(self):
+        anterior = self.url
+        self.assertNotEqual(self.medico_client.post('/api/calendario/').data['url'], anterior)
+        self.assertEqual(self.client.get(anterior).status_code, 404)
+
+        paciente_client = APIClient()
+        paciente_client.force_authenticate(user=self.paciente.user)
+        self.assertEqual(paciente_client.post('/api/calendario/').status_code, 403)
+
+
+@hash_rapido
+class ExportacaoTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        amanha = timezone.localdate() + timedelta(days=1)
+        cls.medicos = [
+            Medico.objects.create(nome=nome, crm=crm, especialidade='Pediatra')
+            for nome, crm in (('Dra. Ana', '111'), ('Dr. Bruno, Jr.', '222'))
+        ]
+        paciente = Paciente.objects.create(nome='João', cpf='123')
+        cls.consultas = [
+            Consulta.objects.create(
+                agenda=Agenda.objects.create(medico=medico, dia=amanha + timedelta(days=d), horario=time(9, 0)),
+                paciente=paciente, status=situacao,
+            )
+            for medico, d, situacao in ((cls.medicos[0], 0, 'AGENDADA'), (cls.medicos[1], 0, 'PENDENTE'), (cls.medicos[1], 5, 'AGENDADA'))
+        ]
+        ConsultaArquivada.objects.create(id=999, medico=cls.medicos[0], paciente=paciente, dia=amanha - timedelta(days=400), horario=time(8, 0), status='FINALIZADA')
+        cls.admin = User.objects.create_user(username='admin', password='senha12345', is_staff=True)
+        User.objects.create_user(username='joao', password='senha12345')
+
+    def client_de(self, username):
+        client = APIClient()
+        token = client.post('/api/token/', {'username': username, 'password': 'senha12345'}).json()['access']
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        return client
+
+    def test_csv_filtrado_em_streaming(self):
+        resposta = self.client_de('admin').get('/api/exportacao/consultas/', {'medico': self.medicos[1].id, 'status': 'agendada,pendente'})
+        self.assertEqual(resposta.status_code, 200)
+        self.assertTrue(resposta.streaming)
+        linhas = list(csv.reader(StringIO(b''.join(resposta.streaming_content).decode())))
+        self.assertEqual(linhas[0][:5], ['id', 'dia', 'horario', 'status', 'medico_id'])
+        self.assertEqual([linha[0] for linha in linhas[1:]], [str(self.consultas[1].id), str(self.consultas[2].id)])
+        self.assertEqual(linhas[1][5], 'Dr. Bruno, Jr.')
+
+    def test_ndjson_com_arquivadas(self):
+        resposta = self.client_de('admin').get('/api/exportacao/consultas/', {'formato': 'ndjson', 'origem': 'todas', 'status': 'FINALIZADA,AGENDADA'})
+        registros = [json.loads(linha) for linha in b''.join(resposta.streaming_content).decode().splitlines()]
+        self.assertEqual([registro['id'] for registro in registros], [self.consultas[0].id, self.consultas[2].id, 999])
+        self.assertEqual(registros[2]['medico_crm'], '111')
+
+    def test_apenas_administradores(self):
+        self.assertEqual(self.client_de('joao').get('/api/exportacao/consultas/').status_code, 403)
+        self.assertEqual(self.client_de('admin').get('/api/exportacao/consultas/', {'status': 'XYZ'}).status_code, 400)
+
+    def test_comando(self):
+        saida = StringIO()
+        call_command('exportar_consultas', '--formato', 'ndjson', '--origem', 'arquivadas', stdout=saida)
+        self.assertEqual(json.loads(saida.getvalue())['id'], 999)
+
+
+@hash_rapido
+class ImportacaoMedicosTest(TestCase):
+    CSV = (
+        'nome,crm,especialidade,email\n'
+        'Dra. Ana,111,Cardiologista,ana@exemplo.com\n'
+        'Dr. Bruno,222,Pediatra,\n'
+        'Dr. Caio,333,Pediatra,ana@exemplo.com\n'
+        ',444,Pediatra,\n'
+        'Dra. Duda,555,Ortopedista,nao-e-email\n'
+        'Dr. Bruno Filho,222,Pediatra,\n'
+        'Dr. Eli,666,Clínico,ocupado@exemplo.com\n'
+    )
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.ana = Medico.objects.create(nome='Ana', crm='111', especialidade='Clínico', email='antigo@exemplo.com')
+        Medico.objects.create(nome='Outro', crm='999', especialidade='Pediatra', email='ocupado@exemplo.com')
+        User.objects.create_user(username='admin', password='senha12345', is_staff=True)
+
+    def setUp(self):
+        self.admin = APIClient()
+        self.admin.force_authenticate(user=User.objects.get(username='admin'))
+
+    def importar(self, conteudo):
+        arquivo = SimpleUploadedFile('medicos.csv', conteudo.encode('utf-8'), content_type='text/csv')
+        return self.admin.post('/api/medicos/importar/', {'arquivo': arquivo}, format='multipart')
+
+    def test_importa_em_lote_com_relatorio_por_linha(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            resposta = self.importar(self.CSV)
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual((resposta.data['criados'], resposta.data['atualizados'], resposta.data['com_erro']), (1, 1, 5))
+        self.assertEqual([erro['linha'] for erro in resposta.data['erros']], [4, 5, 6, 7, 8])
+        self.assertIn('linha 2', resposta.data['erros'][0]['erros'][0])
+        self.assertIn('CRM 999', resposta.data['erros'][4]['erros'][0])
+
+        self.ana.refresh_from_db()
+        self.assertEqual((self.ana.nome, self.ana.especialidade, self.ana.email), ('Dra. Ana', 'Cardiologista', 'ana@exemplo.com'))
+        self.assertEqual(Medico.objects.get(crm='222').nome, 'Dr. Bruno')
+        self.assertEqual(Medico.objects.count(), 3)
+
+    def test_atualizacao_invalida_caches_do_medico_e_do_usuario(self):
+        user = User.objects.create_user(username='ana', password='senha12345')
+        Medico.objects.filter(pk=self.ana.pk).update(user=user)
+        urls = ['/api/medicos/', f'/api/medicos/{self.ana.id}/', '/api/medicos/buscar/?q=ana']
+        etags = [APIClient().get(url)['ETag'] for url in urls]
+        cache.set(f'autenticacao:usuario:{user.id}', {'is_active': True})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.importar('nome,crm,especialidade\nAna Souza,111,Cardiologista\n')
+        for url, etag in zip(urls, etags):
+            self.assertEqual(APIClient().get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertIsNone(cache.get(f'autenticacao:usuario:{user.id}'))
+
+    def test_linha_sem_email_mantem_o_cadastrado(self):
+        self.importar('nome,crm,especialidade\nAna Souza,111,Cardiologista\n')
+        self.assertEqual(Medico.objects.get(crm='111').email, 'antigo@exemplo.com')
+
+    def test_cabecalho_invalido_e_permissao(self):
+        self.assertEqual(self.importar('nome;crm\nAna;1\n').status_code, 400)
+        anonimo = APIClient().post('/api/medicos/importar/', {}, format='multipart')
+        self.assertEqual(anonimo.status_code, 401)
+
+    def test_comando(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False, encoding='utf-8') as arquivo:
+            arquivo.write(self.CSV)
+        self.addCleanup(os.remove, arquivo.name)
+        saida, erros = StringIO(), StringIO()
+        # Lotes de 2 linhas: repetições são detectadas entre lotes
+        call_command('importar_medicos', arquivo.name, '--lote', '2', stdout=saida, stderr=erros)
+        self.assertIn('1 médicos criados, 1 atualizados, 5 linhas com erro', saida.getvalue())
+        self.assertIn('linha 8 (666)', erros.getvalue())
+
+
+class BuscaMedicosTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.ana = Medico.objects.create(nome='Ana Souza', crm='1', especialidade='Cardiologista')
+        cls.joao = Medico.objects.create(nome='João Anastácio', crm='2', especialidade='Pediatra')
+        cls.carla = Medico.objects.create(nome='Carla Mendes', crm='3', especialidade='Anestesista')
+        cls.souza = Medico.objects.create(nome='Souza Lima', crm='4', especialidade='Cardiologia Pediátrica')
+
+    def buscar(self, q, **params):
+        resposta = APIClient().get('/api/medicos/buscar/', {'q': q, **params})
+        self.assertEqual(resposta.status_code, 200)
+        return [medico['id'] for medico in resposta.data]
+
+    def test_sem_acentos_nem_maiusculas(self):
+        self.assertEqual(self.buscar('JOAO'), [self.joao.id])
+        self.assertEqual(self.buscar('pediatrica'), [self.souza.id])
+
+    def test_varios_termos_e_palavra_no_meio(self):
+        self.assertEqual(self.buscar('ana card'), [self.ana.id])
+        # "souza" começa um nome e está no meio de outro: o prefixo do nome vem primeiro
+        self.assertEqual(self.buscar('souza'), [self.souza.id, self.ana.id])
+        self.assertEqual(self.buscar('card'), [self.ana.id, self.souza.id])
+
+    def test_relevancia_e_limite(self):
+        # Nome que começa pelo termo, depois especialidade, depois palavra no meio do nome
+        self.assertEqual(self.buscar('an'), [self.ana.id, self.carla.id, self.joao.id])
+        self.assertEqual(self.buscar('an', limite=2), [self.ana.id, self.carla.id])
+        self.assertEqual(self.buscar('a'), [])
+        self.assertEqual(APIClient().get('/api/medicos/buscar/', {'q': 'ana', 'limite': 'x'}).status_code, 400)
+
+    def test_campos_de_busca_acompanham_o_nome(self):
+        self.carla.nome = 'Cárla Ávila'
+        self.carla.save(update_fields=['nome'])
+        self.carla.refresh_from_db()
+        self.assertEqual(self.carla.nome_busca, 'carla avila')
+        self.assertEqual(self.buscar('avila'), [self.carla.id])
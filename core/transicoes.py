@@ -0,0 +1,126 @@
+import re
+from collections import defaultdict
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import F
+from django.utils import timezone
+
+from .cache import invalidar_agenda
+from .disponibilidade import atualizar_disponibilidade
+from .estatisticas import registrar
+from .eventos import publicar_consulta, publicar_horario
+from .models import Agenda, Consulta
+
+
+class TransicaoInvalida(Exception):
+    pass
+
+
+class VersaoDesatualizada(Exception):
+    pass
+
+
+ETAG = re.compile(r'^(?:W/)?"(\d+)-(\d+)"$')
+
+
+def etag(consulta):
+    return f'"{consulta.id}-{consulta.versao}"'
+
+
+def versao_do_if_match(valor, consulta_id):
+    """
+    Versão esperada a partir do cabeçalho If-Match (None se ausente ou
+    `*`). Um ETag malformado ou de outra consulta nunca confere.
+    """
+    if not valor or valor.strip() == '*':
+        return None
+    encontrado = ETAG.match(valor.strip())
+    if not encontrado or int(encontrado.group(1)) != int(consulta_id):
+        raise VersaoDesatualizada()
+    return int(encontrado.group(2))
+
+
+def origens(novo_status):
+    """Status a partir dos quais se pode chegar a `novo_status`."""
+    return [atual for atual, destinos in Consulta.TRANSICOES.items() if novo_status in destinos]
+
+
+def reservar_horario(agenda_id):
+    """
+    Reserva o slot com um UPDATE condicional: só uma requisição concorrente
+    consegue passar disponivel de True para False, as outras veem 0
+    linhas. O RETURNING devolve a linha reservada, sem um SELECT antes.
+    Retorna a Agenda, ou None se o horário não existe ou já foi reservado.
+    """
+    quote = connections[DEFAULT_DB_ALIAS].ops.quote_name
+    colunas = ', '.join(quote(campo.column) for campo in Agenda._meta.concrete_fields)
+    sql = (
+        f'UPDATE {quote(Agenda._meta.db_table)} SET {quote("disponivel")} = %s '
+        f'WHERE {quote("id")} = %s AND {quote("disponivel")} = %s RETURNING {colunas}'
+    )
+    return next(iter(Agenda.objects.db_manager(DEFAULT_DB_ALIAS).raw(sql, [False, agenda_id, True])), None)
+
+
+def liberar_horarios(horarios):
+    """
+    Devolve à agenda os slots de consultas canceladas ou rejeitadas, num
+    UPDATE só, e atualiza resumo e cache de cada médico.
+    `horarios` é uma lista de (agenda_id, medico_id, dia, horario).
+    """
+    if not horarios:
+        return
+    Agenda.objects.filter(id__in=[agenda_id for agenda_id, _, _, _ in horarios]).update(disponivel=True)
+    por_medico = defaultdict(list)
+    for agenda_id, medico_id, dia, horario in horarios:
+        por_medico[medico_id].append((dia, horario))
+        publicar_horario('horario_liberado', medico_id, agenda_id, dia, horario)
+    for medico_id, dias in por_medico.items():
+        atualizar_disponibilidade(medico_id, dias)
+        invalidar_agenda(medico_id)
+
+
+def transicionar(consultas, consulta_id, novo_status, motivo=None, versao=None):
+    """
+    Aplica a transição com um UPDATE condicional: só pega a linha se ela
+    pertence a `consultas` (o escopo do usuário), se o status atual
+    permite ir para `novo_status` e, com `versao`, se ninguém a alterou
+    desde então. Não há trava de linha fora desta transação curta.
+
+    Deve ser chamada dentro de transaction.atomic, junto com o
+    enfileiramento da notificação. Retorna a consulta atualizada e levanta
+    Consulta.DoesNotExist, TransicaoInvalida ou VersaoDesatualizada quando
+    nada foi alterado.
+    """
+    alvo = consultas.filter(id=consulta_id, status__in=origens(novo_status))
+    if versao is not None:
+        alvo = alvo.filter(versao=versao)
+
+    campos = {'status': novo_status, 'versao': F('versao') + 1, 'atualizada_em': timezone.now()}
+    if motivo:
+        campos['motivo_cancelamento'] = motivo
+    # Um UPDATE por status de origem (no máximo dois), para saber de qual
+    # status a consulta saiu e acertar os contadores do painel
+    alterou, anterior = 0, None
+    for origem in origens(novo_status):
+        alterou = alvo.filter(status=origem).update(**campos)
+        if alterou:
+            anterior = origem
+            break
+
+    consulta = consultas.select_related('agenda', 'paciente').get(id=consulta_id)
+    if not alterou:
+        if versao is not None and consulta.versao != versao:
+            raise VersaoDesatualizada()
+        raise TransicaoInvalida(f'Não é possível mudar uma consulta {consulta.status} para {novo_status}.')
+
+    if consulta.agenda:
+        registrar(consulta.agenda.medico_id, consulta.agenda.dia, anterior, novo_status)
+    publicar_consulta(
+        'status_alterado', consulta.id, consulta.agenda.medico_id if consulta.agenda else None,
+        consulta.paciente_id, consulta.status, consulta.versao,
+    )
+    if novo_status in Consulta.STATUS_QUE_LIBERAM and consulta.agenda:
+        agenda = consulta.agenda
+        liberar_horarios([(agenda.id, agenda.medico_id, agenda.dia, agenda.horario)])
+        agenda.disponivel = True
+    return consulta
@@ -1,36 +1,74 @@
+import csv
+import io
+import json
+import logging
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.views import View
 from rest_framework import viewsets, generics
-from .models import Medico, Consulta, Agenda, Paciente
-from .serializers import MedicoSerializer, ConsultaSerializer, AgendaSerializer, PacienteSerializer, UserRegistrationSerializer, MedicoRegistrationSerializer
+from .models import Medico, Consulta, ConsultaArquivada, Agenda, Paciente, ResumoDisponibilidade
+from .serializers import MedicoSerializer, AgendamentoSerializer, ConsultaSerializer, ConsultaArquivadaSerializer, AtualizacaoStatusLoteSerializer, AgendaSerializer, PacienteSerializer, UserRegistrationSerializer, MedicoRegistrationSerializer, AgendaRecorrenteSerializer
+from .pagination import MedicoPagination, PacientePagination, AgendaPagination, ConsultaPagination, HistoricoPagination
+from .agendas import criar_agendas_recorrentes
+from .disponibilidade import atualizar_disponibilidade
+from .authentication import AdminConferido, PerfilJWTAuthentication, perfil_do_usuario
+from .notificacoes import enfileirar, enfileirar_lote
+from .busca import buscar_medicos
+from .calendario import gerar_ics, gerar_token, validadores
+from .importacao import ArquivoInvalido, importar_medicos
+from .exportacao import FORMATOS, ORIGENS, exportar
+from .estatisticas import painel, registrar_mudancas
+from .eventos import canal_consultas_medico, canal_consultas_paciente, canal_medico, escutar, publicar_consulta, publicar_horario
+from .transicoes import TransicaoInvalida, VersaoDesatualizada, etag, liberar_horarios, origens, reservar_horario, transicionar, versao_do_if_match
+from .fotos import FotoInvalida, salvar_foto, remover_foto_se_orfa
+from .cache import RespostaVersionadaMixin, VERSAO_AGENDAS, VERSAO_GLOBAL, chave_versao_agenda, chave_versao_medico, invalidar_agenda
 from rest_framework.decorators import action
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import InvalidToken
 from rest_framework.response import Response
 from rest_framework import status
-from datetime import datetime
+from datetime import date, timedelta
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.parsers import MultiPartParser, FormParser
-from django.db import transaction
+from django.db import DatabaseError, IntegrityError, transaction
+from django.db.models import F, Min, OuterRef, Q, Subquery, Sum
+from django.utils import timezone
+from django.core.exceptions import ValidationError
 from django.contrib.auth.models import User
+from django.conf import settings
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
 
 
 
 from rest_framework.views import APIView
 
+
+logger = logging.getLogger(__name__)
+
+
 class MeView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
         user = request.user
+        perfil = perfil_do_usuario(user)
         data = {
             'id': user.id,
             'username': user.username,
             'email': user.email,
-            'type': 'medico' if hasattr(user, 'medico') else 'paciente'
+            'type': perfil.tipo
         }
-        if hasattr(user, 'medico'):
-            data['medico_id'] = user.medico.id
-            data['crm'] = user.medico.crm
-        elif hasattr(user, 'paciente'):
-             data['paciente_id'] = user.paciente.id
+        if perfil.medico_id:
+            data['medico_id'] = perfil.medico_id
+            data['crm'] = perfil.crm
+        elif perfil.paciente_id:
+             data['paciente_id'] = perfil.paciente_id
         
         return Response(data)
 
@@ -48,188 +86,707 @@ class MedicoRegisterView(generics.CreateAPIView):
 
 
 
-class MedicoViewSet(viewsets.ModelViewSet):
+def _versao_por_medico(chave, medico_id, padrao):
+    try:
+        return [chave(int(medico_id))]
+    except (TypeError, ValueError):
+        return [padrao]
+
+
+class MedicoViewSet(RespostaVersionadaMixin, viewsets.ModelViewSet):
     queryset = Medico.objects.all()
     serializer_class = MedicoSerializer
     permission_classes = [AllowAny]
+    pagination_class = MedicoPagination
+
+    LIMITE_BUSCA = 10
+    LIMITE_BUSCA_MAXIMO = 50
+
+    def chaves_de_versao(self):
+        if self.action == 'retrieve':
+            return _versao_por_medico(chave_versao_medico, self.kwargs.get('pk'), VERSAO_GLOBAL)
+        return [VERSAO_GLOBAL]
+
+    @action(detail=False, methods=['get'])
+    def buscar(self, request):
+        """
+        Autocomplete por nome e especialidade, sem diferenciar acentos e
+        maiúsculas: ?q=ana card&limite=10 (ver core/busca.py). Resultados
+        em cache como as listagens.
+        """
+        try:
+            limite = min(max(int(request.query_params.get('limite', self.LIMITE_BUSCA)), 1), self.LIMITE_BUSCA_MAXIMO)
+        except ValueError:
+            return Response({'message': 'limite inválido.'}, status=status.HTTP_400_BAD_REQUEST)
+        return self.resposta_em_cache(request, lambda: Response(buscar_medicos(request.query_params.get('q', ''), limite)))
+
+    @action(detail=False, methods=['post'], permission_classes=[AdminConferido], parser_classes=[MultiPartParser])
+    def importar(self, request):
+        """
+        Cadastro em massa a partir de um CSV (campo `arquivo`, colunas nome,
+        crm, especialidade e email), lido em streaming e gravado em lotes.
+        Responde com o relatório por linha (ver core/importacao.py).
+        """
+        arquivo = request.FILES.get('arquivo')
+        if not arquivo:
+            return Response({'message': 'Envie o CSV no campo arquivo.'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            relatorio = importar_medicos(io.TextIOWrapper(arquivo.file, encoding='utf-8-sig', newline=''))
+        except (ArquivoInvalido, UnicodeDecodeError, csv.Error) as e:
+            return Response({'message': f'Arquivo inválido: {e}'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(relatorio)
 
 
 class PacienteViewSet(viewsets.ModelViewSet):
     queryset = Paciente.objects.all()
     serializer_class = PacienteSerializer
+    pagination_class = PacientePagination
 
 
-class AgendaViewSet(viewsets.ModelViewSet):
+class AgendaViewSet(RespostaVersionadaMixin, viewsets.ModelViewSet):
 
     queryset = Agenda.objects.filter(disponivel=True)
     serializer_class = AgendaSerializer
     permission_classes = [AllowAny]
+    pagination_class = AgendaPagination
 
     
+    def corte(self):
+        # Início do minuto: entra na chave do cache e na ETag, então uma
+        # resposta guardada não mostra um horário que já começou por mais
+        # de um minuto, por maior que seja o timeout
+        if not hasattr(self, '_corte'):
+            self._corte = timezone.localtime().replace(second=0, microsecond=0)
+        return self._corte
+
+    def partes_da_chave(self):
+        return [self.corte().isoformat()]
+
     def get_queryset(self):
-        queryset = Agenda.objects.filter(disponivel=True)
+        # Só horários futuros: os vencidos ficam fora da varredura (e são
+        # apagados pelo comando arquivar)
+        agora = self.corte()
+        queryset = Agenda.objects.filter(disponivel=True).filter(
+            Q(dia__gt=agora.date()) | Q(dia=agora.date(), horario__gte=agora.time())
+        )
         medico_id = self.request.query_params.get('medico')
         if medico_id:
             queryset = queryset.filter(medico_id=medico_id)
         
         return queryset
 
+    def chaves_de_versao(self):
+        medico_id = self.request.query_params.get('medico')
+        if self.action == 'list' and medico_id:
+            return _versao_por_medico(chave_versao_agenda, medico_id, VERSAO_AGENDAS)
+        return [VERSAO_AGENDAS]
+
+    @action(detail=False, methods=['post'], permission_classes=[IsAuthenticated])
+    def gerar(self, request):
+        """
+        Cria em lote os horários de um modelo recorrente para o médico logado
+        """
+        medico_id = perfil_do_usuario(request.user).medico_id
+        if not medico_id:
+            return Response(
+                {'message': 'Apenas médicos podem gerar horários.'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        serializer = AgendaRecorrenteSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        try:
+            criados, ignorados = criar_agendas_recorrentes(medico_id, **serializer.validated_data)
+        except ValidationError as e:
+            return Response({'message': e.messages[0]}, status=status.HTTP_400_BAD_REQUEST)
+        except IntegrityError as e:
+            return Response({'message': str(e)}, status=status.HTTP_409_CONFLICT)
+
+        return Response({'criados': criados, 'ignorados': ignorados}, status=status.HTTP_201_CREATED)
+
+
+class DisponibilidadeView(APIView):
+    """
+    Busca de médicos com horários livres, lida só do resumo por hora
+    (ResumoDisponibilidade). Filtros: especialidade, data_inicio,
+    data_fim, hora_inicio e hora_fim (horas cheias, fim exclusivo). As
+    horas de hoje que já passaram ficam de fora.
+    """
+    permission_classes = [AllowAny]
+
+    PERIODO_PADRAO = 30
+    PERIODO_MAXIMO = 90
+    LIMITE_PADRAO = 50
+    LIMITE_MAXIMO = 200
+
+    def get(self, request):
+        params = request.query_params
+        agora = timezone.localtime()
+        hoje = agora.date()
+        try:
+            data_inicio = max(date.fromisoformat(params['data_inicio']), hoje) if params.get('data_inicio') else hoje
+            data_fim = date.fromisoformat(params['data_fim']) if params.get('data_fim') else data_inicio + timedelta(days=self.PERIODO_PADRAO)
+            hora_inicio = int(params.get('hora_inicio', 0))
+            hora_fim = int(params.get('hora_fim', 24))
+            limite = min(int(params.get('limite', self.LIMITE_PADRAO)), self.LIMITE_MAXIMO)
+        except ValueError:
+            return Response({'message': 'Parâmetros de busca inválidos.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        data_fim = min(data_fim, data_inicio + timedelta(days=self.PERIODO_MAXIMO))
+
+        resumos = ResumoDisponibilidade.objects.filter(
+            livres__gt=0,
+            dia__range=(data_inicio, data_fim),
+            hora__gte=hora_inicio,
+            hora__lt=hora_fim,
+        ).exclude(dia=hoje, hora__lt=agora.hour)  # horas de hoje que já passaram
+        especialidade = params.get('especialidade')
+        if especialidade:
+            resumos = resumos.filter(medico__especialidade__iexact=especialidade)
+
+        # Agrupamento, ordenação e limite no banco: só os `limite` médicos
+        # com o horário livre mais cedo saem de ResumoDisponibilidade
+        primeiro = resumos.filter(medico_id=OuterRef('medico_id')).order_by('dia', 'hora')
+        selecionados = list(
+            resumos.values('medico_id')
+            .annotate(
+                primeiro_dia=Min('dia'),
+                primeiro_horario=Subquery(primeiro.values('primeiro_horario')[:1]),
+                primeira_agenda=Subquery(primeiro.values('primeira_agenda_id')[:1]),
+            )
+            .order_by('primeiro_dia', 'primeiro_horario', 'medico_id')[:limite]
+        )
+        medico_ids = [linha['medico_id'] for linha in selecionados]
+
+        dias = {medico_id: [] for medico_id in medico_ids}
+        por_dia = (
+            resumos.filter(medico_id__in=medico_ids)
+            .values('medico_id', 'dia')
+            .annotate(total=Sum('livres'))
+            .order_by('medico_id', 'dia')
+        )
+        for linha in por_dia:
+            dias[linha['medico_id']].append({'dia': linha['dia'], 'livres': linha['total']})
+        medicos = Medico.objects.in_bulk(medico_ids)
+
+        return Response([
+            {
+                'medico': MedicoSerializer(medicos[linha['medico_id']], context={'request': request}).data,
+                'primeiro_horario': {
+                    'agenda': linha['primeira_agenda'],
+                    'dia': linha['primeiro_dia'],
+                    'horario': linha['primeiro_horario'],
+                },
+                'dias': dias[linha['medico_id']],
+            }
+            for linha in selecionados
+        ])
+
 
 class ConsultaViewSet(viewsets.ModelViewSet):
     queryset = Consulta.objects.all()
     serializer_class = ConsultaSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = ConsultaPagination
     
     def get_queryset(self):
         """
         Retorna consultas do paciente logado OU do médico logado
         """
-        user = self.request.user
+        perfil = perfil_do_usuario(self.request.user)
         
         # Check if user is a doctor
-        if hasattr(user, 'medico'):
-            return Consulta.objects.filter(agenda__medico=user.medico).order_by('agenda__dia', 'agenda__horario').select_related('agenda', 'paciente')
-
+        if perfil.medico_id:
+            return Consulta.objects.filter(agenda__medico_id=perfil.medico_id).order_by('agenda__dia', 'agenda__horario').select_related('agenda', 'paciente')
+
+        # Return only consultas for this paciente. The profile is provisioned
+        # at registration, so this path never writes.
+        consultas = Consulta.objects.select_related('agenda', 'paciente')
+        if perfil.paciente_id:
+            return consultas.filter(paciente_id=perfil.paciente_id)
+        return consultas.filter(paciente__user_id=self.request.user.id)
+
+    def get_paciente_id(self, perfil):
+        if perfil.paciente_id:
+            return perfil.paciente_id
+        return Paciente.objects.filter(user_id=self.request.user.id).values_list('id', flat=True).first()
+
+    def responder_com_etag(self, consulta, response=None):
+        response = response or Response(self.get_serializer(consulta).data)
+        response['ETag'] = etag(consulta)
+        return response
+
+    def transicionar(self, request, pk, novo_status, motivo, evento, dados):
+        """
+        Aplica a transição (ver core/transicoes.py) e grava a notificação na
+        mesma transação. Devolve (consulta, None) ou (None, resposta de erro).
+        """
         try:
-            # Get or create paciente for the authenticated user
-            paciente, created = Paciente.objects.get_or_create(
-                user=self.request.user,
-                defaults={
-                    'nome': self.request.user.username,
-                    'cpf': f'temp_{self.request.user.id}',
-                    'email': self.request.user.email
-                }
+            versao = versao_do_if_match(request.headers.get('If-Match'), pk)
+            with transaction.atomic():
+                consulta = transicionar(self.get_queryset(), pk, novo_status, motivo, versao)
+                enfileirar(evento, consulta.id, **dados)
+        except (Consulta.DoesNotExist, ValueError):
+            return None, Response({'message': 'Consulta não encontrada.'}, status=status.HTTP_404_NOT_FOUND)
+        except VersaoDesatualizada:
+            return None, Response(
+                {'message': 'A consulta foi alterada por outra pessoa. Recarregue e tente novamente.'},
+                status=status.HTTP_412_PRECONDITION_FAILED
             )
-            # Return only consultas for this paciente
-            return Consulta.objects.filter(paciente=paciente).select_related('agenda', 'agenda__medico')
-        except Exception as e:
-            print(f"Error in get_queryset: {str(e)}")
-            return Consulta.objects.none()
+        except TransicaoInvalida as e:
+            return None, Response({'message': str(e)}, status=status.HTTP_409_CONFLICT)
+        return consulta, None
 
+    def retrieve(self, request, *args, **kwargs):
+        return self.responder_com_etag(self.get_object())
 
-    @action(detail=True, methods=['post'])
-    def cancelar(self, request, pk=None):
+    def update(self, request, *args, **kwargs):
+        """
+        PUT/PATCH com controle otimista: o UPDATE só grava os campos que
+        mudaram e só se a versão ainda for a lida (ou a do If-Match).
+        Status muda apenas pelas ações de transição.
+        """
+        partial = kwargs.pop('partial', False)
         consulta = self.get_object()
-        data_hora_consulta = datetime.combine(consulta.agenda.dia, consulta.agenda.horario)
-        agora = datetime.now()
-
-        diferenca = data_hora_consulta - agora
+        try:
+            versao = versao_do_if_match(request.headers.get('If-Match'), consulta.id)
+        except VersaoDesatualizada:
+            versao = -1
+        if versao is None:
+            versao = consulta.versao
+
+        serializer = self.get_serializer(consulta, data=request.data, partial=partial)
+        serializer.is_valid(raise_exception=True)
+        campos = {campo: valor for campo, valor in serializer.validated_data.items() if getattr(consulta, campo) != valor}
+        if 'agenda' in campos or 'paciente' in campos:
+            return Response(
+                {'message': 'A agenda e o paciente de uma consulta não podem ser alterados.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
 
-        # if diferenca.total_seconds() < 3600:
-        #     return Response(
-        #         {'message': 'Não é possível cancelar uma consulta com menos de 1 hora de antecedência.'},
-        #         status=status.HTTP_400_BAD_REQUEST
-        #     )
-        
-        consulta.motivo_cancelamento = request.data.get('motivo', request.data.get('motivo_cancelamento'))
-        consulta.status = 'CANCELADA'
-        consulta.save()
+        if versao != consulta.versao or (
+            campos and not Consulta.objects.filter(id=consulta.id, versao=versao).update(**campos, versao=F('versao') + 1, atualizada_em=timezone.now())
+        ):
+            return Response(
+                {'message': 'A consulta foi alterada por outra pessoa. Recarregue e tente novamente.'},
+                status=status.HTTP_412_PRECONDITION_FAILED
+            )
 
-        # Re-open agenda if needed? Or keep it closed? Usually cancelation frees up agenda if sufficiently in advance.
-        # For now, let's keep it simple as per previous logic (which didn't re-open). 
-        # But logically, if canceled, agenda might become available. 
-        # User constraint: "cancelamentos e rejeições exigem motivos". I won't enforce re-open logic changes unless asked.
+        if campos:
+            for campo, valor in campos.items():
+                setattr(consulta, campo, valor)
+            consulta.versao += 1
+        return self.responder_com_etag(consulta)
 
-        return Response(
+    @action(detail=True, methods=['post'])
+    def cancelar(self, request, pk=None):
+        motivo = request.data.get('motivo', request.data.get('motivo_cancelamento'))
+        consulta, erro = self.transicionar(request, pk, 'CANCELADA', motivo, 'CONSULTA_CANCELADA', {'motivo': motivo})
+        if erro:
+            return erro
+        return self.responder_com_etag(consulta, Response(
             {'message': 'Consulta cancelada com sucesso.'},
             status=status.HTTP_200_OK
-        )
+        ))
 
     @action(detail=True, methods=['patch'])
     def atualizar_status(self, request, pk=None):
-        consulta = self.get_object()
         novo_status = request.data.get('status')
         motivo = request.data.get('motivo') or request.data.get('motivo_cancelamento')
-        
-        if novo_status not in ['PENDENTE', 'CONFIRMADA', 'REJEITADA', 'FINALIZADA', 'CANCELADA', 'AGENDADA']:
-             return Response(
+
+        if novo_status not in Consulta.TRANSICOES:
+            return Response(
                 {'message': 'Status inválido.'},
                 status=status.HTTP_400_BAD_REQUEST
             )
-            
+
         if novo_status in ['REJEITADA', 'CANCELADA'] and not motivo:
             return Response(
                 {'message': 'É obrigatório informar o motivo para cancelar ou rejeitar.'},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        if motivo:
-            consulta.motivo_cancelamento = motivo
+        # O paciente só pode cancelar; as demais transições são do médico
+        if novo_status != 'CANCELADA' and not perfil_do_usuario(request.user).medico_id:
+            return Response(
+                {'message': 'Apenas o médico pode alterar o status para ' + novo_status + '.'},
+                status=status.HTTP_403_FORBIDDEN
+            )
 
-        consulta.status = novo_status
-        consulta.save()
-        
-        return Response(self.get_serializer(consulta).data)
+        consulta, erro = self.transicionar(
+            request, pk, novo_status, motivo, 'STATUS_ALTERADO', {'status': novo_status, 'motivo': motivo}
+        )
+        return erro or self.responder_com_etag(consulta)
+
+    @action(detail=False, methods=['post'])
+    def atualizar_status_lote(self, request):
+        """
+        Muda o status de várias consultas do médico logado de uma vez: uma
+        leitura para conferir quais são dele e se a transição é permitida,
+        um UPDATE e as notificações em lote, tudo numa transação. Devolve o
+        resultado de cada id.
+        """
+        perfil = perfil_do_usuario(request.user)
+        if not perfil.medico_id:
+            return Response(
+                {'message': 'Apenas médicos podem atualizar consultas em lote.'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        serializer = AtualizacaoStatusLoteSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+        novo_status = serializer.validated_data['status']
+        motivo = serializer.validated_data.get('motivo') or None
+        permitidos = origens(novo_status)
+
+        with transaction.atomic():
+            atuais = {
+                linha[0]: linha[1:]
+                for linha in Consulta.objects.select_for_update(of=('self',))
+                .filter(id__in=ids, agenda__medico_id=perfil.medico_id)
+                .values_list('id', 'status', 'agenda_id', 'agenda__dia', 'agenda__horario', 'paciente_id', 'versao')
+            }
+            alterar = [consulta_id for consulta_id in ids if consulta_id in atuais and atuais[consulta_id][0] in permitidos]
+
+            if alterar:
+                campos = {'status': novo_status, 'versao': F('versao') + 1, 'atualizada_em': timezone.now()}
+                if motivo:
+                    campos['motivo_cancelamento'] = motivo
+                Consulta.objects.filter(id__in=alterar, status__in=permitidos).update(**campos)
+                enfileirar_lote('STATUS_ALTERADO', alterar, status=novo_status, motivo=motivo)
+                registrar_mudancas([
+                    (perfil.medico_id, atuais[consulta_id][2], atuais[consulta_id][0], novo_status)
+                    for consulta_id in alterar
+                ])
+                for consulta_id in alterar:
+                    publicar_consulta(
+                        'status_alterado', consulta_id, perfil.medico_id, atuais[consulta_id][4],
+                        novo_status, atuais[consulta_id][5] + 1,
+                    )
+                if novo_status in Consulta.STATUS_QUE_LIBERAM:
+                    liberar_horarios([
+                        (atuais[consulta_id][1], perfil.medico_id, atuais[consulta_id][2], atuais[consulta_id][3])
+                        for consulta_id in alterar
+                    ])
+
+        def resultado(consulta_id):
+            if consulta_id not in atuais:
+                return 'nao_encontrada'
+            if atuais[consulta_id][0] == novo_status:
+                return 'inalterada'
+            return 'atualizada' if consulta_id in alterar else 'transicao_invalida'
+
+        return Response({
+            'status': novo_status,
+            'atualizadas': len(alterar),
+            'resultados': [{'id': consulta_id, 'resultado': resultado(consulta_id)} for consulta_id in ids],
+        })
 
     def create(self, request, *args, **kwargs):
+        logger.debug('Criando consulta: %s', request.data)
+
+        paciente_id = self.get_paciente_id(perfil_do_usuario(request.user))
+        if not paciente_id:
+            return Response(
+                {'message': 'Perfil de paciente não encontrado.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        entrada = AgendamentoSerializer(data=request.data)
+
+        # Só a validação, a reserva e o INSERT viram 400: eventos e cache
+        # rodam depois do commit (robust) e não transformam um agendamento
+        # gravado em erro. A transação fica só com a reserva, o INSERT e os
+        # contadores (resumo, painel e outbox).
         try:
-            
+            if not entrada.is_valid():
+                logger.warning('Erro ao criar consulta: %s', entrada.errors)
+                return Response({'message': str(entrada.errors)}, status=status.HTTP_400_BAD_REQUEST)
+
             with transaction.atomic():
-                
-                # Log the incoming request data for debugging
-                print(f"Request data: {request.data}")
-                
-                # Get or create paciente for the authenticated user
-                paciente, created = Paciente.objects.get_or_create(
-                    user=request.user,
-                    defaults={
-                        'nome': request.user.username,
-                        'cpf': f'temp_{request.user.id}',  # Temporary CPF until user updates profile
-                        'email': request.user.email
-                    }
-                )
-                
-                # Add paciente to request data
-                data = request.data.copy()
-                data['paciente'] = paciente.id
-                
-                serializer = self.get_serializer(data=data)
-                serializer.is_valid(raise_exception=True)
-                
-                agenda_id = serializer.validated_data['agenda'].id
-                agenda = Agenda.objects.get(id=agenda_id)
-
-                
-                if not agenda.disponivel:
+                agenda = reservar_horario(entrada.validated_data['agenda'])
+                if agenda is None:
                     return Response(
                         {'message': 'Esse horário já foi agendado por outra pessoa!'},
                         status=status.HTTP_400_BAD_REQUEST
                     )
 
-                
-                
-                agenda.disponivel = False
-                agenda.save()
-
-                
-                self.perform_create(serializer)
-                headers = self.get_success_headers(serializer.data)
-                return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+                atualizar_disponibilidade(agenda.medico_id, [(agenda.dia, agenda.horario)])
+                invalidar_agenda(agenda.medico_id)
 
-        except Exception as e:
-            print(f"Error creating consulta: {str(e)}")  # Log the error
+                consulta = Consulta.objects.create(
+                    agenda=agenda, paciente_id=paciente_id, observacoes=entrada.validated_data.get('observacoes'),
+                )
+                publicar_horario('horario_ocupado', agenda.medico_id, agenda.id, agenda.dia, agenda.horario)
+                publicar_consulta('consulta_criada', consulta.id, agenda.medico_id, paciente_id, 'PENDENTE', 1)
+        except DatabaseError as e:
+            logger.warning('Erro ao criar consulta: %s', e)
             return Response({'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
+        # paciente_detalhes é lido aqui, já fora da transação
+        data = self.get_serializer(consulta).data
+        return Response(data, status=status.HTTP_201_CREATED, headers=self.get_success_headers(data))
+
+
+class HistoricoViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Consultas encerradas já arquivadas (ver core/arquivamento.py), do
+    paciente ou do médico logado.
+    """
+    serializer_class = ConsultaArquivadaSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = HistoricoPagination
+
+    def get_queryset(self):
+        perfil = perfil_do_usuario(self.request.user)
+        consultas = ConsultaArquivada.objects.select_related('medico', 'paciente')
+        if perfil.medico_id:
+            return consultas.filter(medico_id=perfil.medico_id)
+        if perfil.paciente_id:
+            return consultas.filter(paciente_id=perfil.paciente_id)
+        return consultas.filter(paciente__user_id=self.request.user.id)
+
+
+class EstatisticasView(APIView):
+    """
+    Painel do médico logado: consultas por status por dia e por semana e
+    ocupação dos horários, lidos dos contadores de EstatisticaDiaria (ver
+    core/estatisticas.py). Período por data_inicio/data_fim; padrão de 30
+    dias atrás a 30 dias à frente.
+    """
+    permission_classes = [IsAuthenticated]
+
+    PERIODO_PADRAO = 30
+    PERIODO_MAXIMO = 366
+
+    def get(self, request):
+        medico_id = perfil_do_usuario(request.user).medico_id
+        if not medico_id:
+            return Response({'message': 'Apenas médicos têm painel de estatísticas.'}, status=status.HTTP_403_FORBIDDEN)
+
+        params = request.query_params
+        hoje = timezone.localdate()
+        try:
+            data_inicio = date.fromisoformat(params['data_inicio']) if params.get('data_inicio') else hoje - timedelta(days=self.PERIODO_PADRAO)
+            data_fim = date.fromisoformat(params['data_fim']) if params.get('data_fim') else hoje + timedelta(days=self.PERIODO_PADRAO)
+        except ValueError:
+            return Response({'message': 'Datas inválidas.'}, status=status.HTTP_400_BAD_REQUEST)
+        if data_fim < data_inicio:
+            return Response({'message': 'data_fim antes de data_inicio.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        data_fim = min(data_fim, data_inicio + timedelta(days=self.PERIODO_MAXIMO))
+        return Response(painel(medico_id, data_inicio, data_fim))
+
+
+class ExportacaoView(APIView):
+    """
+    Exporta consultas em CSV ou NDJSON para relatórios (só administradores),
+    em streaming e sem paginação. Filtros: data_inicio, data_fim, medico,
+    status (separados por vírgula), origem (ativas, arquivadas ou todas) e
+    formato. Mesmo conteúdo do comando exportar_consultas.
+    """
+    permission_classes = [AdminConferido]
+
+    TIPOS = {'csv': 'text/csv; charset=utf-8', 'ndjson': 'application/x-ndjson'}
+
+    def get(self, request):
+        params = request.query_params
+        formato = params.get('formato', 'csv')
+        origem = params.get('origem', 'ativas')
+        status_pedidos = [valor for valor in params.get('status', '').upper().split(',') if valor]
+        validos = {codigo for codigo, _ in Consulta.STATUS_CHOICES}
+        try:
+            filtros = {
+                'origem': origem,
+                'data_inicio': date.fromisoformat(params['data_inicio']) if params.get('data_inicio') else None,
+                'data_fim': date.fromisoformat(params['data_fim']) if params.get('data_fim') else None,
+                'medico_id': int(params['medico']) if params.get('medico') else None,
+                'status': status_pedidos,
+            }
+        except ValueError:
+            return Response({'message': 'Parâmetros de exportação inválidos.'}, status=status.HTTP_400_BAD_REQUEST)
+        if formato not in FORMATOS or origem not in ORIGENS or not set(status_pedidos) <= validos:
+            return Response({'message': 'Parâmetros de exportação inválidos.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        response = StreamingHttpResponse(exportar(formato, **filtros), content_type=self.TIPOS[formato])
+        response['Content-Disposition'] = f'attachment; filename="consultas.{formato}"'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
+class CalendarioTokenView(APIView):
+    """
+    URL secreta do feed iCalendar do médico logado. GET devolve a atual
+    (null se nunca gerada); POST gera uma nova, invalidando a anterior.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        medico_id = perfil_do_usuario(request.user).medico_id
+        if not medico_id:
+            return Response({'message': 'Apenas médicos têm feed de calendário.'}, status=status.HTTP_403_FORBIDDEN)
+        token = Medico.objects.filter(pk=medico_id).values_list('token_calendario', flat=True).first()
+        return Response({'url': self.url(request, token)})
+
+    def post(self, request):
+        medico_id = perfil_do_usuario(request.user).medico_id
+        if not medico_id:
+            return Response({'message': 'Apenas médicos têm feed de calendário.'}, status=status.HTTP_403_FORBIDDEN)
+        token = gerar_token()
+        Medico.objects.filter(pk=medico_id).update(token_calendario=token)
+        return Response({'url': self.url(request, token)}, status=status.HTTP_201_CREATED)
+
+    def url(self, request, token):
+        return request.build_absolute_uri(reverse('calendario', args=[token])) if token else None
+
+
+class CalendarioView(View):
+    """
+    Feed iCalendar (.ics) das consultas confirmadas de um médico, para
+    assinar no Google Agenda, Outlook etc. O token da URL é a credencial.
+    Clientes que repetem o GET com If-None-Match/If-Modified-Since recebem
+    304 depois de uma consulta agregada só; senão o corpo sai em streaming.
+    """
+
+    def get(self, request, token):
+        medico = Medico.objects.filter(token_calendario=token).only('id', 'nome').first()
+        if medico is None:
+            raise Http404
+
+        etag, ultima = validadores(medico)
+        ultima_http = ultima.replace(microsecond=0) if ultima else None
+        response = get_conditional_response(request, etag=etag, last_modified=ultima_http and ultima_http.timestamp())
+        if response is None:
+            response = StreamingHttpResponse(gerar_ics(medico), content_type='text/calendar; charset=utf-8')
+            response['Content-Disposition'] = 'inline; filename="agenda.ics"'
+        response['ETag'] = etag
+        if ultima_http:
+            response['Last-Modified'] = http_date(ultima_http.timestamp())
+        # Tem nome de paciente: só o cliente do médico pode guardar
+        response['Cache-Control'] = 'private, no-cache'
+        return response
 
-        
 
 class UpdateProfilePhotoView(APIView):
     permission_classes = [IsAuthenticated]
     parser_classes = [MultiPartParser, FormParser]
 
     def patch(self, request):
-        user = request.user
+        # Uploads always go to a temporary file on disk, never to memory
+        request.upload_handlers = [TemporaryFileUploadHandler(request._request)]
+
+        perfil = perfil_do_usuario(request.user)
         foto = request.FILES.get('foto') 
         if not foto:
             return Response({'message': 'Nenhuma foto foi enviada.'}, status=status.HTTP_400_BAD_REQUEST)
+        if foto.size > settings.FOTO_TAMANHO_MAXIMO:
+            return Response({'message': 'A foto excede o tamanho máximo permitido.'}, status=status.HTTP_400_BAD_REQUEST)
         
-        if hasattr(user,'medico'):
-            user.medico.foto = foto
-            user.medico.save()
-        elif hasattr(user,'paciente'):
-            user.paciente.foto = foto
-            user.paciente.save()
+        if perfil.medico_id:
+            dono = Medico.objects.get(pk=perfil.medico_id)
+        elif perfil.paciente_id:
+            dono = Paciente.objects.get(pk=perfil.paciente_id)
         else:
             return Response({'message': 'Perfil não encontrado.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            nome, foto_hash = salvar_foto(foto)
+        except FotoInvalida as e:
+            return Response({'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        anterior = (dono.foto.name if dono.foto else None, dono.foto_hash)
+        if nome != anterior[0]:
+            # Variants are generated off-request by `manage.py processar_fotos`
+            dono.foto.name = nome
+            dono.foto_hash = foto_hash
+            dono.foto_processada = False
+            with transaction.atomic():
+                dono.save(update_fields=['foto', 'foto_hash', 'foto_processada'])
+                transaction.on_commit(lambda: remover_foto_se_orfa(*anterior))
         
         return Response({'message': 'Foto atualizada com sucesso.'}, status=status.HTTP_200_OK)
+
+
+class EventosView(View):
+    """
+    Stream de Server-Sent Events com as mudanças de disponibilidade, no
+    lugar de o frontend ficar consultando /api/agendas/. Canais públicos:
+    `?medico=1,2` (horários ocupados, liberados e grade alterada). Com
+    token (cabeçalho Authorization ou `?token=`, já que o EventSource do
+    navegador não manda cabeçalhos), recebe também as mudanças das
+    próprias consultas.
+
+    A view é assíncrona: cada conexão aberta é uma corrotina esperando na
+    fila, não uma thread. Precisa de um servidor ASGI (ver proj1/asgi.py):
+    em WSGI (runserver, gunicorn sync) o stream prenderia um worker para
+    sempre, então a view responde 501.
+    """
+
+    MAX_MEDICOS = 50
+    RETRY_MS = 3000
+
+    async def get(self, request):
+        if not isinstance(request, ASGIRequest):
+            return JsonResponse(
+                {'message': 'O stream de eventos exige um servidor ASGI (uvicorn, daphne).'},
+                status=status.HTTP_501_NOT_IMPLEMENTED,
+            )
+        try:
+            medico_ids = {
+                int(valor)
+                for parametro in request.GET.getlist('medico')
+                for valor in parametro.split(',') if valor.strip()
+            }
+        except ValueError:
+            return JsonResponse({'message': 'Parâmetro medico inválido.'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(medico_ids) > self.MAX_MEDICOS:
+            return JsonResponse({'message': f'No máximo {self.MAX_MEDICOS} médicos por conexão.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        canais = [canal_medico(medico_id) for medico_id in sorted(medico_ids)]
+        bruto = self.token_bruto(request)
+        if bruto:
+            try:
+                perfil = await sync_to_async(self.perfil_do_token)(bruto)
+            except (InvalidToken, AuthenticationFailed):
+                return JsonResponse({'message': 'Token inválido ou expirado.'}, status=status.HTTP_401_UNAUTHORIZED)
+            if perfil.medico_id:
+                canais.append(canal_consultas_medico(perfil.medico_id))
+            elif perfil.paciente_id:
+                canais.append(canal_consultas_paciente(perfil.paciente_id))
+        if not canais:
+            return JsonResponse({'message': 'Informe ?medico= ou um token.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        response = StreamingHttpResponse(
+            self.stream(canais, reconectando='HTTP_LAST_EVENT_ID' in request.META),
+            content_type='text/event-stream',
+        )
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # nginx: não segurar o stream em buffer
+        return response
+
+    def token_bruto(self, request):
+        cabecalho = request.META.get('HTTP_AUTHORIZATION', '').split()
+        if len(cabecalho) == 2 and cabecalho[0] == 'Bearer':
+            return cabecalho[1]
+        return request.GET.get('token')
+
+    def perfil_do_token(self, bruto):
+        autenticacao = PerfilJWTAuthentication()
+        return perfil_do_usuario(autenticacao.get_user(autenticacao.get_validated_token(bruto)))
+
+    async def stream(self, canais, reconectando):
+        yield f'retry: {self.RETRY_MS}\n\n'
+        if reconectando:
+            # O broker não guarda histórico: quem reconecta pode ter perdido
+            # eventos e deve recarregar o que exibe.
+            yield 'event: recarregar\ndata: {}\n\n'
+        async for evento in escutar(canais, settings.EVENTOS_KEEPALIVE):
+            if evento is None:
+                yield ': ping\n\n'
+                continue
+            linhas = [f'event: {evento["tipo"]}', f'data: {json.dumps(evento["dados"])}']
+            if evento.get('id'):
+                linhas.insert(0, f'id: {evento["id"]}')
+            yield '\n'.join(linhas) + '\n\n'
@@ -65,7 +65,7 @@ def populate():
         time(13, 0), time(14, 0), time(15, 0), time(16, 0), time(17, 0)
     ]
 
-    count_agendas = 0
+    novas_agendas = []
     for medico in medico_objects:
         # Create random slots for each doctor
         # Pick 3-5 random days
@@ -76,14 +76,12 @@ def populate():
             selected_hours = random.sample(hours, k=random.randint(2, 4))
             
             for hora in selected_hours:
-                if not Agenda.objects.filter(medico=medico, dia=day, horario=hora).exists():
-                    Agenda.objects.create(
-                        medico=medico,
-                        dia=day,
-                        horario=hora,
-                        disponivel=True
-                    )
-                    count_agendas += 1
+                novas_agendas.append(Agenda(medico=medico, dia=day, horario=hora, disponivel=True))
+
+    # Single batched insert; slots that already exist (medico, dia, horario) are skipped
+    count_agendas = Agenda.objects.filter(medico__in=medico_objects).count()
+    Agenda.objects.bulk_create(novas_agendas, ignore_conflicts=True)
+    count_agendas = Agenda.objects.filter(medico__in=medico_objects).count() - count_agendas
 
     print(f"\nConcluído! {len(medico_objects)} médicos processados e {count_agendas} novos horários de agenda criados.")
 
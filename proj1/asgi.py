@@ -3,6 +3,10 @@ ASGI config for proj1 project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+O stream de eventos (/api/eventos/) é uma view assíncrona e precisa deste
+ponto de entrada: ``uvicorn proj1.asgi:application`` ou ``daphne
+proj1.asgi:application``. No WSGI cada conexão aberta prenderia um worker.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/6.0/howto/deployment/asgi/
 """
@@ -45,6 +45,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.InstrumentacaoMiddleware',  # primeiro, para medir toda a pilha
+    'core.middleware.ReplicasMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -92,9 +94,55 @@ DATABASES = {
         'PASSWORD': 'postgres',
         'HOST': 'localhost',
         'PORT': '5432',
+        # Conexões persistentes: reaproveitadas entre requisições por até
+        # CONN_MAX_AGE segundos, com checagem antes de reusar.
+        'CONN_MAX_AGE': int(os.environ.get('DATABASE_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Pool do psycopg 3 (Django 5.1+) no lugar das conexões persistentes:
+# DATABASE_POOL=1, com DATABASE_POOL_MIN/DATABASE_POOL_MAX conexões por processo.
+if os.environ.get('DATABASE_POOL') == '1':
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': int(os.environ.get('DATABASE_POOL_MIN', 2)),
+            'max_size': int(os.environ.get('DATABASE_POOL_MAX', 10)),
+        },
+    }
+
+# Réplicas de leitura: DATABASE_REPLICA_HOSTS=host1,host2 (mesmo banco,
+# usuário e senha do primário). Ver core/replicas.py. Exige um cache
+# compartilhado entre os processos (check core.E002).
+DATABASE_REPLICAS = []
+for numero, host in enumerate(filter(None, os.environ.get('DATABASE_REPLICA_HOSTS', '').split(',')), start=1):
+    alias = f'replica{numero}'
+    DATABASES[alias] = {**DATABASES['default'], 'HOST': host.strip(), 'TEST': {'MIRROR': 'default'}}
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['core.replicas.RoteadorReplicas']
+# Depois de uma escrita, as leituras do usuário ficam no primário por este tempo
+REPLICA_FIXACAO_SEGUNDOS = 5
+
+
+# Cache
+# https://docs.djangoproject.com/en/6.0/topics/cache/
+# LocMemCache é por processo: com vários workers use FileBasedCache
+# (DJANGO_CACHE_BACKEND=django.core.cache.backends.filebased.FileBasedCache),
+# Redis ou Memcached, para que a invalidação chegue a todos.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('DJANGO_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('DJANGO_CACHE_LOCATION', 'grumosmed'),
+    }
+}
+
+# Cache versionado das respostas públicas (médicos e agendas), ver core/cache.py
+API_CACHE_ALIAS = 'default'
+API_CACHE_TIMEOUT = 300
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
@@ -135,16 +183,23 @@ STATIC_URL = 'static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Fotos de perfil: limite do upload; as variantes são geradas por `manage.py processar_fotos`
+FOTO_TAMANHO_MAXIMO = 10 * 1024 * 1024
+
 # Django REST Framework
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'core.authentication.PerfilJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated', # Opcional: Tranca tudo por padrão
     ),
 }
 
+# Listagens são paginadas por cursor (core/pagination.py); até esta data
+# clientes antigos ainda recebem o array completo com ?paginar=0
+PAGINACAO_LISTA_SIMPLES_ATE = '2027-01-31'
+
 # Configuração do comportamento do JWT
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60), # O token vale 1 hora
@@ -152,4 +207,69 @@ SIMPLE_JWT = {
     'ROTATE_REFRESH_TOKENS': False,
     'BLACKLIST_AFTER_ROTATION': False,
     'AUTH_HEADER_TYPES': ('Bearer',), # O padrão do header HTTP
-}
\ No newline at end of file
+    # Tipo de usuário e ids do perfil vão no token (ver core/authentication.py)
+    'TOKEN_OBTAIN_SERIALIZER': 'core.serializers.PerfilTokenObtainPairSerializer',
+}
+
+# Usuário + perfil de tokens sem as claims de perfil, e is_active/is_staff
+# dos tokens com claims, ficam em cache por este tempo (segundos).
+# Alterações e desativações invalidam na hora no cache compartilhado; com
+# um cache local do processo, os outros workers só veem no fim do tempo.
+AUTENTICACAO_CACHE_TIMEOUT = 60
+# Fora do DEBUG o check core.E001 exige um cache compartilhado entre os
+# processos em API_CACHE_ALIAS (DJANGO_CACHE_BACKEND com Redis/Memcached)
+CACHE_COMPARTILHADO_OBRIGATORIO = not DEBUG
+
+# Notificações (outbox entregue por `manage.py processar_notificacoes`)
+# Backends: core.notificacoes.ConsoleBackend, ArquivoBackend, EmailBackend
+NOTIFICACOES_BACKEND = 'core.notificacoes.ConsoleBackend'
+NOTIFICACOES_ARQUIVO = os.path.join(BASE_DIR, 'notificacoes.log')
+NOTIFICACOES_MAX_TENTATIVAS = 5
+NOTIFICACOES_ESPERA_BASE = 30  # segundos; dobra a cada falha
+# Segundos que um lote reservado fica com o worker antes de voltar à fila
+NOTIFICACOES_PRAZO_ENTREGA = 300
+
+# Instrumentação por requisição (core/middleware.py): Server-Timing, log e orçamentos
+INSTRUMENTACAO_SERVER_TIMING = True
+INSTRUMENTACAO_MAX_QUERIES = 20
+INSTRUMENTACAO_MAX_MS = 500
+# Orçamentos por prefixo de caminho, ex.: {'/api/consultas/': {'queries': 12, 'ms': 300}}
+INSTRUMENTACAO_ORCAMENTOS = {}
+# Queries acima deste tempo têm o SQL e a origem registrados (na fração amostrada)
+INSTRUMENTACAO_SQL_LENTO_MS = 100
+INSTRUMENTACAO_AMOSTRAGEM_SQL_LENTO = 1.0
+
+# Eventos em tempo real (/api/eventos/, Server-Sent Events; exige servidor ASGI)
+# MemoriaBackend serve um processo só; com vários workers use core.eventos.RedisBackend
+EVENTOS_BACKEND = os.environ.get('EVENTOS_BACKEND', 'core.eventos.MemoriaBackend')
+EVENTOS_REDIS_URL = os.environ.get('EVENTOS_REDIS_URL', 'redis://localhost:6379/0')
+EVENTOS_KEEPALIVE = 15  # segundos entre pings de uma conexão ociosa
+
+# Feed iCalendar da agenda (/api/calendario/<token>.ics)
+CALENDARIO_DURACAO_MINUTOS = 30  # a Agenda guarda só o início do horário
+CALENDARIO_DOMINIO_UID = 'grumosmed'  # sufixo dos UIDs dos eventos
+
+# Logs: uma linha por requisição em INFO (core.requisicoes); orçamento
+# excedido, SQL lento e erros em WARNING ou acima
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'simples': {
+            'format': '{asctime} {levelname} {name} {message}',
+            'style': '{',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'simples',
+        },
+    },
+    'loggers': {
+        'core': {
+            'handlers': ['console'],
+            'level': os.environ.get('DJANGO_LOG_LEVEL', 'WARNING'),
+        },
+    },
+}
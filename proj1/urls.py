@@ -4,7 +4,7 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 from rest_framework.routers import DefaultRouter
-from core.views import MedicoViewSet, ConsultaViewSet, AgendaViewSet, PacienteViewSet, userRegisterView, MedicoRegisterView, MeView, UpdateProfilePhotoView
+from core.views import MedicoViewSet, ConsultaViewSet, AgendaViewSet, PacienteViewSet, HistoricoViewSet, userRegisterView, MedicoRegisterView, MeView, UpdateProfilePhotoView, DisponibilidadeView, EstatisticasView, EventosView, CalendarioView, CalendarioTokenView, ExportacaoView
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
 
@@ -13,6 +13,7 @@ router.register(r'medicos', MedicoViewSet)
 router.register(r'consultas', ConsultaViewSet)
 router.register(r'agendas', AgendaViewSet)  
 router.register(r'pacientes', PacienteViewSet)
+router.register(r'historico', HistoricoViewSet, basename='historico')
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -24,6 +25,12 @@ urlpatterns = [
     path('api/register/medico/', MedicoRegisterView.as_view(), name='register_medico'),
     path('api/me/', MeView.as_view(), name='me'),
     path('api/profile/photo/', UpdateProfilePhotoView.as_view(), name='update_photo'),
+    path('api/disponibilidade/', DisponibilidadeView.as_view(), name='disponibilidade'),
+    path('api/eventos/', EventosView.as_view(), name='eventos'),
+    path('api/estatisticas/', EstatisticasView.as_view(), name='estatisticas'),
+    path('api/exportacao/consultas/', ExportacaoView.as_view(), name='exportacao_consultas'),
+    path('api/calendario/', CalendarioTokenView.as_view(), name='calendario_token'),
+    path('api/calendario/<str:token>.ics', CalendarioView.as_view(), name='calendario'),
 ]
 
 if settings.DEBUG: